@@ -0,0 +1,318 @@
+"""
+Admission control for the chat endpoints.
+
+AdmissionController caps how many upstream (OpenAI) calls a worker runs at
+once. Requests beyond the limit wait in a bounded queue until a slot frees
+up or their deadline passes; once the queue is full they are rejected
+straight away, so callers get a fast 503 instead of timing out. The limit
+adapts to upstream latency: it shrinks while recent calls are slower than
+the long-run baseline and grows back while they are not.
+
+RateLimiter is a per-client token bucket.
+
+Both are per process; with several gunicorn workers the totals are the
+per-worker values times the number of workers.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+
+class Rejected(Exception):
+    """The request was not admitted; retry_after is a hint in seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdaptiveLimit:
+    """
+    Gradient concurrency limit: limit * (long-run latency / recent latency),
+    plus a sqrt(limit) allowance for queueing, smoothed and clamped to
+    [min_limit, max_limit]. The allowance shrinks with the gradient, to
+    nothing at its floor, so sustained slowness can drive the limit down to
+    min_limit.
+    """
+
+    def __init__(self, initial=8, min_limit=2, max_limit=64, smoothing=0.2):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.smoothing = smoothing
+        self._long = None
+        self._short = None
+
+    def update(self, latency):
+        if self._long is None:
+            self._long = self._short = latency
+            return
+        self._short += 0.3 * (latency - self._short)
+        self._long += 0.02 * (latency - self._long)
+        # Let the baseline follow latency down quickly once things recover
+        if self._long > 2 * self._short:
+            self._long = 2 * self._short
+
+        gradient = max(0.5, min(1.0, self._long / self._short))
+        target = self.limit * gradient + math.sqrt(self.limit) * (2 * gradient - 1)
+        limit = self.limit + self.smoothing * (target - self.limit)
+        self.limit = max(self.min_limit, min(self.max_limit, limit))
+
+    @property
+    def current(self):
+        return int(self.limit)
+
+    @property
+    def latency(self):
+        """Recent (smoothed) latency in seconds, None before the first sample"""
+        return self._short
+
+
+class Lease:
+    """
+    An admitted slot; the first release() frees it and reports how long it
+    was held, unless record is false: work that did not complete an upstream
+    call says nothing about upstream latency
+    """
+
+    def __init__(self, release_fn):
+        self._release_fn = release_fn
+        self._started = time.perf_counter()
+        self._released = False
+
+    def _held(self, record):
+        return time.perf_counter() - self._started if record else None
+
+    def release(self, record=True):
+        if not self._released:
+            self._released = True
+            self._release_fn(self._held(record))
+
+
+class AsyncLease(Lease):
+    async def release(self, record=True):
+        if not self._released:
+            self._released = True
+            await self._release_fn(self._held(record))
+
+
+class _ControllerBase:
+    def __init__(self, limit=8, min_limit=2, max_limit=64, queue_size=32, queue_timeout=10.0,
+                 counter=None, gauge=None):
+        self.limit = AdaptiveLimit(limit, min_limit, max_limit)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.counter = counter
+        self.gauge = gauge
+        self.in_flight = 0
+        self.waiting = 0
+
+    def _count(self, result):
+        if self.counter is not None:
+            self.counter.labels(result).inc()
+
+    def publish(self):
+        """Report the current limit to the gauge; call once per worker process"""
+        if self.gauge is not None:
+            self.gauge.set(self.limit.current)
+
+    def _retry_after(self):
+        """Rough time for the queue ahead to drain, in whole seconds"""
+        latency = self.limit.latency or 1.0
+        return max(1, math.ceil(latency * (self.waiting + 1) / max(1, self.limit.current)))
+
+    def _full(self):
+        self._count("rejected")
+        return Rejected("queue full", self._retry_after())
+
+    def _expired(self):
+        self._count("timed_out")
+        return Rejected("queue timeout", self._retry_after())
+
+    def _released(self, latency):
+        self.in_flight -= 1
+        if latency is not None:
+            self.limit.update(latency)
+            self.publish()
+
+    def stats(self):
+        return {
+            "limit": self.limit.current,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "queue_size": self.queue_size
+        }
+
+
+class AdmissionController(_ControllerBase):
+    """Thread-based controller for the WSGI app"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Take a slot, waiting up to queue_timeout; raises Rejected"""
+        with self._condition:
+            if self.in_flight < self.limit.current and not self.waiting:
+                self.in_flight += 1
+                self._count("admitted")
+                return
+            if self.waiting >= self.queue_size:
+                raise self._full()
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.in_flight >= self.limit.current:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._expired()
+                    self._condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            self._count("queued")
+
+    def release(self, latency=None):
+        """Free a slot; latency (seconds) of the admitted work feeds the limit"""
+        with self._condition:
+            self._released(latency)
+            self._condition.notify_all()
+
+    def lease(self):
+        """acquire() and return a Lease whose release() may be called more than once"""
+        self.acquire()
+        return Lease(self.release)
+
+    @contextmanager
+    def slot(self):
+        """Hold a lease for the block; its time feeds the limit only if the block completes"""
+        lease = self.lease()
+        try:
+            yield lease
+        except BaseException:
+            lease.release(record=False)
+            raise
+        lease.release()
+
+
+class AsyncAdmissionController(_ControllerBase):
+    """asyncio controller for the ASGI app; use from a single event loop"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._condition = None
+
+    def _get_condition(self):
+        # Created lazily so it binds to the serving loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self):
+        condition = self._get_condition()
+        async with condition:
+            if self.in_flight < self.limit.current and not self.waiting:
+                self.in_flight += 1
+                self._count("admitted")
+                return
+            if self.waiting >= self.queue_size:
+                raise self._full()
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(
+                    condition.wait_for(lambda: self.in_flight < self.limit.current),
+                    self.queue_timeout
+                )
+            except asyncio.TimeoutError:
+                raise self._expired() from None
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            self._count("queued")
+
+    async def release(self, latency=None):
+        condition = self._get_condition()
+        async with condition:
+            self._released(latency)
+            condition.notify_all()
+
+    async def lease(self):
+        await self.acquire()
+        return AsyncLease(self.release)
+
+    @asynccontextmanager
+    async def slot(self):
+        lease = await self.lease()
+        try:
+            yield lease
+        except BaseException:
+            await lease.release(record=False)
+            raise
+        await lease.release()
+
+
+class LeasedBody:
+    """
+    Async response body that releases a lease once it is exhausted or
+    closed, including when it is closed before the first chunk was sent
+    """
+
+    def __init__(self, body, lease):
+        self._body = body
+        self._lease = lease
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._body.__anext__()
+        except StopAsyncIteration:
+            await self._lease.release()
+            raise
+
+    async def aclose(self):
+        try:
+            await self._body.aclose()
+        finally:
+            await self._lease.release()
+
+
+class RateLimiter:
+    """
+    Token bucket per client key: `rate` tokens per second up to `burst`.
+    Buckets of the least recently seen clients are dropped beyond
+    max_clients.
+    """
+
+    def __init__(self, rate=0.5, burst=10, max_clients=10000, counter=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.counter = counter
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        """Spend a token for key; raises Rejected when the bucket is empty"""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                if self.counter is not None:
+                    self.counter.labels("rate_limited").inc()
+                raise Rejected("rate limited", max(1, math.ceil((1 - tokens) / self.rate)))
+            self._buckets[key] = (tokens - 1, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
@@ -0,0 +1,264 @@
+"""
+Inverted-file (IVF) approximate nearest-neighbour index over chunk
+embeddings.
+
+Training clusters the embeddings into nlist cells with spherical k-means.
+The vectors are then stored grouped by cell, so a query only scores the
+nprobe cells whose centroids are closest to it. nlist and nprobe trade
+recall against latency. New vectors are assigned to the existing centroids
+without retraining, so ingesting a few PDFs is cheap.
+
+The layout is persisted next to the dense index as ivf_*.npy files, which
+are memory-mapped at load time like the rest of the index.
+
+Benchmark recall@k and QPS against exact search from the backend directory:
+    python ann_index.py build --index dense_index --nlist 128
+    python ann_index.py bench --index dense_index --nprobe 1 2 4 8 16 32
+"""
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Retrain once this fraction of the vectors was inserted after training
+RETRAIN_RATIO = 0.5
+
+
+def assign(vectors, centroids, block_rows=65536):
+    """Index of the closest centroid (by inner product) for every row"""
+    cells = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+        cells[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return cells
+
+
+def train_centroids(vectors, nlist, iterations=20, sample_size=65536, seed=0):
+    """Spherical k-means on (a sample of) L2-normalised vectors"""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    nlist = max(1, min(nlist, n))
+    sample = np.asarray(vectors[np.sort(rng.choice(n, min(n, sample_size), replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        cells = assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, cells, sample)
+        counts = np.bincount(cells, minlength=nlist)
+        empty = counts == 0
+        # Re-seed empty cells with random points so every cell stays in use
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+    return centroids
+
+
+def exact_search(vectors, query_vectors, k):
+    """Brute-force (ids, scores) of shape (queries, k), the recall baseline"""
+    scores = np.asarray(query_vectors, dtype=np.float32) @ np.asarray(vectors, dtype=np.float32).T
+    k = min(k, scores.shape[1])
+    ids = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, ids, axis=1), axis=1)
+    ids = np.take_along_axis(ids, order, axis=1)
+    return ids, np.take_along_axis(scores, ids, axis=1)
+
+
+class IVFIndex:
+    """
+    Cell centroids plus the vectors and chunk IDs of every cell, stored
+    contiguously in cell order (cell i spans offsets[i]:offsets[i + 1]).
+    """
+
+    def __init__(self, centroids, offsets, ids, vectors, trained_on, inserted=0):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+        self.trained_on = trained_on
+        self.inserted = inserted
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def _from_cells(cls, centroids, cells, ids, vectors, trained_on, inserted=0):
+        order = np.argsort(cells, kind="stable")
+        counts = np.bincount(cells, minlength=len(centroids))
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(
+            centroids.astype(np.float32),
+            offsets,
+            np.asarray(ids, dtype=np.uint32)[order],
+            np.asarray(vectors)[order],
+            trained_on,
+            inserted
+        )
+
+    @classmethod
+    def train(cls, vectors, nlist=None, iterations=20, seed=0):
+        """Cluster vectors (chunk i is row i) into nlist cells, sqrt(n) by default"""
+        vectors = np.asarray(vectors)
+        nlist = nlist or max(1, int(np.sqrt(len(vectors))))
+        centroids = train_centroids(vectors, nlist, iterations=iterations, seed=seed)
+        cells = assign(vectors, centroids)
+        return cls._from_cells(centroids, cells, np.arange(len(vectors)), vectors, len(vectors))
+
+    def add(self, vectors, ids):
+        """Return a new index with vectors inserted into their closest cells"""
+        vectors = np.asarray(vectors, dtype=self.vectors.dtype)
+        old_cells = np.repeat(np.arange(self.nlist, dtype=np.int32), np.diff(self.offsets))
+        new_cells = assign(vectors, self.centroids)
+        index = IVFIndex._from_cells(
+            self.centroids,
+            np.concatenate([old_cells, new_cells]),
+            np.concatenate([np.asarray(self.ids), np.asarray(ids, dtype=np.uint32)]),
+            np.concatenate([np.asarray(self.vectors), vectors]),
+            self.trained_on,
+            self.inserted + len(vectors)
+        )
+        if index.needs_retraining:
+            logger.warning(
+                "%d of %d vectors were added after IVF training; rebuild the index to keep recall up",
+                index.inserted, len(index)
+            )
+        return index
+
+    @property
+    def needs_retraining(self):
+        return self.inserted > RETRAIN_RATIO * max(1, self.trained_on)
+
+    def search(self, query_vectors, k=5, nprobe=8):
+        """(ids, scores) of shape (queries, k), scanning the nprobe closest cells"""
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        nprobe = max(1, min(nprobe, self.nlist))
+        probes = np.argpartition(-(query_vectors @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        ids = np.zeros((len(query_vectors), k), dtype=np.int64)
+        scores = np.full((len(query_vectors), k), -np.inf, dtype=np.float32)
+        for row, (query, cells) in enumerate(zip(query_vectors, probes)):
+            spans = [(int(self.offsets[c]), int(self.offsets[c + 1])) for c in cells]
+            candidates = np.concatenate([self.ids[a:b] for a, b in spans])
+            if not len(candidates):
+                continue
+            candidate_vectors = np.concatenate([self.vectors[a:b] for a, b in spans])
+            candidate_scores = candidate_vectors.astype(np.float32, copy=False) @ query
+            n = min(k, len(candidates))
+            top = np.argpartition(-candidate_scores, n - 1)[:n]
+            top = top[np.argsort(-candidate_scores[top])]
+            ids[row, :n] = candidates[top]
+            scores[row, :n] = candidate_scores[top]
+        return ids, scores
+
+    def save(self, directory):
+        directory = Path(directory)
+        np.save(directory / "ivf_centroids.npy", self.centroids)
+        np.save(directory / "ivf_offsets.npy", self.offsets)
+        np.save(directory / "ivf_ids.npy", np.asarray(self.ids))
+        np.save(directory / "ivf_vectors.npy", np.asarray(self.vectors))
+        with open(directory / "ivf.json", "w", encoding="utf-8") as f:
+            json.dump({"nlist": self.nlist, "trained_on": self.trained_on, "inserted": self.inserted}, f)
+
+    @classmethod
+    def load(cls, directory):
+        directory = Path(directory)
+        with open(directory / "ivf.json", encoding="utf-8") as f:
+            info = json.load(f)
+        return cls(
+            np.load(directory / "ivf_centroids.npy"),
+            np.load(directory / "ivf_offsets.npy"),
+            np.load(directory / "ivf_ids.npy", mmap_mode="r"),
+            np.load(directory / "ivf_vectors.npy", mmap_mode="r"),
+            info["trained_on"],
+            info["inserted"]
+        )
+
+    @staticmethod
+    def exists(directory):
+        return (Path(directory) / "ivf.json").exists()
+
+
+def build_ivf(directory, nlist=None, iterations=20):
+    """Train an IVF layout for the dense index in directory and save it there"""
+    started = time.perf_counter()
+    vectors = np.load(Path(directory) / "embeddings.npy", mmap_mode="r")
+    index = IVFIndex.train(vectors, nlist=nlist, iterations=iterations)
+    index.save(directory)
+    logger.info(
+        "Built IVF index: %d vectors in %d cells in %.1fs",
+        len(index), index.nlist, time.perf_counter() - started
+    )
+    return index
+
+
+def benchmark(directory, nprobes=(1, 2, 4, 8, 16, 32), k=10, queries=200, seed=0):
+    """
+    Recall@k and queries per second of IVF search at each nprobe, against
+    exact search. Queries are perturbed copies of random chunk embeddings.
+    """
+    vectors = np.load(Path(directory) / "embeddings.npy", mmap_mode="r")
+    ivf = IVFIndex.load(directory)
+    rng = np.random.default_rng(seed)
+
+    sample = np.asarray(vectors[rng.choice(len(vectors), min(queries, len(vectors)), replace=False)], dtype=np.float32)
+    query_vectors = sample + rng.normal(scale=0.5 / np.sqrt(sample.shape[1]), size=sample.shape).astype(np.float32)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+
+    started = time.perf_counter()
+    exact_ids = np.concatenate([exact_search(vectors, q[None, :], k)[0] for q in query_vectors])
+    exact_seconds = time.perf_counter() - started
+
+    results = {
+        "vectors": len(vectors),
+        "nlist": ivf.nlist,
+        "k": k,
+        "queries": len(query_vectors),
+        "exact": {"recall": 1.0, "qps": round(len(query_vectors) / exact_seconds, 1)},
+        "ivf": []
+    }
+    for nprobe in nprobes:
+        started = time.perf_counter()
+        ann_ids = np.concatenate([ivf.search(q[None, :], k, nprobe)[0] for q in query_vectors])
+        seconds = time.perf_counter() - started
+        recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(ann_ids, exact_ids)])
+        results["ivf"].append({
+            "nprobe": nprobe,
+            "recall": round(float(recall), 4),
+            "qps": round(len(query_vectors) / seconds, 1)
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or benchmark the IVF index of a dense index")
+    parser.add_argument("--index", default="dense_index", help="dense index directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build")
+    build.add_argument("--nlist", type=int, default=None, help="number of cells (default sqrt(chunks))")
+    build.add_argument("--iterations", type=int, default=20)
+    bench = commands.add_parser("bench")
+    bench.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    bench.add_argument("-k", type=int, default=10)
+    bench.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "build":
+        build_ivf(args.index, args.nlist, args.iterations)
+    else:
+        print(json.dumps(benchmark(args.index, args.nprobe, args.k, args.queries), indent=2))
+
+
+if __name__ == "__main__":
+    main()
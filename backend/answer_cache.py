@@ -0,0 +1,85 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(text):
+    """Lower-case, collapse whitespace and drop trailing punctuation"""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(" ?!.")
+
+
+def answer_key(question, model, instructions, vector_store_id):
+    """Cache key for a question under a given model/prompt/knowledge base"""
+    parts = [normalize_question(question), model, instructions, vector_store_id]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    Bounded LRU cache of (reply, citations) with a per-entry TTL.
+
+    version_fn returns a fingerprint of the knowledge base; whenever it
+    changes the whole cache is dropped so answers never outlive the
+    vector store contents they were generated from. counter is an optional
+    Prometheus counter labelled by result (hit/miss).
+    """
+
+    def __init__(self, max_size=512, ttl=86400, version_fn=None, counter=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version_fn = version_fn
+        self.counter = counter
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self):
+        if self.version_fn is None:
+            return
+        version = self.version_fn()
+        if version != self._version:
+            if self._entries:
+                logger.info("Knowledge base changed, dropping %d cached answers", len(self._entries))
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key):
+        """Return the cached (reply, citations) or None"""
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                if self.counter is not None:
+                    self.counter.labels("miss").inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if self.counter is not None:
+                self.counter.labels("hit").inc()
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._check_version()
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
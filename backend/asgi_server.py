@@ -0,0 +1,652 @@
+"""
+Asyncio-native version of server.py for ASGI servers.
+
+Serves the same endpoints (/chat, /chat/stream, /flag, /flags) with
+AsyncOpenAI and a pooled keep-alive httpx client for Supabase, so a single
+worker can hold many concurrent conversations while waiting on upstreams.
+
+Run with:
+    uvicorn asgi_server:app --host 0.0.0.0 --port 10000
+or under gunicorn:
+    gunicorn asgi_server:app -k uvicorn.workers.UvicornWorker -c gunicorn.conf.py
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+import uuid
+
+import httpx
+import openai
+from openai import AsyncOpenAI, OpenAI
+from quart import Quart, Response, g, jsonify, request
+from quart_cors import cors
+
+# Configure logging before the other backend modules start logging
+from logging_setup import request_id_var, setup_logging
+setup_logging()
+
+from admission import AsyncAdmissionController, LeasedBody, Rejected
+from chat_common import (
+    CORS_ORIGINS, FAQ_PATH, FAQ_THRESHOLD, FLAGS_MAX_PAGE_SIZE, LOCAL_TOP_K, MODEL, PREWARM_CONCURRENCY,
+    QUERY_ROUTING, SINGLEFLIGHT_TIMEOUT, SUPABASE_URL, VECTOR_STORE_ID,
+    admission_settings, answer_cache_for, build_citation, cache_key, cached_answer, chat_body, chat_message,
+    client_key, client_rate_limiter, collect_file_citations, flag_outbox, flag_payload, flags_page,
+    flags_page_cache, flags_page_headers, flags_page_params, knowledge_base_version, load_local_index,
+    local_citations, ndjson_lines, next_cursor, parse_page_size, prewarm_questions, rejection_response,
+    replay_answer, response_params, server_error_response, session_exhausted_response, session_store,
+    sse_event, stats_body, stream_error_event, supabase_headers, turn_args, upstream_error_response,
+    upstream_policies, wants_ndjson, wants_session, warmup_result
+)
+from citation_cache import CitationMetadataCache
+from faq import load_faq
+from metrics import (
+    COALESCED, FAQ_LOOKUPS, IN_FLIGHT, REQUEST_SECONDS, ROUTED_QUERIES, STAGE_SECONDS,
+    TIME_TO_FIRST_TOKEN_SECONDS, UPSTREAM_ERRORS, record_usage, render
+)
+from routing import QueryRouter
+from sessions import SessionBudgetExceeded
+from singleflight import AsyncSingleFlight
+
+
+logger = logging.getLogger(__name__)
+
+
+def origin_patterns(origins):
+    """quart-cors matches wildcard origins only as compiled regexes"""
+    patterns = []
+    for origin in origins:
+        origin = origin.rstrip("/")
+        if "*" in origin:
+            patterns.append(re.compile(re.escape(origin).replace(r"\*", r"[^/]+")))
+        else:
+            patterns.append(origin)
+    return patterns
+
+
+app = Quart(__name__)
+app = cors(
+    app,
+    allow_origin=origin_patterns(CORS_ORIGINS),
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type", "If-None-Match", "X-Request-ID"],
+    expose_headers=["ETag", "Link", "X-Next-Cursor", "X-Request-ID"]
+)
+
+@app.before_request
+async def start_request_timer():
+    request_id_var.set(request.headers.get("X-Request-ID") or uuid.uuid4().hex)
+    g.request_started = time.perf_counter()
+    g.endpoint_label = request.url_rule.rule if request.url_rule else "unmatched"
+    IN_FLIGHT.labels(g.endpoint_label).inc()
+
+
+@app.after_request
+async def record_status(response):
+    g.response_status = response.status_code
+    response.headers["X-Request-ID"] = request_id_var.get()
+    return response
+
+
+@app.teardown_request
+async def observe_request(exc):
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    request_id_var.set(None)
+    IN_FLIGHT.labels(g.endpoint_label).dec()
+    status = g.get("response_status", 500)
+    REQUEST_SECONDS.labels(g.endpoint_label, str(status)).observe(time.perf_counter() - started)
+
+
+# Set up OpenAI clients using the key from environment
+api_key = os.getenv("OPENAI_API_KEY")
+if not api_key:
+    raise ValueError("No API key found. Please check your .env file")
+else:
+    logger.info("API key loaded")
+
+# AsyncOpenAI keeps a pooled keep-alive connection set for the event loop.
+# Retries are done by openai_policy and vector_store_policy instead of the SDK
+async_client = AsyncOpenAI(api_key=api_key, max_retries=0)
+
+# Deadline, retries, circuit breaker and optional hedging for upstream calls
+openai_policy, vector_store_policy = upstream_policies()
+
+def openai_client():
+    # Sync client for background threads; retries are done by the policies
+    return OpenAI(api_key=api_key, max_retries=0)
+
+# The snapshot is (re)loaded on a background thread, so it uses a sync client
+citation_cache = CitationMetadataCache(
+    openai_client(),
+    VECTOR_STORE_ID,
+    ttl=int(os.getenv("CITATION_CACHE_TTL", "3600")),
+    policy=vector_store_policy
+)
+
+# Optional local retrieval in place of the hosted file_search tool
+local_index = load_local_index(citation_cache.client)
+if local_index is None:
+    # At import, so a preloading gunicorn master shares it with its workers
+    try:
+        citation_cache.load()
+    except Exception as e:
+        logger.warning("Error loading citation metadata snapshot: %s", e)
+
+# Narrow file_search to the question's categories, minus superseded documents
+router = QueryRouter(citation_cache.snapshot, counter=ROUTED_QUERIES) if QUERY_ROUTING else None
+
+# Curated answers to common questions, served without calling the model
+faq = load_faq(FAQ_PATH, threshold=FAQ_THRESHOLD, counter=FAQ_LOOKUPS)
+
+# Answers to repeated questions, dropped whenever the knowledge base changes
+answer_cache = answer_cache_for(lambda: knowledge_base_version(local_index, citation_cache))
+
+# Flags are appended to a local outbox and flushed to Supabase in batches
+flag_queue = flag_outbox()
+
+# Short-lived page cache for reading flags back
+flags_cache = flags_page_cache()
+
+# SQLite-backed, so only touched from worker threads (asyncio.to_thread)
+sessions = session_store()
+
+# Identical questions in flight at the same time share one upstream call
+inflight = AsyncSingleFlight(timeout=SINGLEFLIGHT_TIMEOUT, counter=COALESCED)
+
+admission = AsyncAdmissionController(**admission_settings())
+rate_limiter = client_rate_limiter()
+
+# Created per event loop in before_serving
+supabase = None
+
+# Set once this worker has warmed up; /ready reports 503 until then
+ready = False
+warmup_report = {}
+
+
+async def warm_up():
+    """Open upstream connections, touch the index and make sure the snapshot is loaded"""
+    global ready
+    started = time.perf_counter()
+    checks = {
+        "openai": lambda: async_client.models.retrieve(MODEL, timeout=10),
+        "supabase": lambda: supabase.get("/rest/v1/flags", params={"select": "id", "limit": 1}),
+    }
+    if local_index is not None:
+        checks["index"] = lambda: asyncio.to_thread(local_index.search, "hearing", 1)
+    for name, check in checks.items():
+        try:
+            await check()
+            warmup_report[name] = warmup_result()
+        except Exception as e:
+            warmup_report[name] = warmup_result(e)
+            if not isinstance(e, openai.APIStatusError):
+                logger.warning("Warm-up of %s failed: %s", name, e)
+
+    # Not ready without the citation snapshot (loaded at import unless it failed)
+    delay = 1
+    while local_index is None and citation_cache.fingerprint is None:
+        try:
+            await asyncio.to_thread(citation_cache.load)
+        except Exception as e:
+            logger.warning("Error loading citation metadata snapshot, retrying in %ds: %s", delay, e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    warmup_report["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info("Worker warmed up", extra={"warmup": warmup_report})
+    ready = True
+
+
+@app.before_serving
+async def startup():
+    global supabase
+    # A fresh sync client per worker, so no connection is shared across a fork
+    sync_client = openai_client()
+    citation_cache.client = sync_client
+    if getattr(getattr(local_index, "embedder", None), "client", None) is not None:
+        local_index.embedder.client = sync_client.with_options(max_retries=2)
+    admission.publish()
+
+    supabase = httpx.AsyncClient(
+        base_url=SUPABASE_URL,
+        headers=supabase_headers(),
+        timeout=httpx.Timeout(10.0),
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("SUPABASE_MAX_CONNECTIONS", "50")),
+            max_keepalive_connections=int(os.getenv("SUPABASE_MAX_KEEPALIVE", "20"))
+        )
+    )
+
+    flag_queue.start()
+    app.add_background_task(warm_up)
+
+    frequent_questions = prewarm_questions()
+    if frequent_questions:
+        app.add_background_task(prewarm_answer_cache, frequent_questions)
+
+
+@app.after_serving
+async def shutdown():
+    flag_queue.stop()
+    await supabase.aclose()
+    await async_client.close()
+
+
+async def extract_reply(response, hits=None):
+    """
+    Return the reply text and resolved citations of a completed response.
+    hits are the locally retrieved chunks the answer was based on, if any.
+    """
+    reply, annotations = collect_file_citations(response)
+    if hits is not None:
+        return reply, local_citations(hits)
+    with STAGE_SECONDS.labels("chat", "citations").time():
+        attributes = await citation_cache.aget_many((a.file_id for a in annotations), async_client)
+    citations = [build_citation(a, attributes.get(a.file_id)) for a in annotations]
+    return reply, citations
+
+
+async def call_openai(params):
+    """Responses API call with latency, error and usage metrics"""
+    try:
+        with STAGE_SECONDS.labels("chat", "openai").time():
+            response = await openai_policy.acall(
+                lambda timeout: async_client.responses.create(timeout=timeout, **params)
+            )
+    except Exception:
+        UPSTREAM_ERRORS.labels("openai", "responses.create").inc()
+        raise
+    record_usage(response)
+    return response
+
+
+async def chat_params(user_message, session=None):
+    """
+    response_params() for the next turn, and the locally retrieved chunks it
+    includes (None when the hosted file_search tool does the retrieval)
+    """
+    args = turn_args(sessions, session, user_message)
+    hits = None
+    if local_index is not None:
+        with STAGE_SECONDS.labels("chat", "retrieval").time():
+            # Off the event loop: the dense index may call the embeddings API
+            hits = await asyncio.to_thread(local_index.search, user_message, LOCAL_TOP_K)
+        args["context"] = hits
+    elif router is not None:
+        args["filters"] = router.filters(user_message)
+    return response_params(**args), hits
+
+
+async def answer(user_message, key):
+    """Call OpenAI for a single answer and cache it"""
+    params, hits = await chat_params(user_message)
+    response = await call_openai(params)
+    reply, citations = await extract_reply(response, hits)
+    if reply:
+        answer_cache.set(key, (reply, citations))
+    return reply, citations
+
+
+async def admitted_answer(user_message, key):
+    """
+    answer() under an admission slot; run by the single-flight leader only,
+    so coalesced requests never take a slot of their own
+    """
+    async with admission.slot() as lease:
+        # Another request may have answered it while this one was queued
+        cached = answer_cache.get(key)
+        if cached is not None:
+            await lease.release(record=False)
+            return cached
+        return await answer(user_message, key)
+
+
+async def answer_in_session(session, user_message):
+    """Answer the next turn of a conversation and record it in the session"""
+    params, hits = await chat_params(user_message, session)
+    response = await call_openai(params)
+    reply, citations = await extract_reply(response, hits)
+    await asyncio.to_thread(sessions.record_turn, session, user_message, reply, response)
+    return reply, citations
+
+
+async def session_for(data):
+    """The conversation session a /chat request belongs to, if it asked for one"""
+    if not wants_session(data):
+        return None
+    return await asyncio.to_thread(sessions.get_or_create, data.get('session_id'))
+
+
+def shed(rejection):
+    body, status, headers = rejection_response(rejection)
+    logger.warning("Request not admitted: %s", rejection.reason)
+    return jsonify(body), status, headers
+
+
+async def prewarm_answer_cache(questions):
+    """
+    Answer each known frequent question once so later requests hit the
+    cache, PREWARM_CONCURRENCY at a time
+    """
+    semaphore = asyncio.Semaphore(PREWARM_CONCURRENCY)
+
+    async def warm(question):
+        key = cache_key(question)
+        if answer_cache.get(key) is not None:
+            return 0
+        try:
+            async with semaphore:
+                reply, citations = await inflight.do(key, lambda: answer(question, key))
+            if reply:
+                return 1
+        except Exception as e:
+            logger.warning("Error pre-warming answer: %s", e, extra={"user_message": question})
+        return 0
+
+    warmed = sum(await asyncio.gather(*(warm(q) for q in questions)))
+    logger.info("Answer cache pre-warmed with %d answers", warmed)
+    return warmed
+
+
+async def stream_chat(user_message, session=None):
+    """
+    Forward output-text deltas as SSE 'delta' events, then send the full
+    reply with its resolved citations as a final 'citations' event
+    """
+    if session is None:
+        key, cached = cached_answer(faq, answer_cache, user_message)
+        final = {}
+    else:
+        # Session turns depend on earlier turns, so they are never cached or coalesced
+        key = None
+        cached = None
+        final = {"session_id": session["id"]}
+    lease = None
+    params, hits = None, None
+    # A question already in flight is answered by its leader, which holds
+    # the slot; only the requests that will call OpenAI are admitted
+    if cached is None and (key is None or not inflight.pending(key)):
+        # Raises Rejected or SessionBudgetExceeded before the stream starts
+        lease = await admission.lease()
+        try:
+            params, hits = await chat_params(user_message, session)
+        except BaseException:
+            await lease.release(record=False)
+            raise
+    started = time.perf_counter()
+
+    async def generate():
+        if cached is not None:
+            for message in replay_answer(*cached):
+                yield message
+            return
+
+        future = None
+        if key is not None:
+            future, leader = inflight.begin(key)
+            if not leader:
+                # Same question already in flight: wait for its complete answer,
+                # giving back the slot admitted for a call this request will not make
+                if lease is not None:
+                    await lease.release(record=False)
+                try:
+                    reply, citations = await inflight.wait(future)
+                except Exception as e:
+                    logger.error("OpenAI API Error: %s", e)
+                    yield stream_error_event(e)
+                    return
+                for message in replay_answer(reply, citations):
+                    yield message
+                return
+            if params is None:
+                # The call this request meant to join ended just before it could;
+                # share its outcome through the cache rather than calling again
+                answered = answer_cache.get(key)
+                if answered is None:
+                    error = RuntimeError("Coalesced request failed")
+                    inflight.finish(key, future, error=error)
+                    yield stream_error_event(error)
+                    return
+                inflight.finish(key, future, result=answered)
+                for message in replay_answer(*answered):
+                    yield message
+                return
+
+        result = None
+        error = None
+        first_token = True
+        try:
+            stream = await openai_policy.acall(
+                lambda timeout: async_client.responses.create(stream=True, timeout=timeout, **params),
+                hedge=False
+            )
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    if first_token:
+                        TIME_TO_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started)
+                        first_token = False
+                    yield sse_event("delta", {"text": event.delta})
+                elif event.type == "response.completed":
+                    STAGE_SECONDS.labels("chat", "openai").observe(time.perf_counter() - started)
+                    record_usage(event.response)
+                    reply, citations = await extract_reply(event.response, hits)
+                    if session is not None:
+                        await asyncio.to_thread(sessions.record_turn, session, user_message, reply, event.response)
+                    elif reply:
+                        answer_cache.set(key, (reply, citations))
+                    result = (reply, citations)
+                    yield sse_event("citations", dict(final, response=reply, citations=citations))
+                elif event.type in ("response.failed", "error"):
+                    logger.error("OpenAI stream error: %s", event.type)
+                    UPSTREAM_ERRORS.labels("openai", "responses.stream").inc()
+                    error = RuntimeError("OpenAI API Error")
+                    yield stream_error_event(error)
+                    return
+        except Exception as e:
+            logger.error("OpenAI API Error: %s", e)
+            UPSTREAM_ERRORS.labels("openai", "responses.stream").inc()
+            error = e
+            yield stream_error_event(e)
+            return
+        finally:
+            # Also runs when the client disconnects mid-stream
+            if future is not None:
+                if result is None and error is None:
+                    error = RuntimeError("Stream ended before the answer completed")
+                inflight.finish(key, future, result=result, error=error)
+            if result is None and lease is not None:
+                # Only a completed answer says how fast upstream is
+                await lease.release(record=False)
+        yield sse_event("done", {})
+
+    # A leased body holds the slot until the stream is closed, however it ends
+    body = generate() if lease is None else LeasedBody(generate(), lease)
+    response = Response(body, mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.timeout = None
+    return response
+
+
+@app.route('/chat', methods=['POST'])
+async def chat():
+    session = None
+    try:
+        data = await request.get_json()
+        user_message = chat_message(data)
+
+        if not user_message:
+            return jsonify({'response': 'No message received'}), 400
+
+        logger.info("Received message", extra={"user_message": user_message})
+        rate_limiter.check(client_key(request.headers, request.remote_addr))
+        session = await session_for(data)
+
+        if request.accept_mimetypes.best == "text/event-stream":
+            return await stream_chat(user_message, session)
+
+        cached = None
+        if session is None:
+            key, cached = cached_answer(faq, answer_cache, user_message)
+
+        if cached is not None:
+            reply, citations = cached
+        else:
+            try:
+                if session is not None:
+                    async with admission.slot():
+                        reply, citations = await answer_in_session(session, user_message)
+                else:
+                    reply, citations = await inflight.do(key, lambda: admitted_answer(user_message, key))
+            except (Rejected, SessionBudgetExceeded):
+                raise
+            except Exception as openai_error:
+                logger.error("OpenAI API Error: %s", openai_error)
+                body, status, headers = upstream_error_response(openai_error)
+                return jsonify(body), status, headers
+
+        with STAGE_SECONDS.labels("chat", "serialize").time():
+            return jsonify(chat_body(reply, citations, session))
+
+    except Rejected as rejection:
+        return shed(rejection)
+
+    except SessionBudgetExceeded:
+        body, status = session_exhausted_response(session)
+        return jsonify(body), status
+
+    except Exception as e:
+        logger.exception("Error handling chat request")
+        body, status = server_error_response(e)
+        return jsonify(body), status
+
+
+@app.route('/chat/stream', methods=['POST'])
+async def chat_stream():
+    session = None
+    try:
+        data = await request.get_json()
+        user_message = chat_message(data)
+
+        if not user_message:
+            return jsonify({'response': 'No message received'}), 400
+
+        logger.info("Received message (stream)", extra={"user_message": user_message})
+        rate_limiter.check(client_key(request.headers, request.remote_addr))
+        session = await session_for(data)
+        return await stream_chat(user_message, session)
+
+    except Rejected as rejection:
+        return shed(rejection)
+
+    except SessionBudgetExceeded:
+        body, status = session_exhausted_response(session)
+        return jsonify(body), status
+
+    except Exception as e:
+        logger.exception("Error handling chat stream request")
+        body, status = server_error_response(e)
+        return jsonify(body), status
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    body, content_type = render()
+    return Response(body, mimetype=content_type)
+
+
+@app.route('/stats', methods=['GET'])
+async def stats():
+    return jsonify(stats_body(admission, openai_policy, vector_store_policy, inflight, answer_cache))
+
+
+@app.route('/ready', methods=['GET'])
+async def readiness():
+    return jsonify({"ready": ready, "warmup": warmup_report}), 200 if ready else 503
+
+
+@app.route('/flag', methods=['POST'])
+async def flag_message():
+    try:
+        data = await request.get_json()
+        try:
+            payload = flag_payload(data)
+        except ValueError as e:
+            return jsonify({"message": f"Invalid flag: {e}"}), 400
+        logger.info("Flagged response", extra=payload)
+
+        # Queue locally; the flusher thread batch-inserts into Supabase
+        with STAGE_SECONDS.labels("flag", "enqueue").time():
+            # A SQLite write, so off the event loop
+            key = await asyncio.to_thread(flag_queue.enqueue, payload)
+        return jsonify({"message": "Flag queued", "id": key}), 202
+
+    except Exception as e:
+        logger.exception("Error queueing flag")
+        return jsonify({"message": "Internal error storing flag"}), 500
+
+
+async def fetch_flags_page(limit, cursor=None):
+    return await supabase.get("/rest/v1/flags", params=flags_page_params(limit, cursor))
+
+
+async def export_flags():
+    """Yield every flag as one NDJSON line, a page at a time"""
+    cursor = None
+    while True:
+        response = await fetch_flags_page(FLAGS_MAX_PAGE_SIZE, cursor)
+        if response.status_code != 200:
+            logger.error("Error exporting flags from Supabase: %s %s", response.status_code, response.text)
+            return
+        rows = response.json()
+        for line in ndjson_lines(rows):
+            yield line
+        cursor = next_cursor(rows, FLAGS_MAX_PAGE_SIZE)
+        if cursor is None:
+            return
+
+
+@app.route('/flags', methods=['GET'])
+async def list_flags():
+    try:
+        if wants_ndjson(request):
+            response = Response(export_flags(), mimetype='application/x-ndjson')
+            response.timeout = None
+            return response
+
+        limit = parse_page_size(request.args.get('limit'))
+        cursor = request.args.get('cursor')
+
+        page_key = (limit, cursor)
+        page = flags_cache.get(page_key)
+        if page is None:
+            try:
+                with STAGE_SECONDS.labels("flags", "supabase").time():
+                    response = await fetch_flags_page(limit, cursor)
+            except (ValueError, TypeError):
+                return jsonify({"message": "Invalid cursor"}), 400
+
+            if response.status_code != 200:
+                UPSTREAM_ERRORS.labels("supabase", "flags.select").inc()
+                logger.error("Error fetching flags from Supabase: %s %s", response.status_code, response.text)
+                return jsonify({"message": "Failed to fetch flags"}), 500
+
+            page = flags_page(response.json(), limit)
+            flags_cache.set(page_key, page)
+
+        body, etag, cursor_next = page
+        if request.if_none_match.contains(etag):
+            result = Response("", status=304)
+        else:
+            result = Response(body, mimetype='application/json')
+        result.set_etag(etag)
+        result.headers.update(flags_page_headers(limit, cursor_next))
+        return result
+
+    except Exception as e:
+        logger.exception("Error reading flags from Supabase")
+        return jsonify({"message": "Internal server error"}), 500
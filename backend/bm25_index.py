@@ -0,0 +1,175 @@
+"""
+Local BM25 retrieval over the PODC PDF corpus.
+
+build_index() extracts and chunks the PDFs under
+storage/data/Grouped_Data/COMBINED and writes an inverted index as flat
+numpy arrays: per-term offsets into one postings array of chunk IDs
+(uint32) and one of term frequencies (uint16). BM25Index memory-maps them,
+so loading is instant and every gunicorn worker shares the same pages.
+
+Build or query the index from the backend directory:
+    python bm25_index.py build
+    python bm25_index.py search "auslan classes for toddlers"
+"""
+import argparse
+import json
+import logging
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from corpus import (
+    DEFAULT_SOURCE_DIR, ChunkStore, collect_chunks, iter_source_files, replace_directory,
+    source_fingerprint, tokenize, write_chunks
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_DIR = "local_index"
+
+
+def build_index(source_dir=DEFAULT_SOURCE_DIR, out_dir=DEFAULT_INDEX_DIR, k1=1.2, b=0.75):
+    """Build the chunk store and BM25 postings for source_dir into out_dir"""
+    started = time.perf_counter()
+    out_dir = Path(out_dir)
+    tmp_dir = out_dir.with_name(out_dir.name + ".tmp")
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    documents, chunk_doc, chunk_page, texts = collect_chunks(source_dir)
+
+    doc_len = []
+    postings_doc, postings_tf = {}, {}
+    for chunk_id, text in enumerate(texts):
+        terms = tokenize(text)
+        doc_len.append(len(terms))
+        for term, tf in Counter(terms).items():
+            postings_doc.setdefault(term, []).append(chunk_id)
+            postings_tf.setdefault(term, []).append(min(tf, 65535))
+
+    write_chunks(tmp_dir, documents, chunk_doc, chunk_page, texts)
+
+    vocabulary = sorted(postings_doc)
+    offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    for i, term in enumerate(vocabulary):
+        offsets[i + 1] = offsets[i] + len(postings_doc[term])
+    all_docs = np.empty(int(offsets[-1]), dtype=np.uint32)
+    all_tfs = np.empty(int(offsets[-1]), dtype=np.uint16)
+    for i, term in enumerate(vocabulary):
+        all_docs[offsets[i]:offsets[i + 1]] = postings_doc[term]
+        all_tfs[offsets[i]:offsets[i + 1]] = postings_tf[term]
+
+    np.save(tmp_dir / "bm25_term_offsets.npy", offsets)
+    np.save(tmp_dir / "bm25_postings_doc.npy", all_docs)
+    np.save(tmp_dir / "bm25_postings_tf.npy", all_tfs)
+    np.save(tmp_dir / "bm25_doc_len.npy", np.asarray(doc_len, dtype=np.uint32))
+    with open(tmp_dir / "bm25_terms.json", "w", encoding="utf-8") as f:
+        json.dump({term: i for i, term in enumerate(vocabulary)}, f)
+
+    manifest = {
+        "chunks": len(texts),
+        "documents": len(documents),
+        "terms": len(vocabulary),
+        "postings": int(offsets[-1]),
+        "avgdl": float(np.mean(doc_len)) if doc_len else 0.0,
+        "k1": k1,
+        "b": b,
+        "fingerprint": source_fingerprint(iter_source_files(source_dir)),
+        "built_at": time.time()
+    }
+    with open(tmp_dir / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    replace_directory(tmp_dir, out_dir)
+    logger.info(
+        "Built BM25 index: %d documents, %d chunks, %d terms in %.1fs",
+        len(documents), len(texts), len(vocabulary), time.perf_counter() - started
+    )
+    return manifest
+
+
+class BM25Index:
+    """Memory-mapped BM25 index written by build_index()"""
+
+    def __init__(self, directory=DEFAULT_INDEX_DIR):
+        directory = Path(directory)
+        with open(directory / "manifest.json", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        with open(directory / "bm25_terms.json", encoding="utf-8") as f:
+            self.terms = json.load(f)
+        self.chunks = ChunkStore(directory)
+        self.term_offsets = np.load(directory / "bm25_term_offsets.npy", mmap_mode="r")
+        self.postings_doc = np.load(directory / "bm25_postings_doc.npy", mmap_mode="r")
+        self.postings_tf = np.load(directory / "bm25_postings_tf.npy", mmap_mode="r")
+
+        # Per-chunk length normalisation, the only array kept in memory
+        k1, b = self.manifest["k1"], self.manifest["b"]
+        doc_len = np.load(directory / "bm25_doc_len.npy").astype(np.float32)
+        avgdl = self.manifest["avgdl"] or 1.0
+        self._norm = k1 * (1 - b + b * doc_len / avgdl)
+        self._k1 = k1
+
+    @property
+    def fingerprint(self):
+        return self.manifest["fingerprint"]
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def scores(self, query):
+        """BM25 score of every chunk for query"""
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        n = len(self.chunks)
+        for term in set(tokenize(query)):
+            term_id = self.terms.get(term)
+            if term_id is None:
+                continue
+            start, end = int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+            docs = self.postings_doc[start:end]
+            tf = self.postings_tf[start:end].astype(np.float32)
+            df = end - start
+            idf = np.log1p((n - df + 0.5) / (df + 0.5))
+            # A chunk appears at most once per postings list, so fancy-index add is safe
+            scores[docs] += idf * tf * (self._k1 + 1) / (tf + self._norm[docs])
+        return scores
+
+    def search(self, query, k=5):
+        """Top-k chunks for query, best first, as ChunkStore.hit() dicts"""
+        scores = self.scores(query)
+        matched = int(np.count_nonzero(scores))
+        k = min(k, matched)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self.chunks.hit(chunk_id, scores[chunk_id]) for chunk_id in top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the local BM25 index")
+    parser.add_argument("--index", default=DEFAULT_INDEX_DIR, help="index directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build")
+    build.add_argument("--source", default=str(DEFAULT_SOURCE_DIR), help="directory of PDFs to index")
+    search = commands.add_parser("search")
+    search.add_argument("query")
+    search.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "build":
+        print(json.dumps(build_index(args.source, args.index), indent=2))
+    else:
+        index = BM25Index(args.index)
+        started = time.perf_counter()
+        hits = index.search(args.query, args.k)
+        elapsed = (time.perf_counter() - started) * 1000
+        for hit in hits:
+            print(f"{hit['score']:7.3f}  {hit['filename']} (p. {hit['page']})")
+            print(f"         {hit['text'][:160]}")
+        print(f"{len(hits)} results in {elapsed:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,591 @@
+"""
+Configuration and helpers shared by the WSGI (server.py) and ASGI
+(asgi_server.py) versions of the backend.
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+
+import openai
+from dotenv import load_dotenv, find_dotenv
+
+from admission import RateLimiter
+from answer_cache import AnswerCache, answer_key
+from bm25_index import BM25Index
+from dense_index import DenseIndex
+from flag_queue import FlagQueue
+from metrics import (
+    ADMISSION, ANSWER_CACHE, CIRCUIT_BREAKER, CONCURRENCY_LIMIT, HEDGED_REQUESTS, STAGE_SECONDS,
+    UPSTREAM_RETRIES
+)
+from resilience import CircuitBreaker, CircuitOpen, DeadlineExceeded, UpstreamPolicy
+from sessions import SessionStore
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables from .env with debugging
+env_path = find_dotenv()
+if env_path:
+    logger.info("Found .env file at: %s", env_path)
+    load_dotenv(env_path)
+else:
+    logger.info("No .env file found")
+
+SUPABASE_URL = os.getenv("SUPABASE_URL", "https://jqcnepfjbcpgsulzbfna.supabase.co")
+SUPABASE_API_KEY = os.environ.get("SUPABASE_API_KEY", "")
+
+CORS_ORIGINS = [
+    "http://localhost:5000",
+    "https://podc-chatbot-frontend-v2.onrender.com",
+    "https://*.onrender.com",
+    "https://macquarieuniversity.wildapricot.org/", #Change to PODC domain for integration
+    "https://*.wildapricot.org"
+]
+
+MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+INSTRUCTIONS = "You are a helpful AI assistant for Parents of Deaf Children (PODC). Provide accurate, supportive, and accessible information"
+VECTOR_STORE_ID = os.getenv("VECTOR_STORE_ID", "vs_681eac93bf088191bd4f7de05e04dbbf")
+
+# "file_search" uses OpenAI's hosted tool over VECTOR_STORE_ID; "local" retrieves
+# chunks from the BM25 index in LOCAL_INDEX_DIR and "dense" from the embedding
+# index in DENSE_INDEX_DIR, and passes them to the model as context
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "file_search")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "local_index")
+DENSE_INDEX_DIR = os.getenv("DENSE_INDEX_DIR", "dense_index")
+
+# Restrict file_search to the question's categories and skip superseded _OLD
+# files. Off by default: the category filter is a hard one, so a misrouted
+# question searches none of the documents that answer it
+QUERY_ROUTING = os.getenv("QUERY_ROUTING", "0") == "1"
+LOCAL_TOP_K = int(os.getenv("LOCAL_TOP_K", "5"))
+
+FLAG_QUEUE_PATH = os.getenv("FLAG_QUEUE_PATH", "flag_queue.sqlite3")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "sessions.sqlite3")
+FAQ_PATH = os.getenv("FAQ_PATH", "faq.json")
+FAQ_THRESHOLD = float(os.getenv("FAQ_THRESHOLD", "0.7"))
+
+# Reverse proxies in front of the app that append to X-Forwarded-For (Render
+# has one); 0 when clients connect directly
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "1"))
+
+FLAGS_SELECT = "id,timestamp,user_prompt,flagged_text"
+FLAGS_PAGE_SIZE = 100
+FLAGS_MAX_PAGE_SIZE = 1000
+
+
+def supabase_headers():
+    return {
+        "apikey": SUPABASE_API_KEY,
+        "Authorization": f"Bearer {SUPABASE_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+
+def encode_cursor(row):
+    """Opaque keyset cursor pointing just past row"""
+    raw = json.dumps([row["timestamp"], row["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def parse_timestamp(value):
+    """The datetime of an ISO-8601 string; raises ValueError for anything else"""
+    if not isinstance(value, str):
+        raise ValueError("Expected an ISO-8601 timestamp")
+    # fromisoformat() only reads a trailing Z from Python 3.11
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value)
+
+
+def decode_cursor(cursor):
+    """
+    (timestamp, id) of a cursor; raises ValueError unless they are an
+    ISO-8601 timestamp and an integer, as they go into a PostgREST filter
+    """
+    timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    parse_timestamp(timestamp)
+    return timestamp, int(row_id)
+
+
+def flags_page_params(limit, cursor=None):
+    """
+    PostgREST query for one page of flags, newest first. Pages are keyset on
+    (timestamp, id) so deep pages cost the same as the first one.
+    """
+    params = {
+        "select": FLAGS_SELECT,
+        "order": "timestamp.desc,id.desc",
+        "limit": str(limit)
+    }
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        params["or"] = f'(timestamp.lt."{timestamp}",and(timestamp.eq."{timestamp}",id.lt.{row_id}))'
+    return params
+
+
+def parse_page_size(value):
+    """Clamp the ?limit= query argument"""
+    try:
+        limit = int(value) if value else FLAGS_PAGE_SIZE
+    except ValueError:
+        limit = FLAGS_PAGE_SIZE
+    return max(1, min(limit, FLAGS_MAX_PAGE_SIZE))
+
+
+def next_cursor(rows, limit):
+    """Cursor for the following page, or None on the last page"""
+    if len(rows) < limit:
+        return None
+    return encode_cursor(rows[-1])
+
+
+def etag_for(body):
+    return hashlib.sha1(body).hexdigest()
+
+
+def flag_payload(data):
+    """
+    Map a /flag request body onto a row of the flags table; raises
+    ValueError for a body Supabase would reject, so it is never queued
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object")
+    for field in ('userPrompt', 'flaggedText'):
+        if not isinstance(data.get(field), str):
+            raise ValueError(f"{field} must be a string")
+    parse_timestamp(data.get('timestamp'))
+    return {
+        "timestamp": data.get('timestamp'),
+        "user_prompt": data.get('userPrompt'),
+        "flagged_text": data.get('flaggedText')
+    }
+
+
+def client_key(headers, remote_addr, trusted_proxies=None):
+    """
+    Rate-limit key of a request. Behind `trusted_proxies` proxies (default
+    TRUSTED_PROXIES) that each append to X-Forwarded-For, the client is the
+    address the outermost one saw: that many hops from the right. Anything
+    left of it was sent by the client and can be forged. Without proxies,
+    or with fewer hops than proxies, it is the peer address.
+    """
+    if trusted_proxies is None:
+        trusted_proxies = TRUSTED_PROXIES
+    hops = [
+        hop.strip()
+        for value in headers.getlist("X-Forwarded-For")
+        for hop in value.split(",")
+        if hop.strip()
+    ]
+    if trusted_proxies > 0 and len(hops) >= trusted_proxies:
+        return hops[-trusted_proxies]
+    return remote_addr or "unknown"
+
+
+def rejection_response(rejection):
+    """(body, status, headers) for a request turned away by admission control"""
+    if rejection.reason == "rate limited":
+        message, status = "Too many requests. Please wait a moment and try again.", 429
+    else:
+        message, status = "The service is busy right now. Please try again shortly.", 503
+    return {'response': message, 'citations': []}, status, {"Retry-After": str(rejection.retry_after)}
+
+
+def upstream_error_response(error):
+    """(body, status, headers) for a chat request whose upstream call failed"""
+    if isinstance(error, CircuitOpen):
+        message, status = "The assistant is temporarily unavailable. Please try again shortly.", 503
+        headers = {"Retry-After": str(error.retry_after)}
+    elif isinstance(error, (DeadlineExceeded, openai.APITimeoutError)):
+        message, status, headers = "The assistant took too long to answer. Please try again.", 504, {}
+    else:
+        message, status, headers = "The assistant could not answer right now. Please try again.", 502, {}
+    return {'response': message, 'citations': []}, status, headers
+
+
+def knowledge_base_id():
+    if RETRIEVAL_BACKEND == "local":
+        return f"local:{LOCAL_INDEX_DIR}"
+    if RETRIEVAL_BACKEND == "dense":
+        return f"dense:{DENSE_INDEX_DIR}"
+    return VECTOR_STORE_ID
+
+
+def cache_key(user_message):
+    return answer_key(user_message, MODEL, INSTRUCTIONS, knowledge_base_id())
+
+
+def context_instructions(hits):
+    """INSTRUCTIONS followed by locally retrieved excerpts to answer from"""
+    excerpts = "\n\n".join(
+        f"[{i}] {hit['filename']} (page {hit['page']}):\n{hit['text']}"
+        for i, hit in enumerate(hits, start=1)
+    )
+    return (
+        f"{INSTRUCTIONS}\n\n"
+        "Answer using the following excerpts from the PODC knowledge base. "
+        "If they do not contain the answer, say so.\n\n"
+        f"{excerpts}"
+    )
+
+
+def response_params(user_input, previous_response_id=None, context=None, filters=None):
+    """
+    Arguments shared by the blocking and streaming calls to the Responses API.
+    user_input is the message text, or a list of messages for a session turn.
+    context is a list of locally retrieved chunks; when given it replaces the
+    hosted file_search tool. filters are attribute filters for file_search.
+    """
+    params = {
+        "model": MODEL,
+        "instructions": INSTRUCTIONS,
+        "input": user_input
+    }
+    if context is None:
+        params["tools"] = [{
+            "type": "file_search",
+            "vector_store_ids": [VECTOR_STORE_ID]
+        }]
+        if filters:
+            params["tools"][0]["filters"] = filters
+        params["include"] = ["file_search_call.results"]
+    else:
+        params["instructions"] = context_instructions(context)
+    if previous_response_id:
+        params["previous_response_id"] = previous_response_id
+    return params
+
+
+def collect_file_citations(response):
+    """Return the reply text and the file_citation annotations of a completed response"""
+    reply = ""
+    annotations = []
+
+    # Process the output items
+    for output in response.output:
+        if output.type == "message":
+            for content in output.content:
+                if content.type == "output_text":
+                    reply = content.text
+                    # Collect citations from annotations
+                    if hasattr(content, 'annotations'):
+                        for annotation in content.annotations:
+                            if annotation.type == "file_citation":
+                                annotations.append(annotation)
+
+    return reply, annotations
+
+
+def build_citation(annotation, attributes):
+    """Build a citation dict for a file_citation annotation"""
+    if attributes is None:
+        return {
+            'filename': annotation.filename,
+            'file_id': annotation.file_id,
+            'metadata': {}
+        }
+
+    return {
+        'filename': annotation.filename,
+        'file_id': annotation.file_id,
+        'metadata': {
+            'url': attributes.get('url'),
+            'category': attributes.get('category')
+        }
+    }
+
+
+def local_citations(hits):
+    """Citations for locally retrieved chunks, one per source file"""
+    citations = []
+    seen = set()
+    for hit in hits:
+        if hit["filename"] in seen:
+            continue
+        seen.add(hit["filename"])
+        citations.append({
+            'filename': hit["filename"],
+            'file_id': None,
+            'metadata': {
+                'url': hit["url"],
+                'category': hit["category"]
+            }
+        })
+    return citations
+
+
+def sse_event(event, data):
+    """Format a single Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Components both servers build the same way from the environment
+
+def upstream_policies():
+    """
+    (openai_policy, vector_store_policy): deadline, retries, circuit breaker
+    and optional hedging for the upstream calls
+    """
+    openai_policy = UpstreamPolicy(
+        "openai",
+        deadline=float(os.getenv("OPENAI_DEADLINE", "60")),
+        attempts=int(os.getenv("OPENAI_MAX_ATTEMPTS", "3")),
+        breaker=CircuitBreaker(
+            "openai",
+            failure_threshold=int(os.getenv("BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv("BREAKER_RESET_TIMEOUT", "30")),
+            counter=CIRCUIT_BREAKER
+        ),
+        hedge=os.getenv("OPENAI_HEDGE", "0") == "1",
+        retry_counter=UPSTREAM_RETRIES,
+        hedge_counter=HEDGED_REQUESTS
+    )
+    vector_store_policy = UpstreamPolicy(
+        "vector_stores",
+        deadline=float(os.getenv("VECTOR_STORE_DEADLINE", "15")),
+        breaker=CircuitBreaker("vector_stores", counter=CIRCUIT_BREAKER),
+        retry_counter=UPSTREAM_RETRIES
+    )
+    return openai_policy, vector_store_policy
+
+
+def load_local_index(client):
+    """
+    The local index that replaces the hosted file_search tool, or None.
+    client is a sync OpenAI client for the dense index's query embeddings.
+    """
+    local_index = None
+    if RETRIEVAL_BACKEND == "local":
+        local_index = BM25Index(LOCAL_INDEX_DIR)
+    elif RETRIEVAL_BACKEND == "dense":
+        local_index = DenseIndex(
+            DENSE_INDEX_DIR,
+            client=client.with_options(max_retries=2),
+            nprobe=int(os.getenv("DENSE_NPROBE", "8"))
+        )
+    if local_index is not None:
+        logger.info("Local %s index loaded: %d chunks", RETRIEVAL_BACKEND, len(local_index))
+    return local_index
+
+
+def knowledge_base_version(local_index, citation_cache):
+    """Fingerprint of the knowledge base, refreshing a stale snapshot in the background"""
+    if local_index is not None:
+        return local_index.fingerprint
+    if citation_cache.is_stale:
+        citation_cache.refresh_in_background()
+    return citation_cache.fingerprint
+
+
+def answer_cache_for(version_fn):
+    """Answers to repeated questions, dropped whenever version_fn() changes"""
+    return AnswerCache(
+        max_size=int(os.getenv("ANSWER_CACHE_SIZE", "512")),
+        ttl=int(os.getenv("ANSWER_CACHE_TTL", "86400")),
+        version_fn=version_fn,
+        counter=ANSWER_CACHE
+    )
+
+
+def flags_page_cache():
+    """Short-lived cache of /flags pages"""
+    return AnswerCache(max_size=256, ttl=int(os.getenv("FLAGS_CACHE_TTL", "10")))
+
+
+def flag_outbox():
+    """Local outbox the flags are flushed to Supabase from, in batches"""
+    return FlagQueue(FLAG_QUEUE_PATH, SUPABASE_URL, supabase_headers())
+
+
+def session_store():
+    """Multi-turn conversation state shared by all workers"""
+    return SessionStore(
+        SESSION_STORE_PATH,
+        max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "5000")),
+        idle_ttl=int(os.getenv("SESSION_IDLE_TTL", "1800")),
+        token_budget=int(os.getenv("SESSION_TOKEN_BUDGET", "60000")),
+        context_tokens=int(os.getenv("SESSION_CONTEXT_TOKENS", "8000"))
+    )
+
+
+def admission_settings():
+    """
+    Arguments of the admission controller: upstream chat calls allowed at
+    once in a worker; the rest wait in a bounded queue until their
+    deadline, and are shed with a 503 beyond that
+    """
+    return {
+        "limit": int(os.getenv("ADMISSION_LIMIT", "4")),
+        "min_limit": int(os.getenv("ADMISSION_MIN_LIMIT", "1")),
+        "max_limit": int(os.getenv("ADMISSION_MAX_LIMIT", "12")),
+        "queue_size": int(os.getenv("ADMISSION_QUEUE_SIZE", "8")),
+        "queue_timeout": float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10")),
+        "counter": ADMISSION,
+        "gauge": CONCURRENCY_LIMIT
+    }
+
+
+def client_rate_limiter():
+    """Per-client token bucket for the chat endpoints (0 disables it)"""
+    return RateLimiter(
+        rate=float(os.getenv("RATE_LIMIT_PER_MINUTE", "20")) / 60,
+        burst=int(os.getenv("RATE_LIMIT_BURST", "10")),
+        counter=ADMISSION
+    )
+
+
+# How long a request waits for an identical one already in flight
+SINGLEFLIGHT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_TIMEOUT", "120"))
+
+# Frequent questions answered at startup, and how many at once
+ANSWER_CACHE_PREWARM_FILE = os.getenv("ANSWER_CACHE_PREWARM_FILE")
+PREWARM_CONCURRENCY = int(os.getenv("ANSWER_CACHE_PREWARM_CONCURRENCY", "2"))
+
+
+def prewarm_questions():
+    """The questions of ANSWER_CACHE_PREWARM_FILE, a JSON list, if set and readable"""
+    if not ANSWER_CACHE_PREWARM_FILE:
+        return []
+    try:
+        with open(ANSWER_CACHE_PREWARM_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning("Error reading pre-warm questions from %s: %s", ANSWER_CACHE_PREWARM_FILE, e)
+        return []
+
+
+# Request handling shared by both servers
+
+def chat_message(data):
+    """The message of a /chat request body, or None"""
+    return (data or {}).get('message') or None
+
+
+def wants_session(data):
+    """Whether a /chat request belongs to a conversation session"""
+    return bool(data.get('session') or data.get('session_id'))
+
+
+def faq_answer(faq, user_message):
+    """(reply, citations) of a confident FAQ match, or None"""
+    if faq is None:
+        return None
+    with STAGE_SECONDS.labels("chat", "faq").time():
+        matched = faq.match(user_message)
+    if matched is None:
+        return None
+    entry, score = matched
+    logger.info("Answered from FAQ", extra={"faq_id": entry["id"], "score": round(score, 3)})
+    return entry["answer"], entry["citations"]
+
+
+def cached_answer(faq, answer_cache, user_message):
+    """(cache key, (reply, citations) from the FAQ or the answer cache, or None)"""
+    key = cache_key(user_message)
+    cached = faq_answer(faq, user_message)
+    if cached is None:
+        with STAGE_SECONDS.labels("chat", "cache").time():
+            cached = answer_cache.get(key)
+    return key, cached
+
+
+def turn_args(sessions, session, user_message):
+    """response_params() arguments of a single question or a session turn"""
+    if session is None:
+        return {"user_input": user_message}
+    return sessions.turn_params(session, user_message)
+
+
+def chat_body(reply, citations, session=None):
+    body = {
+        'response': reply,
+        'citations': citations
+    }
+    if session is not None:
+        body['session_id'] = session['id']
+    return body
+
+
+def session_exhausted_response(session):
+    """(body, status) for a session that has used up its token budget"""
+    return {
+        'response': 'This conversation has reached its length limit. Please start a new conversation.',
+        'citations': [],
+        'session_id': session['id']
+    }, 429
+
+
+def server_error_response(error):
+    """(body, status) for a chat request that failed unexpectedly"""
+    return {
+        'response': f'Server error: {str(error)}',
+        'citations': []
+    }, 500
+
+
+def replay_answer(reply, citations):
+    """SSE events for an answer that is already complete"""
+    return [
+        sse_event("delta", {"text": reply}),
+        sse_event("citations", {"response": reply, "citations": citations}),
+        sse_event("done", {})
+    ]
+
+
+def stream_error_event(error):
+    """SSE 'error' event for a streamed answer whose upstream call failed"""
+    return sse_event("error", {"response": upstream_error_response(error)[0]['response']})
+
+
+def stats_body(admission, openai_policy, vector_store_policy, inflight, answer_cache):
+    """/stats: admission, circuit breaker, single-flight and answer cache state"""
+    return {
+        "admission": admission.stats(),
+        "circuit_breakers": {
+            "openai": openai_policy.breaker.state,
+            "vector_stores": vector_store_policy.breaker.state
+        },
+        "singleflight": inflight.stats(),
+        "answer_cache": {
+            "size": len(answer_cache),
+            "hits": answer_cache.hits,
+            "misses": answer_cache.misses
+        }
+    }
+
+
+def warmup_result(error=None):
+    """How a warm-up check went, for /ready"""
+    if error is None:
+        return "ok"
+    # Any HTTP response, even an error status, leaves a warm keep-alive connection
+    if isinstance(error, openai.APIStatusError):
+        return f"status {error.status_code}"
+    return f"error: {error}"
+
+
+def wants_ndjson(request):
+    return request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def flags_page(rows, limit):
+    """(JSON body, ETag, next cursor) of a page of flags"""
+    with STAGE_SECONDS.labels("flags", "serialize").time():
+        body = json.dumps(rows).encode("utf-8")
+        return body, etag_for(body), next_cursor(rows, limit)
+
+
+def flags_page_headers(limit, cursor_next):
+    """Caching and pagination headers of a /flags page"""
+    headers = {'Cache-Control': 'no-cache'}
+    if cursor_next:
+        headers['X-Next-Cursor'] = cursor_next
+        headers['Link'] = f'</flags?limit={limit}&cursor={cursor_next}>; rel="next"'
+    return headers
+
+
+def ndjson_lines(rows):
+    return [json.dumps(row) + "\n" for row in rows]
@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import UPSTREAM_ERRORS
+from resilience import UpstreamPolicy
+
+logger = logging.getLogger(__name__)
+
+
+class CitationMetadataCache:
+    """
+    In-memory snapshot of vector store file attributes (file_id -> attributes).
+
+    The snapshot is loaded by paging vector_stores.files.list and refreshed in
+    the background once it is older than ttl seconds. Lookups that miss the
+    snapshot fall back to concurrent vector_stores.files.retrieve calls.
+    All vector store calls go through policy (retries and circuit breaker).
+    """
+
+    def __init__(self, client, vector_store_id, ttl=3600, page_size=100, max_workers=8, policy=None):
+        self.client = client
+        self.policy = policy or UpstreamPolicy("vector_stores", deadline=30)
+        self.vector_store_id = vector_store_id
+        self.ttl = ttl
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self._attributes = {}
+        # None until the first load, which counts as stale however new the process is
+        self._loaded_at = None
+        self.fingerprint = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def load(self):
+        """Replace the snapshot with a full listing of the vector store"""
+        snapshot = {}
+        after = None
+        while True:
+            params = {"limit": self.page_size}
+            if after:
+                params["after"] = after
+            page = self.policy.call(
+                lambda timeout: self.client.vector_stores.files.list(self.vector_store_id, timeout=timeout, **params)
+            )
+            for vector_file in page.data:
+                snapshot[vector_file.id] = dict(vector_file.attributes or {})
+            if not page.has_more or not page.data:
+                break
+            after = page.last_id
+
+        fingerprint = hashlib.sha256(
+            json.dumps(snapshot, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+        with self._lock:
+            self._attributes = snapshot
+            self._loaded_at = time.monotonic()
+            self.fingerprint = fingerprint
+        logger.info("Citation metadata snapshot loaded: %d files", len(snapshot))
+        return len(snapshot)
+
+    @property
+    def is_stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def __len__(self):
+        return len(self._attributes)
+
+    def snapshot(self):
+        """(fingerprint, attributes of every file) of the current snapshot"""
+        with self._lock:
+            return self.fingerprint, list(self._attributes.values())
+
+    def file_ids(self):
+        """Return the file IDs in the current snapshot"""
+        return frozenset(self._attributes)
+
+    def refresh_in_background(self):
+        """Reload the snapshot on a daemon thread, keeping the old one meanwhile"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                UPSTREAM_ERRORS.labels("openai", "vector_stores.files.list").inc()
+                logger.warning("Error refreshing citation metadata: %s", e)
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="citation-cache-refresh", daemon=True).start()
+
+    def _retrieve(self, file_id):
+        try:
+            vector_file = self.policy.call(lambda timeout: self.client.vector_stores.files.retrieve(
+                vector_store_id=self.vector_store_id,
+                file_id=file_id,
+                timeout=timeout
+            ))
+            return file_id, dict(vector_file.attributes or {})
+        except Exception as e:
+            UPSTREAM_ERRORS.labels("openai", "vector_stores.files.retrieve").inc()
+            logger.warning("Error retrieving file info for %s: %s", file_id, e)
+            return file_id, None
+
+    def _lookup(self, file_ids):
+        """Split the unique IDs into snapshot hits and misses"""
+        found = {}
+        misses = []
+        for file_id in dict.fromkeys(file_ids):
+            attributes = self._attributes.get(file_id)
+            if attributes is None:
+                misses.append(file_id)
+            else:
+                found[file_id] = attributes
+        return found, misses
+
+    def _store(self, found, results):
+        with self._lock:
+            for file_id, attributes in results:
+                found[file_id] = attributes
+                if attributes is not None:
+                    self._attributes[file_id] = attributes
+        return found
+
+    def get_many(self, file_ids):
+        """
+        Return {file_id: attributes} for the given IDs. Duplicate IDs are looked
+        up once; IDs that could not be resolved map to None.
+        """
+        if self.is_stale:
+            self.refresh_in_background()
+
+        found, misses = self._lookup(file_ids)
+        if not misses:
+            return found
+
+        workers = min(self.max_workers, len(misses))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(self._retrieve, misses))
+        return self._store(found, results)
+
+    async def _aretrieve(self, async_client, file_id):
+        try:
+            vector_file = await self.policy.acall(lambda timeout: async_client.vector_stores.files.retrieve(
+                vector_store_id=self.vector_store_id,
+                file_id=file_id,
+                timeout=timeout
+            ))
+            return file_id, dict(vector_file.attributes or {})
+        except Exception as e:
+            UPSTREAM_ERRORS.labels("openai", "vector_stores.files.retrieve").inc()
+            logger.warning("Error retrieving file info for %s: %s", file_id, e)
+            return file_id, None
+
+    async def aget_many(self, file_ids, async_client):
+        """Async variant of get_many; misses are fetched with async_client"""
+        if self.is_stale:
+            self.refresh_in_background()
+
+        found, misses = self._lookup(file_ids)
+        if not misses:
+            return found
+
+        results = await asyncio.gather(
+            *(self._aretrieve(async_client, file_id) for file_id in misses)
+        )
+        return self._store(found, results)
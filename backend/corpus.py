@@ -0,0 +1,220 @@
+"""
+Text extraction, chunking and on-disk chunk storage for the local retrieval
+indexes.
+
+Chunk text is stored as one UTF-8 blob with an offsets array, so an index
+directory can be memory-mapped instead of read into every worker.
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import shutil
+from pathlib import Path
+
+import numpy as np
+from PyPDF2 import PdfReader
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCE_DIR = Path(__file__).resolve().parent.parent / "storage" / "data" / "Grouped_Data" / "COMBINED"
+
+CHUNK_WORDS = 200
+CHUNK_OVERLAP = 40
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have
+having he her here hers herself him himself his how i if in into is it its itself just me more most
+my myself no nor not now of off on once only or other our ours ourselves out over own same she
+should so some such than that the their theirs them themselves then there these they this those
+through to too under until up very was we were what when where which while who whom why will with
+would you your yours yourself yourselves
+""".split())
+
+
+def tokenize(text):
+    """Lower-cased alphanumeric terms, without stopwords and single characters"""
+    return [t for t in _TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def iter_source_files(source_dir):
+    """PDFs under source_dir, in a stable order"""
+    return sorted(Path(source_dir).rglob("*.pdf"))
+
+
+def source_fingerprint(paths):
+    """Changes whenever a source file is added, removed or modified"""
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = path.stat()
+        digest.update(f"{path.name}\x1f{stat.st_size}\x1f{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def document_version(filename):
+    """OLD/NEW from the filename suffix, as in the file catalog"""
+    if filename.endswith("_OLD.pdf"):
+        return "OLD"
+    if filename.endswith("_NEW.pdf"):
+        return "NEW"
+    return "UNKNOWN"
+
+
+def extract_pages(path):
+    """Return (pages, source_url) for a PDF; pages is a list of page texts"""
+    reader = PdfReader(str(path))
+    pages = []
+    for page in reader.pages:
+        try:
+            pages.append(page.extract_text() or "")
+        except Exception as e:
+            logger.warning("Error extracting a page of %s: %s", path.name, e)
+            pages.append("")
+    url = None
+    try:
+        metadata = reader.metadata or {}
+        # Indexing resolves indirect values, get() does not
+        if "/SourceURL" in metadata:
+            url = str(metadata["/SourceURL"])
+    except Exception:
+        pass
+    return pages, url
+
+
+def chunk_pages(pages, words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """
+    Split page texts into overlapping windows of roughly `words` words.
+    Yields (page_number, text), page_number being where the chunk starts.
+    """
+    tokens = []
+    for number, text in enumerate(pages, start=1):
+        tokens.extend((number, word) for word in text.split())
+
+    step = max(1, words - overlap)
+    for start in range(0, len(tokens), step):
+        window = tokens[start:start + words]
+        if not window:
+            break
+        yield window[0][0], " ".join(word for _, word in window)
+        if start + words >= len(tokens):
+            break
+
+
+def iter_chunks(source_dir=None, paths=None):
+    """
+    Extract and chunk every PDF under source_dir, or the given paths. Yields
+    (document, page, text) where document is a dict of filename, category,
+    version and url.
+    """
+    for path in (iter_source_files(source_dir) if paths is None else map(Path, paths)):
+        try:
+            pages, url = extract_pages(path)
+        except Exception as e:
+            logger.warning("Error reading %s: %s", path.name, e)
+            continue
+        document = {
+            "filename": path.name,
+            "category": path.parent.name,
+            "version": document_version(path.name),
+            "url": url
+        }
+        for page, text in chunk_pages(pages):
+            yield document, page, text
+
+
+def collect_chunks(source_dir=None, paths=None):
+    """
+    All chunks of source_dir (or paths) as (documents, chunk_doc,
+    chunk_page, texts): the distinct documents, and per chunk its document
+    index, starting page and text.
+    """
+    documents = []
+    document_ids = {}
+    chunk_doc, chunk_page, texts = [], [], []
+    for document, page, text in iter_chunks(source_dir, paths):
+        if document["filename"] not in document_ids:
+            document_ids[document["filename"]] = len(documents)
+            documents.append(document)
+        chunk_doc.append(document_ids[document["filename"]])
+        chunk_page.append(page)
+        texts.append(text)
+    return documents, chunk_doc, chunk_page, texts
+
+
+def write_chunks(out_dir, documents, chunk_doc, chunk_page, texts):
+    """Write the chunk store files into out_dir"""
+    out_dir = Path(out_dir)
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    with open(out_dir / "chunk_text.bin", "wb") as f:
+        position = 0
+        for i, text in enumerate(texts):
+            data = text.encode("utf-8")
+            f.write(data)
+            position += len(data)
+            offsets[i + 1] = position
+    np.save(out_dir / "chunk_offsets.npy", offsets)
+    np.save(out_dir / "chunk_doc.npy", np.asarray(chunk_doc, dtype=np.uint32))
+    np.save(out_dir / "chunk_page.npy", np.asarray(chunk_page, dtype=np.uint32))
+    with open(out_dir / "documents.json", "w", encoding="utf-8") as f:
+        json.dump(documents, f)
+
+
+def replace_directory(tmp_dir, out_dir):
+    """Swap a freshly built index directory into place"""
+    tmp_dir, out_dir = Path(tmp_dir), Path(out_dir)
+    old_dir = out_dir.with_name(out_dir.name + ".old")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if out_dir.exists():
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+class ChunkStore:
+    """Read-only, memory-mapped view of the chunks in an index directory"""
+
+    def __init__(self, directory):
+        directory = Path(directory)
+        with open(directory / "documents.json", encoding="utf-8") as f:
+            self.documents = json.load(f)
+        self.offsets = np.load(directory / "chunk_offsets.npy", mmap_mode="r")
+        self.chunk_doc = np.load(directory / "chunk_doc.npy", mmap_mode="r")
+        self.chunk_page = np.load(directory / "chunk_page.npy", mmap_mode="r")
+
+        self._file = open(directory / "chunk_text.bin", "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self._text = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._text = b""
+
+    def __len__(self):
+        return len(self.chunk_doc)
+
+    def text(self, chunk_id):
+        start, end = int(self.offsets[chunk_id]), int(self.offsets[chunk_id + 1])
+        return self._text[start:end].decode("utf-8")
+
+    def export(self):
+        """The chunks as collect_chunks() returns them, to rebuild from"""
+        documents = [dict(d, version=d.get("version") or document_version(d["filename"])) for d in self.documents]
+        texts = [self.text(i) for i in range(len(self))]
+        return documents, self.chunk_doc.tolist(), self.chunk_page.tolist(), texts
+
+    def hit(self, chunk_id, score):
+        """Search result dict for a chunk"""
+        document = self.documents[int(self.chunk_doc[chunk_id])]
+        return {
+            "chunk_id": int(chunk_id),
+            "score": float(score),
+            "filename": document["filename"],
+            "category": document["category"],
+            "version": document.get("version"),
+            "url": document["url"],
+            "page": int(self.chunk_page[chunk_id]),
+            "text": self.text(chunk_id)
+        }
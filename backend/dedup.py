@@ -0,0 +1,326 @@
+"""
+Duplicate detection for the PDF corpus.
+
+Exact duplicates share the SHA-256 of their bytes. Near-duplicates (the same
+document re-exported, re-saved or lightly edited) are found with MinHash
+signatures over word shingles of the extracted text: LSH banding picks the
+pairs worth comparing, and pairs whose estimated Jaccard similarity reaches
+`threshold` are grouped together.
+
+Each group keeps one canonical file: a _NEW version before an unversioned
+one before _OLD, then a name without "copy", then the most recently
+modified, then the shortest path. The others are reported as duplicates of
+it.
+
+Hashes and signatures are cached by path, size and mtime, so only new or
+changed PDFs are read again.
+
+Report the duplicates across the data tree from the backend directory:
+    python dedup.py ../storage/data --near 0.9 --report duplicates.jsonl
+Keep one copy of each file on disk, hard-linking the duplicates to it:
+    python dedup.py ../storage/data --store ../storage/objects --link
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import zlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from corpus import document_version, extract_pages, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Hashes and MinHash signatures of files already seen
+DEFAULT_CACHE = Path(os.getenv("DEDUP_CACHE", Path(__file__).resolve().parent / "dedup_cache.json"))
+
+SHINGLE_WORDS = 5
+NUM_PERM = 128
+# 32 bands of 4 rows: pairs above ~0.5 similarity are almost always compared
+BANDS = 32
+
+# Largest prime below 2**32, so (a * x + b) stays within uint64 for 32-bit x
+_PRIME = np.uint64(4294967291)
+_rng = np.random.default_rng(20240501)
+_A = _rng.integers(1, 2 ** 32 - 5, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 2 ** 32 - 5, NUM_PERM, dtype=np.uint64)
+
+# Below this many files to read, starting a process pool costs more than it saves
+MIN_PARALLEL = 8
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def minhash(text):
+    """MinHash signature of the text's word shingles, or None when it has no words"""
+    terms = tokenize(text)
+    if not terms:
+        return None
+    width = min(SHINGLE_WORDS, len(terms))
+    shingles = {" ".join(terms[i:i + width]) for i in range(len(terms) - width + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    signature = np.full(NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(hashes), 4096):
+        block = hashes[start:start + 4096]
+        np.minimum(signature, ((_A[:, None] * block[None, :] + _B[:, None]) % _PRIME).min(axis=1), out=signature)
+    return signature
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.mean(np.asarray(a) == np.asarray(b)))
+
+
+def fingerprint(path, near=True):
+    """{"sha256", "signature"} of a PDF; the signature is None for exact-only or textless files"""
+    entry = {"sha256": file_sha256(path), "signature": None}
+    if near:
+        try:
+            pages, _ = extract_pages(path)
+            signature = minhash("\n".join(pages))
+            entry["signature"] = signature.tolist() if signature is not None else None
+        except Exception as e:
+            logger.warning("Error reading %s: %s", path, e)
+    return entry
+
+
+def _fingerprint_near(path):
+    return fingerprint(path, near=True)
+
+
+def _fingerprint_exact(path):
+    return fingerprint(path, near=False)
+
+
+def _load_cache(cache_path):
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_cache(cache, cache_path):
+    # Forget files that no longer exist
+    cache = {path: entry for path, entry in cache.items() if os.path.exists(path)}
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, cache_path)
+
+
+def fingerprints(paths, near=True, workers=None, cache_path=DEFAULT_CACHE):
+    """
+    {path: {"sha256", "signature"}} for paths, reading only files that are
+    not cached with the same size and mtime (or, for near, have no signature
+    yet) across `workers` processes
+    """
+    cache = _load_cache(cache_path) if cache_path else {}
+    results = {}
+    pending = []
+    for path in paths:
+        key = str(Path(path).resolve())
+        stat = os.stat(path)
+        entry = cache.get(key)
+        if (entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns
+                and (not near or "signature" in entry)):
+            results[path] = entry
+        else:
+            pending.append((path, key, stat))
+
+    fn = _fingerprint_near if near else _fingerprint_exact
+    files = [path for path, _, _ in pending]
+    if len(files) < MIN_PARALLEL or workers == 1:
+        computed = map(fn, files)
+    else:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            computed = list(pool.map(fn, files, chunksize=max(1, len(files) // (workers * 4))))
+
+    for (path, key, stat), entry in zip(pending, computed):
+        entry = dict(entry, size=stat.st_size, mtime=stat.st_mtime_ns)
+        if not near:
+            # Only the hash was computed
+            entry.pop("signature")
+        cache[key] = results[path] = entry
+    if cache_path and pending:
+        _save_cache(cache, cache_path)
+    return results
+
+
+def preference(path):
+    """Sort key of the files in a group; the first is canonical"""
+    path = Path(path)
+    version = {"NEW": 0, "UNKNOWN": 1, "OLD": 2}[document_version(path.name)]
+    return (version, "copy" in path.name.lower(), -path.stat().st_mtime, len(str(path)), str(path))
+
+
+def _near_pairs(signatures, threshold):
+    """(i, j, similarity) for the signatures at or above threshold, via LSH banding"""
+    rows = NUM_PERM // BANDS
+    buckets = defaultdict(list)
+    for i, signature in enumerate(signatures):
+        for band in range(BANDS):
+            buckets[(band, tuple(signature[band * rows:(band + 1) * rows]))].append(i)
+
+    candidates = set()
+    for members in buckets.values():
+        for x in range(len(members)):
+            for y in range(x + 1, len(members)):
+                candidates.add((members[x], members[y]))
+    for i, j in candidates:
+        score = similarity(signatures[i], signatures[j])
+        if score >= threshold:
+            yield i, j, score
+
+
+def find_duplicates(paths, threshold=None, workers=None, cache_path=DEFAULT_CACHE):
+    """
+    Groups of duplicate files among paths, as dicts of "canonical" (the
+    path to keep) and "duplicates": [{"path", "match", "similarity"}] where
+    match is "exact" or "near". Near-duplicates are only looked for when a
+    threshold is given.
+    """
+    paths = list(paths)
+    prints = fingerprints(paths, near=threshold is not None, workers=workers, cache_path=cache_path)
+
+    parent = {path: path for path in paths}
+
+    def find(path):
+        while parent[path] != path:
+            parent[path] = parent[parent[path]]
+            path = parent[path]
+        return path
+
+    by_hash = defaultdict(list)
+    for path in paths:
+        by_hash[prints[path]["sha256"]].append(path)
+    for same in by_hash.values():
+        for path in same[1:]:
+            parent[find(path)] = find(same[0])
+
+    if threshold is not None:
+        # One signature per distinct content
+        distinct = [same[0] for same in by_hash.values() if prints[same[0]].get("signature")]
+        signatures = [prints[path]["signature"] for path in distinct]
+        for i, j, _ in _near_pairs(signatures, threshold):
+            parent[find(distinct[i])] = find(distinct[j])
+
+    members = defaultdict(list)
+    for path in paths:
+        members[find(path)].append(path)
+
+    groups = []
+    for group in members.values():
+        if len(group) < 2:
+            continue
+        group.sort(key=preference)
+        canonical = group[0]
+        duplicates = []
+        for path in group[1:]:
+            if prints[path]["sha256"] == prints[canonical]["sha256"]:
+                duplicates.append({"path": path, "match": "exact", "similarity": 1.0})
+            else:
+                a, b = prints[path].get("signature"), prints[canonical].get("signature")
+                score = similarity(a, b) if a and b else None
+                duplicates.append({"path": path, "match": "near", "similarity": score})
+        groups.append({"canonical": canonical, "duplicates": duplicates})
+    groups.sort(key=lambda group: str(group["canonical"]))
+    return groups
+
+
+def dedupe(paths, threshold=None, workers=None, cache_path=DEFAULT_CACHE):
+    """(paths without their duplicates, in the original order; the duplicate groups)"""
+    paths = list(paths)
+    groups = find_duplicates(paths, threshold=threshold, workers=workers, cache_path=cache_path)
+    skipped = {duplicate["path"] for group in groups for duplicate in group["duplicates"]}
+    return [path for path in paths if path not in skipped], groups
+
+
+def build_store(paths, store_dir, link=False, cache_path=DEFAULT_CACHE):
+    """
+    Content-addressed store of paths under store_dir: one
+    objects/<sha256[:2]>/<sha256>.pdf per distinct content (hard-linked to
+    the first file with it where possible) and an index.json of path ->
+    sha256. With link, every path is replaced by a hard link to its object,
+    so the corpus keeps one copy of each distinct file on disk; the store
+    must then be on the same filesystem. Returns the bytes that link freed.
+    """
+    store_dir = Path(store_dir)
+    prints = fingerprints(paths, near=False, cache_path=cache_path)
+    index = {}
+    freed = 0
+    for original in paths:
+        path = Path(original)
+        sha256 = prints[original]["sha256"]
+        index[str(path.resolve())] = sha256
+        obj = store_dir / "objects" / sha256[:2] / f"{sha256}.pdf"
+        if not obj.exists():
+            obj.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(path, obj)
+            except OSError:
+                shutil.copy2(path, obj)
+        if link and not os.path.samefile(path, obj):
+            tmp_path = path.with_name(f"{path.name}.tmp")
+            os.link(obj, tmp_path)
+            size = path.stat().st_size
+            os.replace(tmp_path, path)
+            freed += size
+
+    with open(store_dir / "index.json", "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    return freed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find duplicate PDFs")
+    parser.add_argument("directories", nargs="+")
+    parser.add_argument("--near", type=float, default=None, help="also group near-duplicates at this estimated similarity, e.g. 0.9")
+    parser.add_argument("--report", default=None, help="write the groups to this JSON lines file")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--store", default=None, help="build a content-addressed store in this directory")
+    parser.add_argument("--link", action="store_true", help="with --store, replace every file by a hard link into the store")
+    args = parser.parse_args()
+
+    paths = sorted(path for directory in args.directories for path in Path(directory).rglob("*.pdf"))
+    groups = find_duplicates(paths, threshold=args.near, workers=args.workers)
+
+    duplicates = [duplicate for group in groups for duplicate in group["duplicates"]]
+    wasted = sum(Path(duplicate["path"]).stat().st_size for duplicate in duplicates)
+    for group in groups:
+        print(group["canonical"])
+        for duplicate in group["duplicates"]:
+            score = f" {duplicate['similarity']:.2f}" if duplicate["similarity"] is not None else ""
+            print(f"  {duplicate['match']}{score}: {duplicate['path']}")
+    print(
+        f"{len(paths)} files, {len(paths) - len(duplicates)} distinct, {len(groups)} groups, "
+        f"{len(duplicates)} duplicates ({wasted / 1e6:.1f} MB)"
+    )
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            for group in groups:
+                f.write(json.dumps({
+                    "canonical": str(group["canonical"]),
+                    "duplicates": [dict(duplicate, path=str(duplicate["path"])) for duplicate in group["duplicates"]]
+                }) + "\n")
+    if args.store:
+        freed = build_store(paths, args.store, link=args.link)
+        print(f"Store written to {args.store}" + (f"; {freed / 1e6:.1f} MB freed by linking" if args.link else ""))
+
+
+if __name__ == "__main__":
+    main()
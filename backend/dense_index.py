@@ -0,0 +1,286 @@
+"""
+Dense embedding index over the PODC PDF corpus.
+
+Chunk embeddings are stored as one contiguous (chunks, dim) float32 (or,
+to halve the file, float16) matrix in embeddings.npy next to the chunk
+store, and opened with
+mmap_mode="r" so all gunicorn workers share one read-only copy. A search is
+a single matrix product against the query batch followed by argpartition
+top-k.
+
+When the directory also holds an IVF layout (see ann_index.py) searches
+only scan the nprobe closest cells instead of every chunk.
+
+Build, extend or query the index from the backend directory:
+    python dense_index.py build                       # local hashing embedder
+    python dense_index.py build --embedder openai     # OpenAI embeddings
+    python dense_index.py build --chunks-from local_index --ivf-nlist 128
+    python dense_index.py add new_document.pdf
+    python dense_index.py search "auslan classes for toddlers"
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from corpus import (
+    DEFAULT_SOURCE_DIR, ChunkStore, collect_chunks, iter_source_files, replace_directory,
+    source_fingerprint, write_chunks
+)
+from ann_index import IVFIndex
+from embeddings import HashingEmbedder, OpenAIEmbedder, embedder_from_spec
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_DIR = "dense_index"
+
+# Rows scored per matmul, bounding the float32 copy made of a float16 matrix
+SCORE_BLOCK_ROWS = 65536
+
+
+def build_dense_index(source_dir=DEFAULT_SOURCE_DIR, out_dir=DEFAULT_INDEX_DIR, embedder=None,
+                      dtype="float32", chunks_from=None, batch_size=512, ivf_nlist=None):
+    """
+    Embed every chunk of source_dir into out_dir. chunks_from may name an
+    existing index directory (e.g. the BM25 one) built from the same sources,
+    to reuse its chunks instead of extracting the PDFs again. ivf_nlist also
+    trains an IVF layout with that many cells.
+    """
+    started = time.perf_counter()
+    embedder = embedder or HashingEmbedder()
+    out_dir = Path(out_dir)
+    tmp_dir = out_dir.with_name(out_dir.name + ".tmp")
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    fingerprint = source_fingerprint(iter_source_files(source_dir))
+
+    chunks = None
+    if chunks_from:
+        with open(Path(chunks_from) / "manifest.json", encoding="utf-8") as f:
+            if json.load(f).get("fingerprint") == fingerprint:
+                chunks = ChunkStore(chunks_from).export()
+            else:
+                logger.warning("Chunks in %s are from different sources, extracting again", chunks_from)
+    if chunks is None:
+        chunks = collect_chunks(source_dir)
+    documents, chunk_doc, chunk_page, texts = chunks
+    write_chunks(tmp_dir, documents, chunk_doc, chunk_page, texts)
+
+    # Written straight into the .npy file so the matrix never has to fit in memory twice
+    vectors = np.lib.format.open_memmap(
+        tmp_dir / "embeddings.npy", mode="w+", dtype=dtype, shape=(len(texts), embedder.dim)
+    )
+    for start in range(0, len(texts), batch_size):
+        vectors[start:start + batch_size] = embedder.embed(texts[start:start + batch_size])
+    vectors.flush()
+    if ivf_nlist:
+        IVFIndex.train(vectors, nlist=ivf_nlist).save(tmp_dir)
+    del vectors
+
+    manifest = {
+        "chunks": len(texts),
+        "documents": len(documents),
+        "dim": embedder.dim,
+        "dtype": dtype,
+        "embedder": embedder.spec,
+        "fingerprint": fingerprint,
+        "built_at": time.time()
+    }
+    with open(tmp_dir / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    replace_directory(tmp_dir, out_dir)
+    logger.info(
+        "Built dense index: %d documents, %d chunks, dim %d in %.1fs",
+        len(documents), len(texts), embedder.dim, time.perf_counter() - started
+    )
+    return manifest
+
+
+def add_documents(directory, paths, client=None, batch_size=512):
+    """
+    Append the chunks of new PDFs to an existing index. Only the new chunks
+    are embedded, and they join the IVF layout without retraining it.
+    Documents already in the index are skipped.
+    """
+    started = time.perf_counter()
+    directory = Path(directory)
+    index = DenseIndex(directory, client=client, nprobe=0)
+    documents, chunk_doc, chunk_page, texts = index.chunks.export()
+
+    known = {document["filename"] for document in documents}
+    paths = [Path(path) for path in paths if Path(path).name not in known]
+    new_documents, new_doc, new_page, new_texts = collect_chunks(paths=paths)
+    if not new_texts:
+        logger.info("No new chunks to add")
+        return index.manifest
+
+    first_chunk = len(texts)
+    documents += new_documents
+    chunk_doc += [len(known) + i for i in new_doc]
+    chunk_page += new_page
+    texts += new_texts
+
+    tmp_dir = directory.with_name(directory.name + ".tmp")
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    write_chunks(tmp_dir, documents, chunk_doc, chunk_page, texts)
+
+    vectors = np.lib.format.open_memmap(
+        tmp_dir / "embeddings.npy", mode="w+", dtype=index.vectors.dtype, shape=(len(texts), index.vectors.shape[1])
+    )
+    vectors[:first_chunk] = index.vectors
+    for start in range(first_chunk, len(texts), batch_size):
+        vectors[start:start + batch_size] = index.embedder.embed(texts[start:start + batch_size])
+    vectors.flush()
+    if IVFIndex.exists(directory):
+        IVFIndex.load(directory).add(vectors[first_chunk:], np.arange(first_chunk, len(texts))).save(tmp_dir)
+    del vectors
+
+    # Chain the fingerprint so caches keyed on it see the change
+    added = source_fingerprint(paths)
+    manifest = dict(
+        index.manifest,
+        chunks=len(texts),
+        documents=len(documents),
+        fingerprint=hashlib.sha256(f"{index.fingerprint}\x1f{added}".encode("utf-8")).hexdigest(),
+        built_at=time.time()
+    )
+    with open(tmp_dir / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    replace_directory(tmp_dir, directory)
+    logger.info(
+        "Added %d documents, %d chunks to the dense index in %.1fs",
+        len(new_documents), len(new_texts), time.perf_counter() - started
+    )
+    return manifest
+
+
+def top_k(scores, k):
+    """Row-wise indices of the k largest scores, best first"""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+class DenseIndex:
+    """
+    Memory-mapped embedding matrix written by build_dense_index(). Searches
+    use the directory's IVF layout, if it has one, unless nprobe is 0.
+    """
+
+    def __init__(self, directory=DEFAULT_INDEX_DIR, embedder=None, client=None, nprobe=8):
+        directory = Path(directory)
+        with open(directory / "manifest.json", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.chunks = ChunkStore(directory)
+        self.vectors = np.load(directory / "embeddings.npy", mmap_mode="r")
+        self.embedder = embedder or embedder_from_spec(self.manifest["embedder"], client)
+        self.nprobe = nprobe
+        self.ivf = IVFIndex.load(directory) if nprobe and IVFIndex.exists(directory) else None
+
+    @property
+    def fingerprint(self):
+        return self.manifest["fingerprint"]
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def scores(self, query_vectors):
+        """Cosine similarity of each query vector with every chunk, (queries, chunks)"""
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        scores = np.empty((len(query_vectors), len(self.vectors)), dtype=np.float32)
+        for start in range(0, len(self.vectors), SCORE_BLOCK_ROWS):
+            block = self.vectors[start:start + SCORE_BLOCK_ROWS]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            scores[:, start:start + len(block)] = query_vectors @ block.T
+        return scores
+
+    def search_vectors(self, query_vectors, k=5):
+        """(chunk_ids, scores) arrays of shape (queries, k) for embedded queries"""
+        if self.ivf is not None:
+            return self.ivf.search(query_vectors, k, self.nprobe)
+        scores = self.scores(query_vectors)
+        ids = top_k(scores, k)
+        return ids, np.take_along_axis(scores, ids, axis=1)
+
+    def search_batch(self, queries, k=5):
+        """Top-k chunks for each query, as lists of ChunkStore.hit() dicts"""
+        if not queries:
+            return []
+        ids, scores = self.search_vectors(self.embedder.embed(queries), k)
+        return [
+            [
+                self.chunks.hit(chunk_id, score)
+                for chunk_id, score in zip(row_ids, row_scores)
+                if np.isfinite(score)  # IVF pads rows when the probed cells hold fewer than k chunks
+            ]
+            for row_ids, row_scores in zip(ids, scores)
+        ]
+
+    def search(self, query, k=5):
+        """Top-k chunks for query, best first"""
+        return self.search_batch([query], k)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the dense embedding index")
+    parser.add_argument("--index", default=DEFAULT_INDEX_DIR, help="index directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build")
+    build.add_argument("--source", default=str(DEFAULT_SOURCE_DIR), help="directory of PDFs to index")
+    build.add_argument("--embedder", choices=["hashing", "openai"], default="hashing")
+    build.add_argument("--dim", type=int, default=None)
+    build.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    build.add_argument("--chunks-from", default=None, help="reuse chunks from this index directory")
+    build.add_argument("--ivf-nlist", type=int, default=None, help="also build an IVF layout with this many cells")
+    add = commands.add_parser("add")
+    add.add_argument("paths", nargs="+", help="PDFs to add")
+    search = commands.add_parser("search")
+    search.add_argument("query", nargs="+")
+    search.add_argument("-k", type=int, default=5)
+    search.add_argument("--nprobe", type=int, default=8, help="IVF cells to scan, 0 for exact search")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    client = None
+    if args.command != "build" or args.embedder == "openai":
+        from dotenv import load_dotenv
+        from openai import OpenAI
+        load_dotenv()
+        if os.getenv("OPENAI_API_KEY"):
+            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    if args.command == "build":
+        if args.embedder == "openai":
+            embedder = OpenAIEmbedder(client, dim=args.dim or 512)
+        else:
+            embedder = HashingEmbedder(dim=args.dim or 384)
+        manifest = build_dense_index(
+            args.source, args.index, embedder, args.dtype, args.chunks_from, ivf_nlist=args.ivf_nlist
+        )
+        print(json.dumps(manifest, indent=2))
+    elif args.command == "add":
+        print(json.dumps(add_documents(args.index, args.paths, client), indent=2))
+    else:
+        index = DenseIndex(args.index, client=client, nprobe=args.nprobe)
+        started = time.perf_counter()
+        results = index.search_batch(args.query, args.k)
+        elapsed = (time.perf_counter() - started) * 1000
+        for query, hits in zip(args.query, results):
+            print(query)
+            for hit in hits:
+                print(f"  {hit['score']:6.3f}  {hit['filename']} (p. {hit['page']})")
+        print(f"{len(args.query)} queries in {elapsed:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Embedding functions for the dense chunk index.
+
+An embedder has a `spec` dict (stored in the index manifest so queries are
+embedded the same way as the chunks) and `embed(texts)`, which returns an
+(n, dim) float32 array of L2-normalised rows.
+"""
+import hashlib
+from functools import lru_cache
+
+import numpy as np
+
+from corpus import tokenize
+
+
+def normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+@lru_cache(maxsize=200000)
+def _feature(token, dim):
+    """Bucket and sign of a feature, stable across processes (unlike hash())"""
+    value = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+    return value % dim, 1.0 if value >> 63 else -1.0
+
+
+class HashingEmbedder:
+    """
+    Deterministic local embedder: signed feature hashing of terms and term
+    bigrams with sublinear term frequency. No model or network needed, so it
+    is used for tests and offline builds.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    @property
+    def spec(self):
+        return {"name": "hashing", "dim": self.dim}
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            terms = tokenize(text)
+            counts = {}
+            for feature in terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]:
+                counts[feature] = counts.get(feature, 0) + 1
+            for feature, count in counts.items():
+                bucket, sign = _feature(feature, self.dim)
+                vectors[row, bucket] += sign * (1.0 + np.log(count))
+        return normalize_rows(vectors)
+
+
+class OpenAIEmbedder:
+    """OpenAI embeddings API, called in batches"""
+
+    def __init__(self, client, model="text-embedding-3-small", dim=512, batch_size=256):
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.batch_size = batch_size
+
+    @property
+    def spec(self):
+        return {"name": "openai", "model": self.model, "dim": self.dim}
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            batch = list(texts[start:start + self.batch_size])
+            response = self.client.embeddings.create(model=self.model, input=batch, dimensions=self.dim)
+            for item in response.data:
+                vectors[start + item.index] = item.embedding
+        return normalize_rows(vectors)
+
+
+def embedder_from_spec(spec, client=None):
+    """Recreate the embedder described by an index manifest"""
+    if spec["name"] == "hashing":
+        return HashingEmbedder(dim=spec["dim"])
+    if spec["name"] == "openai":
+        if client is None:
+            raise ValueError("An OpenAI client is needed to embed queries for this index")
+        return OpenAIEmbedder(client, model=spec["model"], dim=spec["dim"])
+    raise ValueError(f"Unknown embedder: {spec['name']}")
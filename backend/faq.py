@@ -0,0 +1,227 @@
+"""
+Curated FAQ answers served without calling the model.
+
+The FAQ file is a JSON list of entries:
+    [
+        {
+            "id": "ndis-access",
+            "questions": ["What is NDIS access?", "How do I get access to the NDIS?"],
+            "answer": "...",
+            "citations": [{"filename": "...", "url": "...", "category": "..."}]
+        }
+    ]
+
+Every question variant is indexed as a TF-IDF vector of its terms, term
+bigrams and character trigrams (so plurals and small typos still match).
+Unlike the retrieval indexes, question words (what, why, who, ...) and
+negations are kept as terms: "Who can apply?" and "How do I apply?" are
+different questions. A user question is answered from the FAQ when its
+cosine similarity to the closest variant reaches `threshold`, the two agree
+on their question word and negation, and that entry beats the runner-up
+entry by at least `margin`; everything else goes to the model.
+
+Check how questions score against the FAQ from the backend directory:
+    python faq.py --faq faq.json "what does NDIS access mean"
+"""
+import argparse
+import json
+import logging
+import math
+import re
+from collections import Counter, defaultdict
+
+from corpus import STOPWORDS
+
+logger = logging.getLogger(__name__)
+
+INTERROGATIVES = frozenset({"how", "what", "when", "where", "which", "who", "whom", "whose", "why"})
+NEGATIONS = frozenset({"never", "no", "nor", "not"})
+
+# Stopwords that still carry meaning in a question
+_STOPWORDS = STOPWORDS - INTERROGATIVES - NEGATIONS
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# "doesn't", "can't", "cannot", ... (with straight or curly apostrophes)
+_NOT_RE = re.compile(r"\b(?:can['\u2019]t|cannot|won['\u2019]t)\b|n['\u2019]t\b")
+_IRREGULAR_NOT = {"can": "can not", "won": "will not"}
+
+
+def tokenize(text):
+    """
+    Lower-cased alphanumeric terms of a question, without single characters
+    and stopwords other than question words and negations; "n't" becomes
+    "not"
+    """
+    text = _NOT_RE.sub(lambda m: _IRREGULAR_NOT.get(m.group()[:3], " not"), text.lower())
+    return [t for t in _TOKEN_RE.findall(text) if len(t) > 1 and t not in _STOPWORDS]
+
+
+def cues(terms):
+    """(question words, whether negated) of a question's terms"""
+    return frozenset(t for t in terms if t in INTERROGATIVES), any(t in NEGATIONS for t in terms)
+
+
+def compatible(a, b):
+    """
+    Whether two questions' cues agree: the same negation, and the same
+    question words unless one of them has none ("NDIS access meaning?")
+    """
+    (asks_a, negated_a), (asks_b, negated_b) = a, b
+    return negated_a == negated_b and (not asks_a or not asks_b or asks_a == asks_b)
+
+
+def term_features(terms):
+    """Term, term-bigram and character-trigram counts of a question's terms"""
+    counts = Counter(terms)
+    counts.update(f"{a} {b}" for a, b in zip(terms, terms[1:]))
+    for term in terms:
+        padded = f"#{term}#"
+        counts.update(f"#{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    return counts
+
+
+def citation(entry):
+    """Normalise a stored citation to the shape /chat returns"""
+    return {
+        'filename': entry.get('filename'),
+        'file_id': entry.get('file_id'),
+        'metadata': {
+            'url': entry.get('url'),
+            'category': entry.get('category')
+        }
+    }
+
+
+class FAQIndex:
+    """
+    Inverted index of the FAQ question variants. match() returns
+    (entry, score) for a confident match, or None.
+    """
+
+    def __init__(self, entries, threshold=0.7, margin=0.05, counter=None):
+        self.threshold = threshold
+        self.margin = margin
+        self.counter = counter
+        self.entries = [
+            {
+                "id": entry.get("id") or str(i),
+                "answer": entry["answer"],
+                "citations": [citation(c) for c in entry.get("citations", [])]
+            }
+            for i, entry in enumerate(entries)
+        ]
+        variants = [
+            (i, tokenize(question))
+            for i, entry in enumerate(entries)
+            for question in entry["questions"]
+        ]
+
+        variants = [(entry, cues(terms), term_features(terms)) for entry, terms in variants]
+
+        document_frequency = Counter()
+        for _, _, counts in variants:
+            document_frequency.update(counts.keys())
+        n = len(variants)
+        self._idf = {f: math.log((n + 1) / (df + 1)) + 1 for f, df in document_frequency.items()}
+        self._unseen_idf = math.log(n + 1) + 1
+
+        self._variant_entry = []
+        self._variant_cues = []
+        self._postings = defaultdict(list)
+        for variant, (entry, variant_cues, counts) in enumerate(variants):
+            weights = self._weights(counts)
+            self._variant_entry.append(entry)
+            self._variant_cues.append(variant_cues)
+            for feature, weight in weights.items():
+                self._postings[feature].append((variant, weight))
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), **kwargs)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _weights(self, counts):
+        """
+        L2-normalised sublinear TF-IDF weights. Features no variant has get
+        the highest IDF, so words the FAQ does not cover lower the score.
+        """
+        weights = {
+            f: (1 + math.log(c)) * self._idf.get(f, self._unseen_idf)
+            for f, c in counts.items()
+        }
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        return {f: w / norm for f, w in weights.items()} if norm else {}
+
+    def scores(self, question):
+        """
+        Best cosine similarity per entry, highest first, over the variants
+        whose question word and negation agree with the question's
+        """
+        terms = tokenize(question)
+        question_cues = cues(terms)
+        variant_scores = defaultdict(float)
+        for feature, weight in self._weights(term_features(terms)).items():
+            for variant, variant_weight in self._postings.get(feature, ()):
+                variant_scores[variant] += weight * variant_weight
+
+        best = {}
+        for variant, score in variant_scores.items():
+            if not compatible(question_cues, self._variant_cues[variant]):
+                continue
+            entry = self._variant_entry[variant]
+            if score > best.get(entry, 0.0):
+                best[entry] = score
+        return sorted(best.items(), key=lambda item: -item[1])
+
+    def match(self, question):
+        ranked = self.scores(question)
+        matched = None
+        if ranked and ranked[0][1] >= self.threshold:
+            runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+            if ranked[0][1] - runner_up >= self.margin:
+                matched = (self.entries[ranked[0][0]], ranked[0][1])
+        if self.counter is not None:
+            self.counter.labels("hit" if matched else "miss").inc()
+        return matched
+
+
+def load_faq(path, threshold=0.7, margin=0.05, counter=None):
+    """FAQIndex from path, or None when the file is missing or invalid"""
+    try:
+        index = FAQIndex.load(path, threshold=threshold, margin=margin, counter=counter)
+    except FileNotFoundError:
+        logger.info("No FAQ file at %s; every question goes to the model", path)
+        return None
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning("Error loading FAQ from %s: %s", path, e)
+        return None
+    logger.info("FAQ loaded: %d entries", len(index))
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score questions against the FAQ")
+    parser.add_argument("questions", nargs="+")
+    parser.add_argument("--faq", default="faq.json")
+    parser.add_argument("--threshold", type=float, default=0.7)
+    parser.add_argument("--margin", type=float, default=0.05)
+    parser.add_argument("--top", type=int, default=3)
+    args = parser.parse_args()
+
+    index = FAQIndex.load(args.faq, threshold=args.threshold, margin=args.margin)
+    for question in args.questions:
+        matched = index.match(question)
+        print(json.dumps({
+            "question": question,
+            "match": matched[0]["id"] if matched else None,
+            "top": [
+                {"id": index.entries[entry]["id"], "score": round(score, 4)}
+                for entry, score in index.scores(question)[:args.top]
+            ]
+        }))
+
+
+if __name__ == "__main__":
+    main()
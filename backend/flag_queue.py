@@ -0,0 +1,273 @@
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import FLAGS_DEAD_LETTERED, FLAGS_FLUSHED, UPSTREAM_ERRORS
+
+logger = logging.getLogger(__name__)
+
+MIGRATION = "supabase/migrations/20261018000000_flags_idempotency_key.sql"
+# PostgREST error codes for a flags table without the idempotency_key
+# column, or without a unique constraint on it
+MISSING_COLUMN = {"42703", "PGRST204"}
+MISSING_CONSTRAINT = {"42P10"}
+# Statuses worth sending the same rows again for, besides 5xx; any other
+# error means Supabase refused the rows themselves
+RETRYABLE_STATUS = {408, 429}
+
+
+class FlagQueue:
+    """
+    Durable local write-behind queue for flagged responses.
+
+    /flag appends rows to a SQLite (WAL) outbox and returns immediately. A
+    background flusher batch-inserts queued rows into Supabase over a pooled
+    session, retrying timeouts, rate limits and server errors with
+    exponential backoff. A batch Supabase refuses is split in halves until
+    the rows it rejects are found; a row rejected max_attempts times moves to
+    the dead_letter table instead of blocking the outbox. Every row carries an
+    idempotency key so a batch that is re-sent after a lost response is not
+    written twice. That needs a unique idempotency_key column on the flags
+    table (see MIGRATION); without one, flushing falls back to plain inserts
+    and logs an error.
+    """
+
+    def __init__(self, path, supabase_url, headers, batch_size=50, flush_interval=1.0,
+                 lease=30.0, max_backoff=300.0, max_attempts=5, timeout=(5, 15)):
+        self.path = path
+        self.endpoint = f"{supabase_url}/rest/v1/flags"
+        self.headers = dict(headers)
+        # Cleared when the flags table turns out not to support them
+        self.upsert = True
+        self.keyed = True
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lease = lease
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS outbox_next_attempt ON outbox (next_attempt);
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                id INTEGER PRIMARY KEY,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                error TEXT,
+                created_at REAL NOT NULL,
+                failed_at REAL NOT NULL
+            );
+        """)
+
+    def _connect(self):
+        """One connection per thread; WAL lets workers append concurrently"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, payload):
+        """Persist a flag locally and return its idempotency key"""
+        key = str(uuid.uuid4())
+        self._connect().execute(
+            "INSERT INTO outbox (idempotency_key, payload, created_at) VALUES (?, ?, ?)",
+            (key, json.dumps(payload), time.time())
+        )
+        return key
+
+    def pending(self):
+        return self._connect().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def dead_letters(self):
+        return self._connect().execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+
+    def _claim(self):
+        """Lease a batch of due rows so concurrent flushers do not send them too"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, idempotency_key, payload, attempts FROM outbox "
+                "WHERE next_attempt <= ? ORDER BY id LIMIT ?",
+                (now, self.batch_size)
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE outbox SET next_attempt = ? WHERE id = ?",
+                    [(now + self.lease, row[0]) for row in rows]
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def _backoff(self, attempts):
+        delay = min(self.max_backoff, self.flush_interval * (2 ** attempts))
+        return delay * random.uniform(0.5, 1.0)
+
+    def flush_once(self):
+        """Send one batch; returns the number of rows written to Supabase"""
+        rows = self._claim()
+        if not rows:
+            return 0
+
+        written, rejected, failed = self._send(rows)
+        conn = self._connect()
+        if written:
+            conn.executemany("DELETE FROM outbox WHERE id = ?", [(row[0],) for row in written])
+            FLAGS_FLUSHED.inc(len(written))
+        if not rejected and not failed:
+            return len(written)
+
+        UPSTREAM_ERRORS.labels("supabase", "flags.insert").inc()
+        now = time.time()
+        dead = [(row, error) for row, error in rejected if row[3] + 1 >= self.max_attempts]
+        if dead:
+            logger.error(
+                "Supabase rejected %d flags %d times; moved them to the dead_letter table of %s",
+                len(dead), self.max_attempts, self.path
+            )
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO dead_letter "
+                    "(id, idempotency_key, payload, attempts, error, created_at, failed_at) "
+                    "SELECT id, idempotency_key, payload, attempts + 1, ?, created_at, ? FROM outbox WHERE id = ?",
+                    [(error, now, row[0]) for row, error in dead]
+                )
+                conn.executemany("DELETE FROM outbox WHERE id = ?", [(row[0],) for row, _ in dead])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            FLAGS_DEAD_LETTERED.inc(len(dead))
+
+        retry = failed + [row for row, _ in rejected if row[3] + 1 < self.max_attempts]
+        conn.executemany(
+            "UPDATE outbox SET attempts = attempts + 1, next_attempt = ? WHERE id = ?",
+            [(now + self._backoff(attempts), row_id) for row_id, _, _, attempts in retry]
+        )
+        return len(written)
+
+    def _send(self, rows):
+        """
+        POST rows, splitting a refused batch in halves to find the rows
+        Supabase rejects. Returns (written, rejected, failed): rejected pairs
+        each row with its error; failed rows are worth sending again as they are.
+        """
+        try:
+            response = self._post(rows)
+            if response.status_code == 400 and self._fall_back(response):
+                response = self._post(rows)
+        except requests.RequestException as e:
+            logger.warning("Error flushing %d flags: %s", len(rows), e)
+            return [], [], rows
+
+        status = response.status_code
+        if status in (200, 201, 204):
+            return rows, [], []
+        logger.warning("Supabase error flushing %d flags: %s %s", len(rows), status, response.text)
+        if status in RETRYABLE_STATUS or status >= 500:
+            return [], [], rows
+        if len(rows) == 1:
+            return [], [(rows[0], f"{status} {response.text}")], []
+
+        middle = len(rows) // 2
+        first, second = self._send(rows[:middle]), self._send(rows[middle:])
+        return tuple(a + b for a, b in zip(first, second))
+
+    def _post(self, rows):
+        if self.keyed:
+            body = [dict(json.loads(payload), idempotency_key=key) for _, key, payload, _ in rows]
+        else:
+            body = [json.loads(payload) for _, _, payload, _ in rows]
+        if self.upsert:
+            return self.session.post(
+                self.endpoint, params={"on_conflict": "idempotency_key"},
+                headers=dict(self.headers, Prefer="resolution=ignore-duplicates,return=minimal"),
+                json=body, timeout=self.timeout
+            )
+        return self.session.post(
+            self.endpoint, headers=dict(self.headers, Prefer="return=minimal"), json=body, timeout=self.timeout
+        )
+
+    def _fall_back(self, response):
+        """
+        Switch to plain inserts if the error says the flags table cannot take
+        the upsert; returns whether the batch should be sent again
+        """
+        try:
+            error = response.json()
+        except ValueError:
+            return False
+        if not isinstance(error, dict):
+            return False
+        code, message = error.get("code"), error.get("message") or ""
+        if code in MISSING_CONSTRAINT and self.upsert:
+            self.upsert = False
+        elif code in MISSING_COLUMN and "idempotency_key" in message and self.keyed:
+            self.upsert = self.keyed = False
+        else:
+            return False
+        logger.error(
+            "The Supabase flags table has no unique idempotency_key column (%s: %s). Flags are now "
+            "inserted without deduplication, so a batch re-sent after a lost response is written "
+            "twice. Apply %s to fix this.", code, message, MIGRATION
+        )
+        return True
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                # Keep draining while full batches are being sent
+                while self.flush_once() == self.batch_size:
+                    pass
+            except Exception as e:
+                logger.exception("Flag flusher error")
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+
+    def start(self):
+        """Start the background flusher thread (once per process)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="flag-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -1,7 +1,49 @@
+import gc
 import os
+import shutil
+import sys
 
 # Gunicorn config variables
 bind = "0.0.0.0:10000"  # Use a specific port
 workers = 4
-threads = 4
-timeout = 120
\ No newline at end of file
+# More threads than the chat admission limit (ADMISSION_MAX_LIMIT plus
+# ADMISSION_QUEUE_SIZE), so excess chat requests are queued or shed by the
+# app rather than blocking /flag and /flags behind them
+threads = 24
+timeout = 120
+
+# Import the app once in the master, so read-only state (config, citation
+# snapshot, indexes, FAQ) is shared copy-on-write by the workers. Each worker
+# then opens its own connections and starts its threads in post_fork.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+if preload_app:
+    # Tells server.py to leave start_worker() to post_fork
+    os.environ["PODC_PRELOAD"] = "1"
+
+# Workers write Prometheus samples here so /metrics can aggregate all of them.
+# Must be set before the app (and prometheus_client) is imported.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/podc_prometheus")
+# The preloading master imports the app (and creates metrics) before on_starting
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+def on_starting(server):
+    # Clear samples left over from a previous run
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+def when_ready(server):
+    # Keep the preloaded objects out of the collector's way, so the workers'
+    # garbage collections do not copy their pages
+    if preload_app:
+        gc.freeze()
+
+def post_fork(server, worker):
+    # asgi_server does its per-worker startup in before_serving instead
+    app_module = sys.modules.get("server")
+    if preload_app and app_module is not None:
+        app_module.start_worker()
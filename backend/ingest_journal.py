@@ -0,0 +1,143 @@
+import json
+import sqlite3
+import time
+from collections import Counter
+
+
+class IngestJournal:
+    """
+    Checkpoint journal for building a vector store.
+
+    Every file of a build moves through hashed -> uploaded -> attached ->
+    indexed (or failed), and each step is committed to SQLite as soon as it
+    happens. A build that is interrupted resumes from the journal: files
+    already uploaded are not uploaded again, uploaded files are attached,
+    and batches already created are polled instead of re-created.
+
+    Paths are relative to the build's directory. Used from one thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=10, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                vector_store_id TEXT PRIMARY KEY,
+                directory TEXT NOT NULL,
+                started_at REAL NOT NULL,
+                finished_at REAL,
+                failed INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                vector_store_id TEXT NOT NULL,
+                path TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                state TEXT NOT NULL,
+                file_id TEXT,
+                batch_id TEXT,
+                attributes TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (vector_store_id, path)
+            );
+        """)
+        # Journals written before runs recorded their failures
+        if "failed" not in {row["name"] for row in self.conn.execute("PRAGMA table_info(runs)")}:
+            self.conn.execute("ALTER TABLE runs ADD COLUMN failed INTEGER")
+
+    def unfinished_run(self, directory):
+        """Vector store ID of the latest unfinished build of directory, if any"""
+        row = self.conn.execute(
+            "SELECT vector_store_id FROM runs WHERE directory = ? AND finished_at IS NULL "
+            "ORDER BY started_at DESC LIMIT 1",
+            (directory,)
+        ).fetchone()
+        return row["vector_store_id"] if row else None
+
+    def start_run(self, vector_store_id, directory):
+        self.conn.execute(
+            "INSERT INTO runs (vector_store_id, directory, started_at) VALUES (?, ?, ?)",
+            (vector_store_id, directory, time.time())
+        )
+
+    def finish_run(self, vector_store_id, failed=0):
+        """Close the build, recording how many files failed in it"""
+        self.conn.execute(
+            "UPDATE runs SET finished_at = ?, failed = ? WHERE vector_store_id = ?",
+            (time.time(), failed, vector_store_id)
+        )
+
+    def files(self, vector_store_id, state=None):
+        """{path: row} of the build's files, optionally only those in state"""
+        query = "SELECT * FROM files WHERE vector_store_id = ?"
+        params = [vector_store_id]
+        if state is not None:
+            query += " AND state = ?"
+            params.append(state)
+        rows = {}
+        for row in self.conn.execute(query + " ORDER BY path", params):
+            row = dict(row)
+            row["attributes"] = json.loads(row["attributes"]) if row["attributes"] else None
+            rows[row["path"]] = row
+        return rows
+
+    def hashed(self, vector_store_id, scanned):
+        """
+        Bring the journal in line with the files scanned ({path: {"sha256",
+        "size", "mtime"}}): new files are added as hashed, files whose
+        content changed go back to hashed, and files no longer scanned are
+        dropped. Failed files go back to uploaded, to be attached again.
+        Returns the file IDs of uploads that no longer match a file.
+        """
+        known = self.files(vector_store_id)
+        stale = []
+        now = time.time()
+        with self.conn:
+            self.conn.execute("BEGIN")
+            for path, info in scanned.items():
+                row = known.get(path)
+                if row is not None and row["sha256"] == info["sha256"]:
+                    continue
+                if row is not None and row["file_id"]:
+                    stale.append(row["file_id"])
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO files (vector_store_id, path, sha256, size, mtime, state, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, 'hashed', ?)",
+                    (vector_store_id, path, info["sha256"], info["size"], info["mtime"], now)
+                )
+            for path, row in known.items():
+                if path not in scanned:
+                    if row["file_id"]:
+                        stale.append(row["file_id"])
+                    self.conn.execute("DELETE FROM files WHERE vector_store_id = ? AND path = ?", (vector_store_id, path))
+            self.conn.execute(
+                "UPDATE files SET state = 'uploaded', batch_id = NULL, error = NULL, updated_at = ? "
+                "WHERE vector_store_id = ? AND state = 'failed' AND file_id IS NOT NULL",
+                (now, vector_store_id)
+            )
+        return stale
+
+    def record(self, vector_store_id, path, state, **fields):
+        """Move a file to state, setting any of file_id, batch_id, attributes and error"""
+        if "attributes" in fields:
+            fields["attributes"] = json.dumps(fields["attributes"])
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        self.conn.execute(
+            f"UPDATE files SET state = ?, updated_at = ?{', ' if fields else ''}{assignments} "
+            "WHERE vector_store_id = ? AND path = ?",
+            (state, time.time(), *fields.values(), vector_store_id, path)
+        )
+
+    def counts(self, vector_store_id):
+        """Files per state"""
+        return Counter({
+            row["state"]: row["n"]
+            for row in self.conn.execute(
+                "SELECT state, COUNT(*) AS n FROM files WHERE vector_store_id = ? GROUP BY state",
+                (vector_store_id,)
+            )
+        })
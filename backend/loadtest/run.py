@@ -0,0 +1,288 @@
+"""
+Load test for the backend running under gunicorn against local stand-ins
+for OpenAI and Supabase.
+
+Starts the stubs, launches `gunicorn server:app` with gunicorn.conf.py
+(workers and threads can be overridden), drives each scenario at the given
+concurrency for a fixed duration and prints one JSON document with p50/p95/
+p99 latency, requests per second and error rate per scenario, so runs can
+be compared with different settings or code.
+
+Run from the backend directory:
+    python -m loadtest.run --concurrency 32 --duration 30
+    python -m loadtest.run --scenarios chat chat_stream --workers 2 --threads 8 --output run.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+from loadtest.stubs import OpenAIStub, SupabaseStub
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+SCENARIOS = ("chat", "chat_stream", "flag", "flags")
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, duration):
+    """Latency percentiles (ms), throughput and error rate of (seconds, ok, ttfb) samples"""
+    latencies = sorted(s[0] * 1000 for s in samples)
+    errors = sum(1 for s in samples if not s[1])
+    summary = {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "rps": round(len(samples) / duration, 2),
+        "latency_ms": {
+            "p50": _round(percentile(latencies, 50)),
+            "p95": _round(percentile(latencies, 95)),
+            "p99": _round(percentile(latencies, 99)),
+            "mean": _round(sum(latencies) / len(latencies)) if latencies else None,
+            "max": _round(latencies[-1]) if latencies else None
+        }
+    }
+    first_bytes = sorted(s[2] * 1000 for s in samples if s[2] is not None)
+    if first_bytes:
+        summary["time_to_first_event_ms"] = {
+            "p50": _round(percentile(first_bytes, 50)),
+            "p95": _round(percentile(first_bytes, 95)),
+            "p99": _round(percentile(first_bytes, 99))
+        }
+    return summary
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+class Scenario:
+    """One request type; request() returns (ok, time_to_first_event or None)"""
+
+    def __init__(self, base_url, repeat_ratio=0.0, timeout=60):
+        self.base_url = base_url
+        self.repeat_ratio = repeat_ratio
+        self.timeout = timeout
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def question(self):
+        """A fresh question, or a repeated one with probability repeat_ratio (answer cache hits)"""
+        if random.random() < self.repeat_ratio:
+            return f"What support is available for question {random.randint(0, 9)}?"
+        with self._lock:
+            self._counter += 1
+            return f"What support is available for question {self._counter} {random.random()}?"
+
+
+class ChatScenario(Scenario):
+    def request(self, session):
+        response = session.post(f"{self.base_url}/chat", json={"message": self.question()}, timeout=self.timeout)
+        return response.status_code == 200 and "response" in response.json(), None
+
+
+class ChatStreamScenario(Scenario):
+    def request(self, session):
+        started = time.perf_counter()
+        first_event = None
+        completed = False
+        with session.post(f"{self.base_url}/chat/stream", json={"message": self.question()},
+                          timeout=self.timeout, stream=True) as response:
+            if response.status_code != 200:
+                return False, None
+            for line in response.iter_lines():
+                if first_event is None and line:
+                    first_event = time.perf_counter() - started
+                if line == b"event: citations":
+                    completed = True
+                if line == b"event: error":
+                    return False, first_event
+        return completed, first_event
+
+
+class FlagScenario(Scenario):
+    def request(self, session):
+        response = session.post(f"{self.base_url}/flag", json={
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "userPrompt": self.question(),
+            "flaggedText": "load test"
+        }, timeout=self.timeout)
+        return response.status_code == 202, None
+
+
+class FlagsScenario(Scenario):
+    def request(self, session):
+        response = session.get(f"{self.base_url}/flags", params={"limit": 100}, timeout=self.timeout)
+        return response.status_code == 200, None
+
+
+SCENARIO_CLASSES = {
+    "chat": ChatScenario,
+    "chat_stream": ChatStreamScenario,
+    "flag": FlagScenario,
+    "flags": FlagsScenario
+}
+
+
+def drive(scenario, concurrency, duration, warmup=2.0):
+    """Run scenario from `concurrency` closed-loop clients; returns samples after warm-up"""
+    samples = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    def client():
+        session = requests.Session()
+        while True:
+            request_started = time.perf_counter()
+            if request_started >= deadline:
+                return
+            try:
+                ok, first_event = scenario.request(session)
+            except requests.RequestException:
+                ok, first_event = False, None
+            finished = time.perf_counter()
+            if request_started >= measure_from and finished <= deadline:
+                with lock:
+                    samples.append((finished - request_started, ok, first_event))
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/ready", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError("gunicorn did not become ready")
+
+
+def start_gunicorn(port, openai_url, supabase_url, workdir, workers=None, threads=None, app="server:app", env=None):
+    command = [sys.executable, "-m", "gunicorn", app, "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}"]
+    if workers:
+        command += ["--workers", str(workers)]
+    if threads:
+        command += ["--threads", str(threads)]
+    if app.startswith("asgi_server"):
+        command += ["-k", "uvicorn.workers.UvicornWorker"]
+
+    process_env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-loadtest",
+        OPENAI_BASE_URL=f"{openai_url}/v1",
+        SUPABASE_URL=supabase_url,
+        SUPABASE_API_KEY="loadtest",
+        FLAG_QUEUE_PATH=str(Path(workdir) / "flag_queue.sqlite3"),
+        SESSION_STORE_PATH=str(Path(workdir) / "sessions.sqlite3"),
+        PROMETHEUS_MULTIPROC_DIR=str(Path(workdir) / "prometheus"),
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+        # Every simulated client shares one address, so per-client limits are off by default
+        RATE_LIMIT_PER_MINUTE=os.getenv("RATE_LIMIT_PER_MINUTE", "0"),
+        **(env or {})
+    )
+    # A file rather than a pipe: nothing reads stderr during the run, and a
+    # full pipe would block the server's logging
+    with open(Path(workdir) / "gunicorn.log", "wb") as log:
+        return subprocess.Popen(command, cwd=BACKEND_DIR, env=process_env, stdout=subprocess.DEVNULL, stderr=log)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the backend under gunicorn with stubbed upstreams")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2, help="unmeasured seconds before each scenario")
+    parser.add_argument("--workers", type=int, default=None, help="override gunicorn.conf.py workers")
+    parser.add_argument("--threads", type=int, default=None, help="override gunicorn.conf.py threads")
+    parser.add_argument("--app", default="server:app", help="server:app or asgi_server:app")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="share of repeated (cacheable) questions")
+    parser.add_argument("--openai-latency", type=float, default=0.5)
+    parser.add_argument("--openai-jitter", type=float, default=0.1)
+    parser.add_argument("--stream-deltas", type=int, default=20)
+    parser.add_argument("--delta-interval", type=float, default=0.02)
+    parser.add_argument("--annotations", type=int, default=3)
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--supabase-latency", type=float, default=0.02)
+    parser.add_argument("--output", default=None, help="write the JSON report here as well as stdout")
+    args = parser.parse_args()
+
+    openai_stub = OpenAIStub(
+        latency=args.openai_latency, jitter=args.openai_jitter, stream_deltas=args.stream_deltas,
+        delta_interval=args.delta_interval, annotations=args.annotations, error_rate=args.openai_error_rate
+    ).start()
+    supabase_stub = SupabaseStub(latency=args.supabase_latency).start()
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    report = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": dict(vars(args), python=platform.python_version(), cpus=os.cpu_count()),
+        "scenarios": {}
+    }
+
+    with tempfile.TemporaryDirectory(prefix="podc-loadtest-") as workdir:
+        process = start_gunicorn(port, openai_stub.url, supabase_stub.url, workdir,
+                                 args.workers, args.threads, args.app)
+        try:
+            wait_ready(base_url, process)
+            for name in args.scenarios:
+                scenario = SCENARIO_CLASSES[name](base_url, repeat_ratio=args.repeat_ratio)
+                samples = drive(scenario, args.concurrency, args.duration, args.warmup)
+                report["scenarios"][name] = summarize(samples, args.duration)
+            report["upstream_calls"] = {"openai_responses": openai_stub.calls}
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            openai_stub.stop()
+            supabase_stub.stop()
+            if process.returncode not in (0, -15) and not report["scenarios"]:
+                log = (Path(workdir) / "gunicorn.log").read_bytes()
+                sys.stderr.write(log.decode("utf-8", "replace")[-4000:])
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Local stand-ins for the OpenAI and Supabase APIs used by the load tests.
+
+OpenAIStub serves the endpoints the backend calls (POST /v1/responses, with
+and without streaming, the vector store file list/retrieve endpoints and
+GET /v1/models/{id} for warm-up)
+with configurable latency, annotations and error rate. Point the OpenAI SDK
+at it with OPENAI_BASE_URL=http://host:port/v1.
+
+SupabaseStub serves PostgREST-style GET and POST /rest/v1/flags from an
+in-memory table. Point the backend at it with SUPABASE_URL.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubServer:
+    """Runs a handler class on a daemon thread; port 0 picks a free port"""
+
+    def __init__(self, handler, host="127.0.0.1", port=0):
+        self.httpd = _Server((host, port), handler)
+        self.httpd.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class OpenAIStub(StubServer):
+    """
+    latency: seconds before a response (or the first streamed delta) is
+    sent, with +/- jitter. stream_deltas chunks are streamed delta_interval
+    seconds apart. Each reply cites `annotations` of `files` distinct files.
+    A fraction error_rate of /v1/responses calls fail with a 500.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.1, stream_deltas=20, delta_interval=0.02,
+                 annotations=3, files=50, error_rate=0.0, **kwargs):
+        super().__init__(_OpenAIHandler, **kwargs)
+        self.latency = latency
+        self.jitter = jitter
+        self.stream_deltas = stream_deltas
+        self.delta_interval = delta_interval
+        self.annotations = annotations
+        self.files = files
+        self.error_rate = error_rate
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def file_attributes(self, n):
+        return {
+            "filename": f"document-{n}_NEW.pdf",
+            "category": "Parent and Teacher Resources",
+            "version": "NEW",
+            "url": f"https://example.org/document-{n}.pdf"
+        }
+
+    def response(self, text):
+        with self._lock:
+            self.calls += 1
+        cited = random.sample(range(self.files), min(self.annotations, self.files))
+        return {
+            "id": f"resp_{uuid.uuid4().hex}",
+            "object": "response",
+            "created_at": int(time.time()),
+            "status": "completed",
+            "model": "gpt-4o-mini",
+            "output": [{
+                "type": "message",
+                "id": f"msg_{uuid.uuid4().hex}",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{
+                    "type": "output_text",
+                    "text": text,
+                    "annotations": [
+                        {"type": "file_citation", "file_id": f"file-{n}", "filename": f"document-{n}_NEW.pdf", "index": 0}
+                        for n in cited
+                    ]
+                }]
+            }],
+            "usage": {"input_tokens": 900, "output_tokens": 120, "total_tokens": 1020}
+        }
+
+
+class _OpenAIHandler(_Handler):
+    def do_POST(self):
+        stub = self.server.stub
+        path = urlparse(self.path).path
+        if path == "/v1/responses":
+            body = self.read_json()
+            if random.random() < stub.error_rate:
+                stub.delay()
+                return self.send_json(500, {"error": {"message": "stub error", "type": "server_error"}})
+            if body.get("stream"):
+                return self.stream_response(stub)
+            stub.delay()
+            return self.send_json(200, stub.response(self.reply_text(stub)))
+        if path == "/v1/embeddings":
+            inputs = self.read_json()["input"]
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            dim = 64
+            data = [
+                {"object": "embedding", "index": i, "embedding": [random.gauss(0, 1) for _ in range(dim)]}
+                for i in range(len(inputs))
+            ]
+            return self.send_json(200, {"object": "list", "data": data, "model": "stub"})
+        self.send_json(404, {"error": {"message": f"No stub for POST {path}"}})
+
+    def do_GET(self):
+        stub = self.server.stub
+        path = urlparse(self.path).path
+        match = re.fullmatch(r"/v1/models/([^/]+)", path)
+        if match:
+            return self.send_json(200, {"id": match.group(1), "object": "model", "created": 0, "owned_by": "stub"})
+        match = re.fullmatch(r"/v1/vector_stores/([^/]+)/files/([^/]+)", path)
+        if match:
+            suffix = match.group(2).rsplit("-", 1)[-1]
+            n = int(suffix) if suffix.isdigit() else 0
+            return self.send_json(200, {
+                "id": match.group(2),
+                "object": "vector_store.file",
+                "vector_store_id": match.group(1),
+                "status": "completed",
+                "attributes": stub.file_attributes(n)
+            })
+        match = re.fullmatch(r"/v1/vector_stores/([^/]+)/files", path)
+        if match:
+            data = [
+                {"id": f"file-{n}", "object": "vector_store.file", "vector_store_id": match.group(1),
+                 "status": "completed", "attributes": stub.file_attributes(n)}
+                for n in range(stub.files)
+            ]
+            return self.send_json(200, {
+                "object": "list", "data": data, "has_more": False,
+                "first_id": data[0]["id"] if data else None, "last_id": data[-1]["id"] if data else None
+            })
+        self.send_json(404, {"error": {"message": f"No stub for GET {path}"}})
+
+    @staticmethod
+    def reply_text(stub):
+        return " ".join(f"word{i}" for i in range(stub.stream_deltas * 3))
+
+    def stream_response(self, stub):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        text = self.reply_text(stub)
+        words = text.split(" ")
+        step = max(1, len(words) // max(1, stub.stream_deltas))
+        sequence = 0
+
+        def send(event_type, data):
+            nonlocal sequence
+            data = dict(data, type=event_type, sequence_number=sequence)
+            sequence += 1
+            self.wfile.write(f"event: {event_type}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        stub.delay()
+        for start in range(0, len(words), step):
+            delta = " ".join(words[start:start + step]) + (" " if start + step < len(words) else "")
+            send("response.output_text.delta", {
+                "item_id": "msg_stub", "output_index": 0, "content_index": 0, "delta": delta, "logprobs": []
+            })
+            time.sleep(stub.delta_interval)
+        send("response.completed", {"response": stub.response(text)})
+
+
+class SupabaseStub(StubServer):
+    """In-memory flags table with `rows` pre-seeded rows"""
+
+    def __init__(self, rows=5000, latency=0.02, **kwargs):
+        super().__init__(_SupabaseHandler, **kwargs)
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.keys = set()
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        self.rows = [
+            {
+                "id": i,
+                "timestamp": (start + timedelta(minutes=i)).isoformat(),
+                "user_prompt": f"question {i}",
+                "flagged_text": f"answer {i}"
+            }
+            for i in range(1, rows + 1)
+        ]
+
+    def page(self, limit, before=None):
+        rows = self.rows[::-1]
+        if before is not None:
+            rows = [r for r in rows if (r["timestamp"], r["id"]) < before]
+        return rows[:limit]
+
+    def insert(self, rows):
+        with self._lock:
+            for row in rows:
+                key = row.get("idempotency_key")
+                if key in self.keys:
+                    continue
+                self.keys.add(key)
+                self.rows.append(dict(row, id=len(self.rows) + 1))
+
+
+class _SupabaseHandler(_Handler):
+    def do_GET(self):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        if url.path != "/rest/v1/flags":
+            return self.send_json(404, {"message": f"No stub for GET {url.path}"})
+        query = parse_qs(url.query)
+        limit = int(query.get("limit", ["100"])[0])
+        before = None
+        if "or" in query:
+            match = re.search(r'timestamp\.lt\."([^"]+)".*id\.lt\.(\d+)', query["or"][0])
+            if match:
+                before = (match.group(1), int(match.group(2)))
+        time.sleep(stub.latency)
+        self.send_json(200, stub.page(limit, before))
+
+    def do_POST(self):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        if url.path != "/rest/v1/flags":
+            return self.send_json(404, {"message": f"No stub for POST {url.path}"})
+        body = self.read_json()
+        stub.insert(body if isinstance(body, list) else [body])
+        time.sleep(stub.latency)
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
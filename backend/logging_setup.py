@@ -0,0 +1,147 @@
+"""
+Structured, non-blocking logging for the backend.
+
+Request threads only put records on an in-memory queue; a single
+QueueListener thread formats them as JSON lines and writes to stdout.
+Records carry the current request ID, user text is replaced by its length
+and a short hash, secrets are masked, and DEBUG records can be sampled.
+"""
+import atexit
+import contextvars
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+# Extra fields that hold user-supplied text and are never logged verbatim
+USER_TEXT_FIELDS = {"user_message", "user_prompt", "flagged_text", "reply"}
+
+SECRET_PATTERNS = [
+    re.compile(r"sk-[A-Za-z0-9_\-]{8,}"),
+    re.compile(r"(?i)bearer\s+[A-Za-z0-9._\-]+"),
+    re.compile(r"eyJ[A-Za-z0-9_\-]+\.[A-Za-z0-9_\-]+\.[A-Za-z0-9_\-]+"),
+]
+
+# Attributes every LogRecord has; anything else was passed via extra=
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+
+def redact(text):
+    for pattern in SECRET_PATTERNS:
+        text = pattern.sub("[REDACTED]", text)
+    return text
+
+
+def summarize_text(text):
+    """Stand-in for user text: enough to correlate records, nothing readable"""
+    if text is None:
+        return None
+    text = str(text)
+    return {"chars": len(text), "sha256": hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]}
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the current request ID and redact secrets and user text"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        record.msg = redact(record.getMessage())
+        record.args = None
+        if record.exc_info:
+            record.exc_text = redact(logging.Formatter().formatException(record.exc_info))
+        for field in USER_TEXT_FIELDS:
+            if field in record.__dict__:
+                record.__dict__[field] = summarize_text(record.__dict__[field])
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of DEBUG records; other levels always pass"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = redact(self.formatException(record.exc_info))
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+_listener = None
+_queue_handler = None
+
+
+def _start_listener(handlers):
+    """Give the queue handler a fresh queue and a listener thread draining it"""
+    global _listener
+    log_queue = queue.SimpleQueue()
+    _queue_handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_after_fork():
+    # The listener thread does not survive fork (e.g. gunicorn preload), so
+    # without this a child's records would pile up in a queue nothing reads
+    if _listener is not None:
+        _start_listener(_listener.handlers)
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def setup_logging():
+    """
+    Route the root logger through a queue to a JSON stdout handler. Safe to
+    call more than once, and before forking; LOG_LEVEL and
+    LOG_DEBUG_SAMPLE_RATE configure it.
+    """
+    global _queue_handler
+    if _listener is not None:
+        return _listener
+
+    _queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    _queue_handler.addFilter(SamplingFilter(float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))))
+    # Filters on the producing side, so the request ID is captured in the request's context
+    _queue_handler.addFilter(RequestContextFilter())
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [_queue_handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    _start_listener([stream_handler])
+    os.register_at_fork(after_in_child=_restart_after_fork)
+    atexit.register(_stop_listener)
+    return _listener
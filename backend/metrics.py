@@ -0,0 +1,121 @@
+"""
+Prometheus metrics for the chat backend.
+
+Under gunicorn every worker is a separate process, so when
+PROMETHEUS_MULTIPROC_DIR is set (gunicorn.conf.py does this) each worker
+writes its samples there and /metrics aggregates all of them.
+"""
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+REQUEST_SECONDS = Histogram(
+    "podc_request_seconds",
+    "End-to-end request latency",
+    ["endpoint", "status"],
+    buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "podc_stage_seconds",
+    "Latency of individual stages of a request",
+    ["endpoint", "stage"],
+    buckets=LATENCY_BUCKETS
+)
+TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    "podc_time_to_first_token_seconds",
+    "Time from request start to the first streamed output-text delta",
+    buckets=LATENCY_BUCKETS
+)
+IN_FLIGHT = Gauge(
+    "podc_in_flight_requests",
+    "Requests currently being served",
+    ["endpoint"],
+    multiprocess_mode="livesum"
+)
+UPSTREAM_ERRORS = Counter(
+    "podc_upstream_errors_total",
+    "Failed calls to upstream services",
+    ["upstream", "operation"]
+)
+UPSTREAM_RETRIES = Counter(
+    "podc_upstream_retries_total",
+    "Retried upstream call attempts",
+    ["upstream"]
+)
+CIRCUIT_BREAKER = Counter(
+    "podc_circuit_breaker_events_total",
+    "Circuit breaker transitions (opened, half_open, closed) and calls it rejected",
+    ["breaker", "event"]
+)
+HEDGED_REQUESTS = Counter(
+    "podc_hedged_requests_total",
+    "Hedged upstream attempts sent, and how many of them won",
+    ["upstream", "result"]
+)
+TOKENS = Counter(
+    "podc_tokens_total",
+    "Tokens reported in OpenAI response usage",
+    ["kind"]
+)
+ANSWER_CACHE = Counter(
+    "podc_answer_cache_lookups_total",
+    "Answer cache lookups by result",
+    ["result"]
+)
+FAQ_LOOKUPS = Counter(
+    "podc_faq_lookups_total",
+    "Questions checked against the curated FAQ by result",
+    ["result"]
+)
+COALESCED = Counter(
+    "podc_singleflight_calls_total",
+    "Chat requests by whether they led an upstream call or were coalesced onto one",
+    ["role"]
+)
+ROUTED_QUERIES = Counter(
+    "podc_routed_queries_total",
+    "Questions routed to each knowledge base category (all: not narrowed)",
+    ["category"]
+)
+ADMISSION = Counter(
+    "podc_admission_total",
+    "Chat requests by admission result (admitted, queued, rejected, timed_out, rate_limited)",
+    ["result"]
+)
+CONCURRENCY_LIMIT = Gauge(
+    "podc_concurrency_limit",
+    "Adaptive limit on concurrent upstream chat calls, summed over workers",
+    multiprocess_mode="livesum"
+)
+FLAGS_FLUSHED = Counter(
+    "podc_flags_flushed_total",
+    "Flags written from the local outbox to Supabase"
+)
+FLAGS_DEAD_LETTERED = Counter(
+    "podc_flags_dead_lettered_total",
+    "Flags Supabase kept rejecting, moved from the outbox to its dead_letter table"
+)
+
+
+def record_usage(response):
+    """Add the token usage of a completed OpenAI response to the counters"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    TOKENS.labels("input").inc(getattr(usage, "input_tokens", 0) or 0)
+    TOKENS.labels("output").inc(getattr(usage, "output_tokens", 0) or 0)
+
+
+def render():
+    """Return (body, content_type) for the /metrics endpoint"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
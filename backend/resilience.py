@@ -0,0 +1,343 @@
+"""
+Retries, circuit breaking and hedging for upstream calls.
+
+An UpstreamPolicy wraps calls to one upstream. Each call is given an
+overall deadline, and fn is called as fn(timeout=seconds) with whatever is
+left of it. Retryable errors (connection errors, timeouts, 408, 429 and 5xx
+responses) are retried with full-jitter exponential backoff while
+attempts and time remain; anything else is raised straight away. The OpenAI
+clients are created with max_retries=0 so the SDK does not retry underneath.
+
+A CircuitBreaker opens after a run of calls that failed with retryable
+errors, once their retries were spent, and fails calls fast with
+CircuitOpen until reset_timeout has passed, then lets a single probe
+through to decide whether to close again.
+
+With hedging on, an attempt that has not finished after the p95 of recent
+latencies is raced against a second identical attempt, and the first
+success wins. It costs an extra upstream call on the slowest ~5% of
+requests, so it is opt-in.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import openai
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {408, 429}
+
+
+class CircuitOpen(Exception):
+    """The upstream is failing; retry_after is when the breaker lets a probe through"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} circuit breaker is open")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def is_retryable(error):
+    if isinstance(error, (openai.APIConnectionError, DeadlineExceeded)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+def retry_after_hint(error):
+    """Seconds from a Retry-After header on a failed response, if any"""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after failure_threshold consecutive failed calls;
+    open -> half-open after reset_timeout seconds; half-open lets one probe
+    through and closes on its success or reopens on its failure.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, counter=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.counter = counter
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _event(self, event):
+        if self.counter is not None:
+            self.counter.labels(self.name, event).inc()
+
+    def allow(self):
+        """Raise CircuitOpen unless a call may go ahead"""
+        with self._lock:
+            if self.state == "open":
+                waited = time.monotonic() - self._opened_at
+                if waited < self.reset_timeout:
+                    self._event("rejected")
+                    raise CircuitOpen(self.name, max(1, int(self.reset_timeout - waited)))
+                self.state = "half_open"
+                self._probing = False
+                self._event("half_open")
+                logger.info("%s circuit breaker half-open", self.name)
+            if self.state == "half_open":
+                if self._probing:
+                    self._event("rejected")
+                    raise CircuitOpen(self.name, 1)
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self.state != "closed":
+                self.state = "closed"
+                self._event("closed")
+                logger.info("%s circuit breaker closed", self.name)
+
+    def abandon(self):
+        """A call ended without a verdict (it was cancelled); let another probe through"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == "half_open" or (self.state == "closed" and self._failures >= self.failure_threshold):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._event("opened")
+                logger.warning("%s circuit breaker opened after %d failures", self.name, self._failures)
+
+
+class LatencyTracker:
+    """Latencies of the last `window` successful attempts"""
+
+    def __init__(self, window=256, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+
+    def quantile(self, q):
+        samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class UpstreamPolicy:
+    """
+    Deadline, retry, circuit breaker and hedging settings for the calls of
+    one upstream. call() is for blocking functions, acall() for coroutine
+    functions; both take hedge=False to opt a call out (e.g. streams).
+    """
+
+    def __init__(self, name, deadline=60.0, attempts=3, base_delay=0.25, max_delay=4.0,
+                 breaker=None, hedge=False, hedge_quantile=0.95, hedge_min_delay=0.5,
+                 retry_counter=None, hedge_counter=None, hedge_workers=16):
+        self.name = name
+        self.deadline = deadline
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.retry_counter = retry_counter
+        self.hedge_counter = hedge_counter
+        self.latency = LatencyTracker()
+        self._hedge_workers = hedge_workers
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None until enough latencies were seen"""
+        quantile = self.latency.quantile(self.hedge_quantile)
+        return None if quantile is None else max(self.hedge_min_delay, quantile)
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        hint = retry_after_hint(error)
+        return max(delay, hint) if hint is not None else delay
+
+    def _on_error(self, error, attempt, deadline_at):
+        """Backoff before the next attempt, or re-raise when there is none"""
+        if not is_retryable(error) or attempt >= self.attempts:
+            raise error
+        delay = self._backoff(attempt, error)
+        if time.monotonic() + delay >= deadline_at:
+            raise error
+        if self.retry_counter is not None:
+            self.retry_counter.labels(self.name).inc()
+        logger.warning("Retrying %s in %.2fs after attempt %d failed: %s", self.name, delay, attempt, error)
+        return delay
+
+    def _allow(self):
+        if self.breaker is not None:
+            self.breaker.allow()
+
+    def _outcome(self, error):
+        """Record a whole call, retries included, with the breaker"""
+        if self.breaker is None:
+            return
+        if error is not None and not isinstance(error, Exception):
+            # Cancelled: no verdict on the upstream
+            self.breaker.abandon()
+        elif error is not None and is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            # A non-retryable error still means the upstream answered
+            self.breaker.record_success()
+
+    def _remaining(self, deadline_at):
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"{self.name} deadline exceeded")
+        return remaining
+
+    def _count_hedge(self, result):
+        if self.hedge_counter is not None:
+            self.hedge_counter.labels(self.name, result).inc()
+
+    # Blocking calls
+
+    def call(self, fn, deadline=None, hedge=None):
+        self._allow()
+        try:
+            result = self._retried(fn, deadline, hedge)
+        except BaseException as error:
+            self._outcome(error)
+            raise
+        self._outcome(None)
+        return result
+
+    def _retried(self, fn, deadline, hedge):
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        hedge = self.hedge if hedge is None else hedge
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = self._remaining(deadline_at)
+            try:
+                return self._hedged(fn, timeout) if hedge else self._timed(fn, timeout)
+            except Exception as error:
+                time.sleep(self._on_error(error, attempt, deadline_at))
+
+    def _timed(self, fn, timeout):
+        started = time.perf_counter()
+        result = fn(timeout=timeout)
+        self.latency.observe(time.perf_counter() - started)
+        return result
+
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self._hedge_workers, thread_name_prefix=f"hedge-{self.name}")
+            return self._pool
+
+    def _hedged(self, fn, timeout):
+        delay = self.hedge_delay()
+        if delay is None or delay >= timeout:
+            return self._timed(fn, timeout)
+
+        pool = self._executor()
+        first = pool.submit(self._timed, fn, timeout)
+        done, _ = wait([first], timeout=delay)
+        if not done:
+            self._count_hedge("sent")
+            second = pool.submit(self._timed, fn, timeout - delay)
+            pending = {first, second}
+            error = None
+            # The losing attempt finishes in the background and is discarded
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is second:
+                            self._count_hedge("won")
+                        return future.result()
+                    error = future.exception()
+            raise error
+        return first.result()
+
+    # Coroutine calls
+
+    async def acall(self, fn, deadline=None, hedge=None):
+        self._allow()
+        try:
+            result = await self._aretried(fn, deadline, hedge)
+        except BaseException as error:
+            self._outcome(error)
+            raise
+        self._outcome(None)
+        return result
+
+    async def _aretried(self, fn, deadline, hedge):
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        hedge = self.hedge if hedge is None else hedge
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = self._remaining(deadline_at)
+            try:
+                return await (self._ahedged(fn, timeout) if hedge else self._atimed(fn, timeout))
+            except Exception as error:
+                await asyncio.sleep(self._on_error(error, attempt, deadline_at))
+
+    async def _atimed(self, fn, timeout):
+        started = time.perf_counter()
+        result = await fn(timeout=timeout)
+        self.latency.observe(time.perf_counter() - started)
+        return result
+
+    async def _ahedged(self, fn, timeout):
+        delay = self.hedge_delay()
+        if delay is None or delay >= timeout:
+            return await self._atimed(fn, timeout)
+
+        tasks = {asyncio.ensure_future(self._atimed(fn, timeout))}
+        first = next(iter(tasks))
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return first.result()
+            self._count_hedge("sent")
+            second = asyncio.ensure_future(self._atimed(fn, timeout - delay))
+            tasks.add(second)
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count_hedge("won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The losing attempt is cancelled
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
@@ -0,0 +1,152 @@
+"""
+Query routing for the hosted file_search tool.
+
+Questions are matched against a keyword lexicon of the knowledge base
+categories (the COMBINED folder names, stored as the `category` attribute of
+every vector store file), and file_search is restricted to the likely
+categories. _OLD documents that have a _NEW replacement in the same category
+are excluded, so superseded versions do not take up result slots.
+"""
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_YEAR_RE = re.compile(r"(?<!\d)(?:19|20)\d\d(?!\d)")
+
+# Words that point at one category. Words common to questions about any of
+# them (hearing, aid, plan, access, help, home, parents, ...) are left out,
+# since a filter on the wrong category hides the right documents.
+CATEGORY_KEYWORDS = {
+    "Australian Federal Laws and Policies": {
+        "law", "laws", "legislation", "federal", "commonwealth", "discrimination", "dda",
+        "tribunal", "complaint", "complaints", "legal", "parliament"
+    },
+    "Early Intervention": {
+        "intervention", "newborn", "baby", "babies", "infant", "infants", "toddler", "toddlers",
+        "diagnosis", "diagnosed", "screening", "preschool", "kindergarten", "birth"
+    },
+    "Education": {
+        "school", "schools", "education", "teacher", "teachers", "classroom", "student", "students",
+        "curriculum", "university", "enrol", "enrolment", "enrollment"
+    },
+    "Global Disability Frameworks": {
+        "un", "nations", "convention", "crpd", "international", "global", "unesco", "unicef",
+        "worldwide"
+    },
+    "Language Development Tools & Assessment Resources for DHH Children": {
+        "language", "assessment", "assess", "milestones", "vocabulary", "speech", "talk", "talking",
+        "speak", "speaking", "auslan", "signing", "bilingual", "literacy", "checklist"
+    },
+    "NDIS Access, Assistive Technology and Carer Inclusion": {
+        "ndis", "assistive", "cochlear", "implant", "implants", "carer", "carers", "eligibility",
+        "eligible"
+    },
+    "Parent and Teacher Resources": {
+        "parenting", "siblings", "activities", "games"
+    },
+    "State and Territory Policies (AUSTRALIA)": {
+        "territory", "nsw", "vic", "victoria", "qld", "queensland", "wa", "sa", "tas", "tasmania",
+        "canberra", "nt", "sydney", "melbourne", "brisbane", "perth", "adelaide", "hobart",
+        "darwin"
+    },
+}
+
+
+def classify(question, max_categories=2, min_share=0.5):
+    """
+    Likely categories for a question, best first. A category needs at least
+    min_share of the best category's keyword hits. An empty list means the
+    question is not specific enough to narrow the search: it matches no
+    category, or more than max_categories.
+    """
+    words = set(_WORD_RE.findall(question.lower()))
+    scores = {category: len(words & keywords) for category, keywords in CATEGORY_KEYWORDS.items()}
+    best = max(scores.values(), default=0)
+    if best == 0:
+        return []
+    ranked = sorted((c for c in scores if scores[c] >= best * min_share), key=lambda c: -scores[c])
+    return ranked if len(ranked) <= max_categories else []
+
+
+def _name_words(filename):
+    name = re.sub(r"_(OLD|NEW)\.pdf$", "", filename, flags=re.IGNORECASE)
+    return set(_WORD_RE.findall(name.lower()))
+
+
+def superseded_files(files, threshold=0.6):
+    """
+    Filenames of _OLD documents that have a _NEW replacement in the same
+    category: names sharing most of their words and naming the same years.
+    files are vector store attribute dicts (filename, category, version).
+    """
+    files = [attributes for attributes in files if attributes.get("filename")]
+    new_by_category = {}
+    for attributes in files:
+        if attributes.get("version") == "NEW":
+            new_by_category.setdefault(attributes.get("category"), []).append(attributes["filename"])
+
+    superseded = set()
+    for attributes in files:
+        if attributes.get("version") != "OLD":
+            continue
+        filename = attributes["filename"]
+        words, years = _name_words(filename), set(_YEAR_RE.findall(filename))
+        for replacement in new_by_category.get(attributes.get("category"), []):
+            other = _name_words(replacement)
+            if years == set(_YEAR_RE.findall(replacement)) and len(words & other) >= threshold * len(words | other):
+                superseded.add(filename)
+                break
+    return superseded
+
+
+def file_search_filters(categories, excluded_filenames=()):
+    """Attribute filter for the file_search tool, or None for no filtering"""
+    filters = []
+    if len(categories) == 1:
+        filters.append({"type": "eq", "key": "category", "value": categories[0]})
+    elif categories:
+        filters.append({
+            "type": "or",
+            "filters": [{"type": "eq", "key": "category", "value": c} for c in categories]
+        })
+    filters.extend({"type": "ne", "key": "filename", "value": f} for f in sorted(excluded_filenames))
+
+    if not filters:
+        return None
+    if len(filters) == 1:
+        return filters[0]
+    return {"type": "and", "filters": filters}
+
+
+class QueryRouter:
+    """
+    Builds file_search filters for questions. snapshot_fn returns the
+    (fingerprint, file attribute dicts) of the vector store; superseded
+    files are worked out once per fingerprint. counter is an optional
+    Prometheus counter labelled by category.
+    """
+
+    def __init__(self, snapshot_fn, max_categories=2, counter=None):
+        self.snapshot_fn = snapshot_fn
+        self.max_categories = max_categories
+        self.counter = counter
+        self._fingerprint = None
+        self._superseded = frozenset()
+
+    def superseded(self):
+        fingerprint, files = self.snapshot_fn()
+        if fingerprint != self._fingerprint:
+            self._superseded = frozenset(superseded_files(files))
+            self._fingerprint = fingerprint
+            logger.info("%d superseded _OLD documents excluded from search", len(self._superseded))
+        return self._superseded
+
+    def filters(self, question):
+        categories = classify(question, self.max_categories)
+        if self.counter is not None:
+            for category in categories or ["all"]:
+                self.counter.labels(category).inc()
+        logger.debug("Routed question", extra={"categories": categories})
+        return file_search_filters(categories, self.superseded())
@@ -1,208 +1,608 @@
-from flask import Flask, request, jsonify, Response, stream_with_context
+from flask import Flask, g, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
+import openai
 from openai import OpenAI
 import os
-from dotenv import load_dotenv, find_dotenv
-import json
+import logging
 import requests
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-SUPABASE_URL = "https://jqcnepfjbcpgsulzbfna.supabase.co"
-SUPABASE_API_KEY = os.environ.get("SUPABASE_API_KEY")
+# Configure logging before the other backend modules start logging
+from logging_setup import request_id_var, setup_logging
+setup_logging()
 
-# Load environment variables from .env with debugging
-env_path = find_dotenv()
-if env_path:
-    print(f"Found .env file at: {env_path}")
-    load_dotenv(env_path)
-else:
-    print("No .env file found!")
+from admission import AdmissionController, Rejected
+from chat_common import (
+    CORS_ORIGINS, FAQ_PATH, FAQ_THRESHOLD, FLAGS_MAX_PAGE_SIZE, LOCAL_TOP_K, MODEL, PREWARM_CONCURRENCY,
+    QUERY_ROUTING, SINGLEFLIGHT_TIMEOUT, SUPABASE_URL, VECTOR_STORE_ID,
+    admission_settings, answer_cache_for, build_citation, cache_key, cached_answer, chat_body, chat_message,
+    client_key, client_rate_limiter, collect_file_citations, flag_outbox, flag_payload, flags_page,
+    flags_page_cache, flags_page_headers, flags_page_params, knowledge_base_version, load_local_index,
+    local_citations, ndjson_lines, next_cursor, parse_page_size, prewarm_questions, rejection_response,
+    replay_answer, response_params, server_error_response, session_exhausted_response, session_store,
+    sse_event, stats_body, stream_error_event, supabase_headers, turn_args, upstream_error_response,
+    upstream_policies, wants_ndjson, wants_session, warmup_result
+)
+from citation_cache import CitationMetadataCache
+from faq import load_faq
+from metrics import (
+    COALESCED, FAQ_LOOKUPS, IN_FLIGHT, REQUEST_SECONDS, ROUTED_QUERIES, STAGE_SECONDS,
+    TIME_TO_FIRST_TOKEN_SECONDS, UPSTREAM_ERRORS, record_usage, render
+)
+from routing import QueryRouter
+from sessions import SessionBudgetExceeded
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app, resources={
     r"/*": {
-        "origins": [
-            "http://localhost:5000",
-            "https://podc-chatbot-frontend-v2.onrender.com",
-            "https://*.onrender.com",
-            "https://macquarieuniversity.wildapricot.org/", #Change to PODC domain for integration
-            "https://*.wildapricot.org"
-        ],
+        "origins": CORS_ORIGINS,
         "methods": ["GET", "POST"],
-        "allow_headers": ["Content-Type"]
+        "allow_headers": ["Content-Type", "If-None-Match", "X-Request-ID"],
+        "expose_headers": ["ETag", "Link", "X-Next-Cursor", "X-Request-ID"]
     }
 })
 
 
+@app.before_request
+def start_request_timer():
+    request_id_var.set(request.headers.get("X-Request-ID") or uuid.uuid4().hex)
+    g.request_started = time.perf_counter()
+    g.endpoint_label = request.url_rule.rule if request.url_rule else "unmatched"
+    IN_FLIGHT.labels(g.endpoint_label).inc()
+
+@app.after_request
+def record_status(response):
+    g.response_status = response.status_code
+    response.headers["X-Request-ID"] = request_id_var.get()
+    return response
+
+@app.teardown_request
+def observe_request(exc):
+    # Can run twice for streamed responses; only the first call counts
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    request_id_var.set(None)
+    IN_FLIGHT.labels(g.endpoint_label).dec()
+    status = g.get("response_status", 500)
+    REQUEST_SECONDS.labels(g.endpoint_label, str(status)).observe(time.perf_counter() - started)
+
+
 # Set up OpenAI client using the key from environment
 api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     raise ValueError("No API key found. Please check your .env file")
 else:
-    print(f"API key loaded")
+    logger.info("API key loaded")
 
-client = OpenAI(api_key=api_key)
+def openai_client():
+    # Retries are done by openai_policy and vector_store_policy instead of the SDK
+    return OpenAI(api_key=api_key, max_retries=0)
+
+# Replaced in each worker by start_worker(), so no connection is shared across a fork
+client = openai_client()
+
+# Deadline, retries, circuit breaker and optional hedging for upstream calls
+openai_policy, vector_store_policy = upstream_policies()
+
+# Optional local retrieval in place of the hosted file_search tool
+local_index = load_local_index(client)
+
+# Snapshot of vector store file attributes used to resolve citations
+citation_cache = CitationMetadataCache(
+    client,
+    VECTOR_STORE_ID,
+    ttl=int(os.getenv("CITATION_CACHE_TTL", "3600")),
+    policy=vector_store_policy
+)
+if local_index is None:
+    try:
+        citation_cache.load()
+    except Exception as e:
+        logger.warning("Error loading citation metadata snapshot: %s", e)
+
+# Narrow file_search to the question's categories, minus superseded documents
+router = QueryRouter(citation_cache.snapshot, counter=ROUTED_QUERIES) if QUERY_ROUTING else None
+
+# Curated answers to common questions, served without calling the model
+faq = load_faq(FAQ_PATH, threshold=FAQ_THRESHOLD, counter=FAQ_LOOKUPS)
+
+# Answers to repeated questions, dropped whenever the knowledge base changes
+answer_cache = answer_cache_for(lambda: knowledge_base_version(local_index, citation_cache))
+
+# Flags are appended to a local outbox and flushed to Supabase in batches
+flag_queue = flag_outbox()
+
+# Pooled session and short-lived page cache for reading flags back
+supabase_session = requests.Session()
+flags_cache = flags_page_cache()
+
+sessions = session_store()
+
+# Identical questions in flight at the same time share one upstream call
+inflight = SingleFlight(timeout=SINGLEFLIGHT_TIMEOUT, counter=COALESCED)
+
+# Set once this worker has warmed up; /ready reports 503 until then
+ready = threading.Event()
+warmup_report = {}
+
+admission = AdmissionController(**admission_settings())
+rate_limiter = client_rate_limiter()
+
+def prewarm_answer_cache(questions):
+    """
+    Answer each known frequent question once so later requests hit the
+    cache, PREWARM_CONCURRENCY at a time
+    """
+    def warm(question):
+        key = cache_key(question)
+        if answer_cache.get(key) is not None:
+            return 0
+        try:
+            reply, citations = inflight.do(key, lambda: answer(question, key))
+            if reply:
+                return 1
+        except Exception as e:
+            logger.warning("Error pre-warming answer: %s", e, extra={"user_message": question})
+        return 0
+
+    with ThreadPoolExecutor(max_workers=PREWARM_CONCURRENCY, thread_name_prefix="prewarm") as pool:
+        warmed = sum(pool.map(warm, questions))
+    logger.info("Answer cache pre-warmed with %d answers", warmed)
+    return warmed
+
+def extract_reply(response, hits=None):
+    """
+    Return the reply text and resolved citations of a completed response.
+    hits are the locally retrieved chunks the answer was based on, if any.
+    """
+    reply, annotations = collect_file_citations(response)
+    if hits is not None:
+        return reply, local_citations(hits)
+
+    # Resolve each cited file once, from the snapshot where possible
+    with STAGE_SECONDS.labels("chat", "citations").time():
+        attributes = citation_cache.get_many(a.file_id for a in annotations)
+    citations = [build_citation(a, attributes.get(a.file_id)) for a in annotations]
+
+    return reply, citations
+
+def call_openai(params):
+    """Blocking Responses API call with latency, error and usage metrics"""
+    try:
+        with STAGE_SECONDS.labels("chat", "openai").time():
+            response = openai_policy.call(lambda timeout: client.responses.create(timeout=timeout, **params))
+    except Exception:
+        UPSTREAM_ERRORS.labels("openai", "responses.create").inc()
+        raise
+    logger.debug("OpenAI call successful", extra={"response_id": response.id})
+    record_usage(response)
+    return response
+
+def chat_params(user_message, session=None):
+    """
+    response_params() for the next turn, and the locally retrieved chunks it
+    includes (None when the hosted file_search tool does the retrieval)
+    """
+    args = turn_args(sessions, session, user_message)
+    hits = None
+    if local_index is not None:
+        with STAGE_SECONDS.labels("chat", "retrieval").time():
+            hits = local_index.search(user_message, LOCAL_TOP_K)
+        args["context"] = hits
+    elif router is not None:
+        args["filters"] = router.filters(user_message)
+    return response_params(**args), hits
+
+def answer(user_message, key):
+    """Call OpenAI for a single answer and cache it"""
+    params, hits = chat_params(user_message)
+    response = call_openai(params)
+
+    # Extract the main response text and citations
+    reply, citations = extract_reply(response, hits)
+    if reply:
+        answer_cache.set(key, (reply, citations))
+    return reply, citations
+
+def admitted_answer(user_message, key):
+    """
+    answer() under an admission slot; run by the single-flight leader only,
+    so coalesced requests never take a slot of their own
+    """
+    with admission.slot() as lease:
+        # Another request may have answered it while this one was queued
+        cached = answer_cache.get(key)
+        if cached is not None:
+            lease.release(record=False)
+            return cached
+        return answer(user_message, key)
+
+def answer_in_session(session, user_message):
+    """Answer the next turn of a conversation and record it in the session"""
+    params, hits = chat_params(user_message, session)
+    response = call_openai(params)
+    reply, citations = extract_reply(response, hits)
+    sessions.record_turn(session, user_message, reply, response)
+    return reply, citations
+
+def session_for(data):
+    """The conversation session a /chat request belongs to, if it asked for one"""
+    if not wants_session(data):
+        return None
+    return sessions.get_or_create(data.get('session_id'))
+
+def shed(rejection):
+    body, status, headers = rejection_response(rejection)
+    logger.warning("Request not admitted: %s", rejection.reason)
+    return jsonify(body), status, headers
+
+def stream_chat(user_message, session=None):
+    """
+    Forward output-text deltas as SSE 'delta' events, then send the full
+    reply with its resolved citations as a final 'citations' event
+    """
+    if session is None:
+        key, cached = cached_answer(faq, answer_cache, user_message)
+        final = {}
+    else:
+        # Session turns depend on earlier turns, so they are never cached or coalesced
+        key = None
+        cached = None
+        final = {"session_id": session["id"]}
+    lease = None
+    params, hits = None, None
+    # A question already in flight is answered by its leader, which holds
+    # the slot; only the requests that will call OpenAI are admitted
+    if cached is None and (key is None or not inflight.pending(key)):
+        # Raises Rejected or SessionBudgetExceeded before the stream starts
+        lease = admission.lease()
+        try:
+            params, hits = chat_params(user_message, session)
+        except Exception:
+            lease.release(record=False)
+            raise
+    started = time.perf_counter()
+
+    def generate():
+        if cached is not None:
+            yield from replay_answer(*cached)
+            return
+
+        call = None
+        if key is not None:
+            call, leader = inflight.begin(key)
+            if not leader:
+                # Same question already in flight: wait for its complete answer,
+                # giving back the slot admitted for a call this request will not make
+                if lease is not None:
+                    lease.release(record=False)
+                try:
+                    reply, citations = inflight.wait(call)
+                except Exception as e:
+                    logger.error("OpenAI API Error: %s", e)
+                    yield stream_error_event(e)
+                    return
+                yield from replay_answer(reply, citations)
+                return
+            if params is None:
+                # The call this request meant to join ended just before it could;
+                # share its outcome through the cache rather than calling again
+                answered = answer_cache.get(key)
+                if answered is None:
+                    error = RuntimeError("Coalesced request failed")
+                    inflight.finish(key, call, error=error)
+                    yield stream_error_event(error)
+                    return
+                inflight.finish(key, call, result=answered)
+                yield from replay_answer(*answered)
+                return
+
+        result = None
+        error = None
+        first_token = True
+        try:
+            stream = openai_policy.call(
+                lambda timeout: client.responses.create(stream=True, timeout=timeout, **params),
+                hedge=False
+            )
+            for event in stream:
+                if event.type == "response.output_text.delta":
+                    if first_token:
+                        TIME_TO_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started)
+                        first_token = False
+                    yield sse_event("delta", {"text": event.delta})
+                elif event.type == "response.completed":
+                    STAGE_SECONDS.labels("chat", "openai").observe(time.perf_counter() - started)
+                    record_usage(event.response)
+                    reply, citations = extract_reply(event.response, hits)
+                    if session is not None:
+                        sessions.record_turn(session, user_message, reply, event.response)
+                    elif reply:
+                        answer_cache.set(key, (reply, citations))
+                    result = (reply, citations)
+                    yield sse_event("citations", dict(final, response=reply, citations=citations))
+                elif event.type in ("response.failed", "error"):
+                    logger.error("OpenAI stream error: %s", event.type)
+                    UPSTREAM_ERRORS.labels("openai", "responses.stream").inc()
+                    error = RuntimeError("OpenAI API Error")
+                    yield stream_error_event(error)
+                    return
+        except Exception as e:
+            logger.error("OpenAI API Error: %s", e)
+            UPSTREAM_ERRORS.labels("openai", "responses.stream").inc()
+            error = e
+            yield stream_error_event(e)
+            return
+        finally:
+            # Also runs when the client disconnects mid-stream
+            if call is not None:
+                if result is None and error is None:
+                    error = RuntimeError("Stream ended before the answer completed")
+                inflight.finish(key, call, result=result, error=error)
+            if result is None and lease is not None:
+                # Only a completed answer says how fast upstream is
+                lease.release(record=False)
+        yield sse_event("done", {})
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+    if lease is not None:
+        # Hold the slot until the stream is closed, however it ends
+        response.call_on_close(lease.release)
+    return response
 
 @app.route('/chat', methods=['POST'])
 def chat():
+    session = None
     try:
         data = request.get_json()
-        user_message = data.get('message')
+        user_message = chat_message(data)
 
         if not user_message:
             return jsonify({'response': 'No message received'}), 400
 
-        # Add debug print
-        print(f"Received message: {user_message}")
+        logger.info("Received message", extra={"user_message": user_message})
+        rate_limiter.check(client_key(request.headers, request.remote_addr))
+        session = session_for(data)
 
-        try:
-            # Test OpenAI connection
-            print("Testing OpenAI connection...")
-            print(f"Using API key (first 4 chars): {api_key[:4]}...")
-            
-            response = client.responses.create(
-                model="gpt-4o-mini",
-                instructions="You are a helpful AI assistant for Parents of Deaf Children (PODC). Provide accurate, supportive, and accessible information",
-                input=user_message,
-                tools=[{
-                    "type": "file_search",
-                    "vector_store_ids": ["vs_681eac93bf088191bd4f7de05e04dbbf"]
-                }],
-                include=["file_search_call.results"]
-            )
-            print("OpenAI call successful")
-            
-        except Exception as openai_error:
-            print(f"OpenAI API Error: {str(openai_error)}")
-            return jsonify({
-                'response': f'OpenAI API Error: {str(openai_error)}',
-                'citations': []
-            }), 500
-
-        # Extract the main response text and citations
-        reply = ""
-        citations = []
-
-        # Process the output items
-        for output in response.output:
-            if output.type == "message":
-                for content in output.content:
-                    if content.type == "output_text":
-                        reply = content.text
-                        # Extract citations from annotations
-                        if hasattr(content, 'annotations'):
-                            for annotation in content.annotations:
-                                if annotation.type == "file_citation":
-                                    # Get file info from vector store instead of regular files
-                                    try:
-                                        vector_file = client.vector_stores.files.retrieve(
-                                            vector_store_id="vs_681eac93bf088191bd4f7de05e04dbbf",
-                                            file_id=annotation.file_id
-                                        )
-                                        
-                                        # Extract URL from attributes if available
-                                        url = vector_file.attributes.get('url') if vector_file.attributes else None
-                                        
-                                        print(f"File info for {annotation.filename}:")
-                                        print(f"- File ID: {annotation.file_id}")
-                                        print(f"- URL: {url}")
-                                        
-                                        citation = {
-                                            'filename': annotation.filename,
-                                            'file_id': annotation.file_id,
-                                            'metadata': {
-                                                'url': url,
-                                                'category': vector_file.attributes.get('category') if vector_file.attributes else None
-                                            }
-                                        }
-                                        citations.append(citation)
-                                    except Exception as e:
-                                        print(f"Error retrieving file info: {e}")
-                                        citations.append({
-                                            'filename': annotation.filename,
-                                            'file_id': annotation.file_id,
-                                            'metadata': {}
-                                        })
-
-        return jsonify({
-            'response': reply,
-            'citations': citations
-        })
+        if request.accept_mimetypes.best == "text/event-stream":
+            return stream_chat(user_message, session)
+
+        cached = None
+        if session is None:
+            key, cached = cached_answer(faq, answer_cache, user_message)
+
+        if cached is not None:
+            reply, citations = cached
+        else:
+            try:
+                if session is not None:
+                    with admission.slot():
+                        reply, citations = answer_in_session(session, user_message)
+                else:
+                    reply, citations = inflight.do(key, lambda: admitted_answer(user_message, key))
+            except (Rejected, SessionBudgetExceeded):
+                raise
+            except Exception as openai_error:
+                logger.error("OpenAI API Error: %s", openai_error)
+                body, status, headers = upstream_error_response(openai_error)
+                return jsonify(body), status, headers
+
+        with STAGE_SECONDS.labels("chat", "serialize").time():
+            return jsonify(chat_body(reply, citations, session))
+
+    except Rejected as rejection:
+        return shed(rejection)
+
+    except SessionBudgetExceeded:
+        body, status = session_exhausted_response(session)
+        return jsonify(body), status
 
     except Exception as e:
-        print(f"Detailed error: {str(e)}")
-        import traceback
-        print(f"Stack trace: {traceback.format_exc()}")
-        return jsonify({
-            'response': f'Server error: {str(e)}',
-            'citations': []
-        }), 500
+        logger.exception("Error handling chat request")
+        body, status = server_error_response(e)
+        return jsonify(body), status
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    session = None
+    try:
+        data = request.get_json()
+        user_message = chat_message(data)
+
+        if not user_message:
+            return jsonify({'response': 'No message received'}), 400
+
+        logger.info("Received message (stream)", extra={"user_message": user_message})
+        rate_limiter.check(client_key(request.headers, request.remote_addr))
+        session = session_for(data)
+        return stream_chat(user_message, session)
+
+    except Rejected as rejection:
+        return shed(rejection)
+
+    except SessionBudgetExceeded:
+        body, status = session_exhausted_response(session)
+        return jsonify(body), status
+
+    except Exception as e:
+        logger.exception("Error handling chat stream request")
+        body, status = server_error_response(e)
+        return jsonify(body), status
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    body, content_type = render()
+    return Response(body, mimetype=content_type)
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify(stats_body(admission, openai_policy, vector_store_policy, inflight, answer_cache))
+
+@app.route('/ready', methods=['GET'])
+def readiness():
+    return jsonify({"ready": ready.is_set(), "warmup": warmup_report}), 200 if ready.is_set() else 503
 
 @app.route('/flag', methods=['POST'])
 def flag_message():
     try:
         data = request.get_json()
-        flagged_text = data.get('flaggedText')
-        user_prompt = data.get('userPrompt')
-        timestamp = data.get('timestamp')
-
-        print("\n[FLAGGED]")
-        print(f"- Time: {timestamp}")
-        print(f"- User Prompt: {user_prompt}")
-        print(f"- Flagged Response: {flagged_text}")
-
-        # POST to Supabase
-        headers = {
-            "apikey": SUPABASE_API_KEY,
-            "Authorization": f"Bearer {SUPABASE_API_KEY}",
-            "Content-Type": "application/json"
-        }
-
-        payload = {
-            "timestamp": timestamp,
-            "user_prompt": user_prompt,
-            "flagged_text": flagged_text
-        }
+        try:
+            payload = flag_payload(data)
+        except ValueError as e:
+            return jsonify({"message": f"Invalid flag: {e}"}), 400
 
-        response = requests.post(
-            f"{SUPABASE_URL}/rest/v1/flags",
-            headers=headers,
-            json=payload
-        )
+        logger.info("Flagged response", extra=payload)
 
-        if response.status_code == 201:
-            return jsonify({"message": "Flag stored in Supabase"}), 200
-        else:
-            print("Supabase error:", response.text)
-            return jsonify({"message": "Failed to store flag in Supabase"}), 500
+        # Queue locally; the flusher thread batch-inserts into Supabase
+        with STAGE_SECONDS.labels("flag", "enqueue").time():
+            key = flag_queue.enqueue(payload)
+        return jsonify({"message": "Flag queued", "id": key}), 202
 
     except Exception as e:
-        print(f"Error sending flag: {e}")
+        logger.exception("Error queueing flag")
         return jsonify({"message": "Internal error storing flag"}), 500
 
+def fetch_flags_page(limit, cursor=None):
+    return supabase_session.get(
+        f"{SUPABASE_URL}/rest/v1/flags",
+        headers=supabase_headers(),
+        params=flags_page_params(limit, cursor),
+        timeout=(5, 30)
+    )
+
+def export_flags():
+    """Yield every flag as one NDJSON line, a page at a time"""
+    cursor = None
+    while True:
+        response = fetch_flags_page(FLAGS_MAX_PAGE_SIZE, cursor)
+        if response.status_code != 200:
+            logger.error("Error exporting flags from Supabase: %s %s", response.status_code, response.text)
+            return
+        rows = response.json()
+        yield from ndjson_lines(rows)
+        cursor = next_cursor(rows, FLAGS_MAX_PAGE_SIZE)
+        if cursor is None:
+            return
+
 @app.route('/flags', methods=['GET'])
 def list_flags():
     try:
-        headers = {
-            "apikey": SUPABASE_API_KEY,
-            "Authorization": f"Bearer {SUPABASE_API_KEY}",
-            "Content-Type": "application/json"
-        }
+        if wants_ndjson(request):
+            return Response(stream_with_context(export_flags()), mimetype='application/x-ndjson')
+
+        limit = parse_page_size(request.args.get('limit'))
+        cursor = request.args.get('cursor')
+
+        page_key = (limit, cursor)
+        page = flags_cache.get(page_key)
+        if page is None:
+            try:
+                with STAGE_SECONDS.labels("flags", "supabase").time():
+                    response = fetch_flags_page(limit, cursor)
+            except (ValueError, TypeError):
+                return jsonify({"message": "Invalid cursor"}), 400
+
+            if response.status_code != 200:
+                UPSTREAM_ERRORS.labels("supabase", "flags.select").inc()
+                logger.error("Error fetching flags from Supabase: %s %s", response.status_code, response.text)
+                return jsonify({"message": "Failed to fetch flags"}), 500
 
-        response = requests.get(
-            f"{SUPABASE_URL}/rest/v1/flags?select=id,timestamp,user_prompt,flagged_text&order=timestamp.desc",
-            headers=headers
-        )
+            page = flags_page(response.json(), limit)
+            flags_cache.set(page_key, page)
 
-        if response.status_code == 200:
-            return jsonify(response.json())
+        body, etag, cursor_next = page
+        if request.if_none_match.contains(etag):
+            result = Response(status=304)
         else:
-            print("Error fetching from Supabase:", response.text)
-            return jsonify({"message": "Failed to fetch flags"}), 500
+            result = Response(body, mimetype='application/json')
+        result.set_etag(etag)
+        result.headers.update(flags_page_headers(limit, cursor_next))
+        return result
 
     except Exception as e:
-        print(f"Error reading flags from Supabase: {e}")
+        logger.exception("Error reading flags from Supabase")
         return jsonify({"message": "Internal server error"}), 500
 
+def warm_up():
+    """Open upstream connections, touch the index and make sure the snapshot is loaded"""
+    started = time.perf_counter()
+    checks = {
+        "openai": lambda: client.models.retrieve(MODEL, timeout=10),
+        "supabase": lambda: supabase_session.get(
+            f"{SUPABASE_URL}/rest/v1/flags",
+            headers=supabase_headers(),
+            params={"select": "id", "limit": 1},
+            timeout=10
+        ),
+    }
+    if local_index is not None:
+        checks["index"] = lambda: local_index.search("hearing", 1)
+    for name, check in checks.items():
+        try:
+            check()
+            warmup_report[name] = warmup_result()
+        except Exception as e:
+            warmup_report[name] = warmup_result(e)
+            if not isinstance(e, openai.APIStatusError):
+                logger.warning("Warm-up of %s failed: %s", name, e)
+
+    # Not ready without the citation snapshot (loaded at import unless it failed)
+    delay = 1
+    while local_index is None and citation_cache.fingerprint is None:
+        try:
+            citation_cache.load()
+        except Exception as e:
+            logger.warning("Error loading citation metadata snapshot, retrying in %ds: %s", delay, e)
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    warmup_report["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info("Worker warmed up", extra={"warmup": warmup_report})
+    ready.set()
+
+def start_worker():
+    """
+    Per-process startup: fresh upstream clients, background threads and
+    warm-up. Runs at import, or in each worker after the fork when
+    gunicorn preloads the app (see gunicorn.conf.py).
+    """
+    global client
+    client = openai_client()
+    citation_cache.client = client
+    if getattr(getattr(local_index, "embedder", None), "client", None) is not None:
+        local_index.embedder.client = client.with_options(max_retries=2)
+
+    admission.publish()
+    flag_queue.start()
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+    # Pre-warm the answer cache from a JSON list of frequent questions
+    frequent_questions = prewarm_questions()
+    if frequent_questions:
+        threading.Thread(
+            target=prewarm_answer_cache,
+            args=(frequent_questions,),
+            name="answer-cache-prewarm",
+            daemon=True
+        ).start()
+
+if os.getenv("PODC_PRELOAD") != "1":
+    start_worker()
+
 if __name__ == '__main__':
     app.run(debug=True)
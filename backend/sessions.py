@@ -0,0 +1,134 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class SessionBudgetExceeded(Exception):
+    """The session has used up its token budget"""
+
+
+class SessionStore:
+    """
+    Server-side state for multi-turn conversations, keyed by session ID.
+
+    Turns are chained with the Responses API's previous_response_id, so the
+    client only ever sends the new message. Each session also keeps a short
+    trimmed history; once the chained context grows past context_tokens the
+    next turn restarts from that history instead. Sessions expire after
+    idle_ttl seconds, the store holds at most max_sessions (least recently
+    used are evicted first), and a session is refused once it has used
+    token_budget tokens.
+
+    State lives in a small SQLite (WAL) table so every gunicorn worker sees
+    the same sessions.
+    """
+
+    def __init__(self, path, max_sessions=5000, idle_ttl=1800, token_budget=60000,
+                 context_tokens=8000, history_turns=4, max_turn_chars=2000):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.token_budget = token_budget
+        self.context_tokens = context_tokens
+        self.history_turns = history_turns
+        self.max_turn_chars = max_turn_chars
+        self._local = threading.local()
+
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                previous_response_id TEXT,
+                history TEXT NOT NULL DEFAULT '[]',
+                context_tokens INTEGER NOT NULL DEFAULT 0,
+                tokens_used INTEGER NOT NULL DEFAULT 0,
+                last_seen REAL NOT NULL
+            )
+        """)
+        self._connect().execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def create(self):
+        session_id = uuid.uuid4().hex
+        self._connect().execute(
+            "INSERT INTO sessions (id, last_seen) VALUES (?, ?)",
+            (session_id, time.time())
+        )
+        self._evict()
+        return self.get(session_id)
+
+    def get(self, session_id):
+        """Return the live session as a dict, or None if unknown or expired"""
+        if not session_id:
+            return None
+        row = self._connect().execute(
+            "SELECT * FROM sessions WHERE id = ? AND last_seen >= ?",
+            (session_id, time.time() - self.idle_ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        session = dict(row)
+        session["history"] = json.loads(session["history"])
+        return session
+
+    def get_or_create(self, session_id):
+        return self.get(session_id) or self.create()
+
+    def turn_params(self, session, user_message):
+        """
+        response_params() arguments for the next turn of session. Raises
+        SessionBudgetExceeded once the session is out of tokens.
+        """
+        if session["tokens_used"] >= self.token_budget:
+            raise SessionBudgetExceeded(session["id"])
+
+        if session["previous_response_id"] and session["context_tokens"] <= self.context_tokens:
+            return {"user_input": user_message, "previous_response_id": session["previous_response_id"]}
+
+        # New session, or the chained context is too large: restart from the trimmed history
+        messages = []
+        for user_text, assistant_text in session["history"]:
+            messages.append({"role": "user", "content": user_text})
+            messages.append({"role": "assistant", "content": assistant_text})
+        if not messages:
+            return {"user_input": user_message}
+        messages.append({"role": "user", "content": user_message})
+        return {"user_input": messages}
+
+    def record_turn(self, session, user_message, reply, response):
+        """Store the response ID, trimmed history and token usage of a completed turn"""
+        history = session["history"] + [[user_message[:self.max_turn_chars], reply[:self.max_turn_chars]]]
+        history = history[-self.history_turns:]
+
+        usage = getattr(response, "usage", None)
+        input_tokens = getattr(usage, "input_tokens", 0) or 0
+        total_tokens = getattr(usage, "total_tokens", 0) or 0
+
+        self._connect().execute(
+            "UPDATE sessions SET previous_response_id = ?, history = ?, context_tokens = ?, "
+            "tokens_used = tokens_used + ?, last_seen = ? WHERE id = ?",
+            (response.id, json.dumps(history), input_tokens, total_tokens, time.time(), session["id"])
+        )
+
+    def _evict(self):
+        """Drop expired sessions, then the least recently used beyond max_sessions"""
+        conn = self._connect()
+        conn.execute("DELETE FROM sessions WHERE last_seen < ?", (time.time() - self.idle_ttl,))
+        conn.execute(
+            "DELETE FROM sessions WHERE id IN ("
+            "SELECT id FROM sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,)
+        )
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key across threads.
+
+    The first caller for a key (the leader) runs the upstream call; callers
+    arriving while it is in flight wait for and share its result or error.
+    counter is an optional Prometheus counter labelled by role
+    (leader/coalesced).
+    """
+
+    def __init__(self, timeout=None, counter=None):
+        self.timeout = timeout
+        self.counter = counter
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def begin(self, key):
+        """Return (call, is_leader) for key"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                self._count("coalesced")
+                return call, False
+            call = _Call()
+            self._calls[key] = call
+            self.leaders += 1
+            self._count("leader")
+            return call, True
+
+    def _count(self, role):
+        if self.counter is not None:
+            self.counter.labels(role).inc()
+
+    def pending(self, key):
+        """Whether a call for key is in flight"""
+        return key in self._calls
+
+    def finish(self, key, call, result=None, error=None):
+        """Publish the leader's result (or error) to every waiter"""
+        call.result = result
+        call.error = error
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.done.set()
+
+    def wait(self, call):
+        if not call.done.wait(self.timeout):
+            raise TimeoutError("Timed out waiting for coalesced request")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do(self, key, fn):
+        """Run fn() once for all concurrent callers with the same key"""
+        call, leader = self.begin(key)
+        if not leader:
+            return self.wait(call)
+        try:
+            result = fn()
+        except Exception as e:
+            self.finish(key, call, error=e)
+            raise
+        except BaseException:
+            # KeyboardInterrupt and the like: still clear the key and release the waiters
+            self.finish(key, call, error=RuntimeError("Coalesced call was interrupted"))
+            raise
+        self.finish(key, call, result=result)
+        return result
+
+    def stats(self):
+        return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines sharing one event loop"""
+
+    def __init__(self, timeout=None, counter=None):
+        self.timeout = timeout
+        self.counter = counter
+        self._calls = {}
+        # Strong references to the running calls; the loop keeps only weak ones
+        self._tasks = set()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def begin(self, key):
+        """Return (future, is_leader) for key"""
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            self._count("coalesced")
+            return future, False
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.leaders += 1
+        self._count("leader")
+        return future, True
+
+    def _count(self, role):
+        if self.counter is not None:
+            self.counter.labels(role).inc()
+
+    def pending(self, key):
+        """Whether a call for key is in flight"""
+        return key in self._calls
+
+    def finish(self, key, future, result=None, error=None):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+            # Mark the exception retrieved in case nobody was waiting
+            future.exception()
+        else:
+            future.set_result(result)
+
+    async def wait(self, future):
+        return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+
+    async def do(self, key, fn):
+        """
+        Await fn() once for all concurrent callers with the same key. fn()
+        runs in a task no caller owns, so a cancelled caller, the leader
+        included, stops waiting without cancelling the call for the others.
+        """
+        future, leader = self.begin(key)
+        if not leader:
+            return await self.wait(future)
+        task = asyncio.ensure_future(fn())
+        self._tasks.add(task)
+        task.add_done_callback(lambda task: self._settle(key, future, task))
+        return await asyncio.shield(future)
+
+    def _settle(self, key, future, task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            if self._calls.get(key) is future:
+                del self._calls[key]
+            future.cancel()
+        elif task.exception() is not None:
+            self.finish(key, future, error=task.exception())
+        else:
+            self.finish(key, future, result=task.result())
+
+    def stats(self):
+        return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self._calls)}
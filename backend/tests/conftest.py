@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+# The backend modules import each other by plain name, and storage.functions
+# from the project root
+_backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _backend)
+sys.path.append(os.path.dirname(_backend))
+
+# Clients are created at import time; tests replace them before any call
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+# The servers read their configuration at import: keep their SQLite files out
+# of the tree, and fail fast on the upstreams nothing here should reach
+_state_dir = tempfile.mkdtemp(prefix="podc-tests-")
+os.environ["FLAG_QUEUE_PATH"] = os.path.join(_state_dir, "flag_queue.sqlite3")
+os.environ["SESSION_STORE_PATH"] = os.path.join(_state_dir, "sessions.sqlite3")
+os.environ["FAQ_PATH"] = os.path.join(_state_dir, "faq.json")
+os.environ["OPENAI_BASE_URL"] = "http://127.0.0.1:9/v1"
+os.environ["SUPABASE_URL"] = "http://127.0.0.1:9"
+os.environ["VECTOR_STORE_DEADLINE"] = "1"
+os.environ["PODC_PRELOAD"] = "1"
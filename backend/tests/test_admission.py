@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from werkzeug.datastructures import Headers
+
+import admission
+from admission import AdmissionController, AsyncAdmissionController, RateLimiter, Rejected
+from chat_common import client_key
+
+
+def test_client_key_uses_the_hop_added_by_the_proxy():
+    headers = Headers([("X-Forwarded-For", "6.6.6.6, 203.0.113.7")])
+    assert client_key(headers, "10.0.0.1", trusted_proxies=1) == "203.0.113.7"
+
+
+def test_client_key_counts_hops_from_the_right():
+    headers = Headers([("X-Forwarded-For", "6.6.6.6, 203.0.113.7, 10.0.0.2"), ("X-Forwarded-For", "10.0.0.3")])
+    assert client_key(headers, "10.0.0.1", trusted_proxies=3) == "203.0.113.7"
+
+
+def test_client_key_without_proxies_or_hops_is_the_peer():
+    forged = Headers([("X-Forwarded-For", "6.6.6.6")])
+    assert client_key(forged, "198.51.100.4", trusted_proxies=0) == "198.51.100.4"
+    assert client_key(forged, "198.51.100.4", trusted_proxies=2) == "198.51.100.4"
+    assert client_key(Headers(), "198.51.100.4", trusted_proxies=1) == "198.51.100.4"
+    assert client_key(Headers(), None, trusted_proxies=1) == "unknown"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def test_rate_limiter_spends_and_refills_per_client(clock):
+    limiter = RateLimiter(rate=0.5, burst=2)
+    limiter.check("a")
+    limiter.check("a")
+    with pytest.raises(Rejected) as rejected:
+        limiter.check("a")
+    assert rejected.value.reason == "rate limited"
+    assert rejected.value.retry_after == 2
+    # Other clients have their own bucket
+    limiter.check("b")
+
+    clock.now += 2
+    limiter.check("a")
+    with pytest.raises(Rejected):
+        limiter.check("a")
+
+
+def test_rate_limiter_forgets_the_least_recent_clients(clock):
+    limiter = RateLimiter(rate=0.001, burst=1, max_clients=2)
+    limiter.check("a")
+    limiter.check("b")
+    limiter.check("c")
+    # "a" was dropped, so it starts again with a full bucket
+    limiter.check("a")
+    with pytest.raises(Rejected):
+        limiter.check("c")
+
+
+def test_rate_limiter_disabled():
+    limiter = RateLimiter(rate=0, burst=1)
+    for _ in range(5):
+        limiter.check("a")
+
+
+def test_admission_queues_then_rejects_beyond_the_limit():
+    controller = AdmissionController(limit=1, min_limit=1, max_limit=1, queue_size=1, queue_timeout=5)
+    controller.acquire()
+
+    admitted = threading.Event()
+
+    def waiter():
+        controller.acquire()
+        admitted.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    while controller.waiting == 0:
+        time.sleep(0.001)
+    with pytest.raises(Rejected) as rejected:
+        controller.acquire()
+    assert rejected.value.reason == "queue full"
+
+    controller.release()
+    thread.join(5)
+    assert admitted.is_set()
+    assert controller.stats() == {"limit": 1, "in_flight": 1, "waiting": 0, "queue_size": 1}
+
+
+def test_admission_wait_times_out():
+    controller = AdmissionController(limit=1, min_limit=1, max_limit=1, queue_size=1, queue_timeout=0.05)
+    controller.acquire()
+    with pytest.raises(Rejected) as rejected:
+        controller.acquire()
+    assert rejected.value.reason == "queue timeout"
+    assert controller.waiting == 0
+
+
+def test_lease_is_released_once():
+    controller = AdmissionController(limit=2, min_limit=1, max_limit=2)
+    lease = controller.lease()
+    lease.release()
+    lease.release()
+    assert controller.in_flight == 0
+
+
+def test_limit_shrinks_while_latency_is_high():
+    controller = AdmissionController(limit=8, min_limit=2, max_limit=16)
+    for _ in range(20):
+        controller.acquire()
+        controller.release(0.1)
+    settled = controller.limit.current
+    for _ in range(20):
+        controller.acquire()
+        controller.release(2.0)
+    assert controller.limit.current < settled
+
+
+def test_sustained_latency_drives_the_limit_to_its_floor():
+    controller = AdmissionController(limit=4, min_limit=1, max_limit=12)
+    for _ in range(100):
+        controller.acquire()
+        controller.release(0.5)
+    assert controller.limit.current == 12
+    for _ in range(40):
+        controller.acquire()
+        controller.release(5.0)
+    assert controller.limit.current == 1
+
+
+def test_only_completed_work_feeds_the_limit():
+    controller = AdmissionController(limit=2, min_limit=1, max_limit=2)
+    with pytest.raises(RuntimeError):
+        with controller.slot():
+            raise RuntimeError("session budget exceeded")
+    with controller.slot() as lease:
+        # Answered from the cache after all
+        lease.release(record=False)
+    assert controller.limit.latency is None
+    assert controller.in_flight == 0
+
+    with controller.slot():
+        pass
+    assert controller.limit.latency is not None
+
+
+def test_async_admission_limits_concurrency():
+    controller = AsyncAdmissionController(limit=2, min_limit=2, max_limit=2, queue_size=8)
+    running = peak = 0
+
+    async def work():
+        nonlocal running, peak
+        async with controller.slot():
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    async def main():
+        await asyncio.gather(*(work() for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert controller.in_flight == 0
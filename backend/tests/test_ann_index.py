@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from ann_index import IVFIndex, exact_search
+from embeddings import normalize_rows
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    """Unit vectors in 16 well separated clusters"""
+    rng = np.random.default_rng(1)
+    centres = normalize_rows(rng.normal(size=(16, 32)).astype(np.float32))
+    points = np.repeat(centres, 50, axis=0) + 0.05 * rng.normal(size=(800, 32)).astype(np.float32)
+    return normalize_rows(points)
+
+
+def recall(found, expected):
+    return np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, expected)])
+
+
+def test_probing_every_cell_is_exact(vectors):
+    index = IVFIndex.train(vectors, nlist=8)
+    queries = vectors[::40]
+    ids, scores = index.search(queries, k=5, nprobe=index.nlist)
+    expected_ids, expected_scores = exact_search(vectors, queries, 5)
+    assert np.allclose(scores, expected_scores, atol=1e-5)
+    assert recall(ids, expected_ids) == 1.0
+
+
+def test_few_probes_keep_recall_on_clustered_data(vectors):
+    index = IVFIndex.train(vectors, nlist=16)
+    assert index.nlist == 16 and len(index) == len(vectors)
+    queries = vectors[::20]
+    ids, _ = index.search(queries, k=10, nprobe=2)
+    assert recall(ids, exact_search(vectors, queries, 10)[0]) > 0.9
+
+
+def test_rows_are_padded_when_the_probed_cells_are_small(vectors):
+    index = IVFIndex.train(vectors[:20], nlist=4)
+    ids, scores = index.search(vectors[:1], k=20, nprobe=1)
+    assert np.isinf(scores[0, -1])
+
+
+def test_added_vectors_are_found_without_retraining(vectors, caplog):
+    index = IVFIndex.train(vectors[:600], nlist=16)
+    centroids = index.centroids.copy()
+    grown = index.add(vectors[600:], np.arange(600, 800))
+
+    assert np.array_equal(grown.centroids, centroids)
+    assert len(grown) == 800 and grown.inserted == 200
+    ids, _ = grown.search(vectors[700:701], k=1, nprobe=2)
+    assert ids[0, 0] == 700
+    assert not grown.needs_retraining
+
+    bigger = grown.add(vectors[:200], np.arange(800, 1000))
+    assert bigger.needs_retraining
+    assert "rebuild the index" in caplog.text
+
+
+def test_save_and_load(vectors, tmp_path):
+    index = IVFIndex.train(vectors, nlist=8).add(vectors[:10], np.arange(800, 810))
+    index.save(tmp_path)
+    assert IVFIndex.exists(tmp_path)
+
+    loaded = IVFIndex.load(tmp_path)
+    assert (loaded.nlist, len(loaded), loaded.trained_on, loaded.inserted) == (8, 810, 800, 10)
+    queries = vectors[::100]
+    assert np.array_equal(loaded.search(queries, k=5)[0], index.search(queries, k=5)[0])
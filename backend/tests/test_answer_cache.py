@@ -0,0 +1,43 @@
+import answer_cache
+from answer_cache import AnswerCache, answer_key, normalize_question
+
+
+def test_rephrased_punctuation_and_case_share_a_key():
+    assert normalize_question("  What is   the NDIS?? ") == "what is the ndis"
+    key = answer_key("What is the NDIS?", "gpt", "prompt", "vs_1")
+    assert answer_key("what is the ndis", "gpt", "prompt", "vs_1") == key
+    assert answer_key("What is the NDIS?", "gpt", "prompt", "vs_2") != key
+    assert answer_key("What is the NDIS?", "gpt", "other prompt", "vs_1") != key
+
+
+def test_least_recently_used_answers_are_evicted():
+    cache = AnswerCache(max_size=2)
+    cache.set("a", ("A", []))
+    cache.set("b", ("B", []))
+    cache.get("a")
+    cache.set("c", ("C", []))
+    assert cache.get("b") is None
+    assert cache.get("a") == ("A", [])
+    assert cache.get("c") == ("C", [])
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_answers_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "monotonic", lambda: now[0])
+    cache = AnswerCache(ttl=60)
+    cache.set("a", ("A", []))
+    now[0] += 59
+    assert cache.get("a") == ("A", [])
+    now[0] += 2
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_knowledge_base_change_drops_every_answer():
+    version = ["v1"]
+    cache = AnswerCache(version_fn=lambda: version[0])
+    cache.set("a", ("A", []))
+    assert cache.get("a") == ("A", [])
+    version[0] = "v2"
+    assert cache.get("a") is None
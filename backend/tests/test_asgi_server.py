@@ -0,0 +1,118 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import asgi_server
+from admission import AsyncAdmissionController, RateLimiter
+from singleflight import AsyncSingleFlight
+
+
+def completed_response(text):
+    return SimpleNamespace(
+        id="resp_1",
+        output=[SimpleNamespace(
+            type="message",
+            content=[SimpleNamespace(type="output_text", text=text, annotations=[])]
+        )],
+        usage=SimpleNamespace(input_tokens=10, output_tokens=5, total_tokens=15)
+    )
+
+
+@pytest.fixture
+def on_loop_thread(monkeypatch):
+    """Names of the store calls that ran on the event loop's thread"""
+    blocked = []
+
+    def watch(obj, name):
+        original = getattr(obj, name)
+
+        def wrapper(*args, **kwargs):
+            if threading.current_thread() is threading.main_thread():
+                blocked.append(name)
+            return original(*args, **kwargs)
+
+        monkeypatch.setattr(obj, name, wrapper)
+
+    watch(asgi_server.sessions, "get_or_create")
+    watch(asgi_server.sessions, "record_turn")
+    watch(asgi_server.flag_queue, "enqueue")
+    return blocked
+
+
+def test_flag_is_queued_off_the_event_loop(on_loop_thread):
+    async def post():
+        client = asgi_server.app.test_client()
+        return await client.post("/flag", json={"timestamp": "2024-05-01T00:00:00Z", "userPrompt": "q", "flaggedText": "a"})
+
+    response = asyncio.run(post())
+    assert response.status_code == 202
+    assert on_loop_thread == []
+
+
+def test_session_turn_touches_the_store_off_the_event_loop(monkeypatch, on_loop_thread):
+    async def call_openai(params):
+        return completed_response("Hello")
+
+    monkeypatch.setattr(asgi_server, "call_openai", call_openai)
+
+    async def post():
+        client = asgi_server.app.test_client()
+        response = await client.post("/chat", json={"message": "Hi", "session": True})
+        return response.status_code, await response.get_json()
+
+    status, body = asyncio.run(post())
+    assert status == 200
+    assert body["response"] == "Hello" and body["session_id"]
+    assert on_loop_thread == []
+    assert asgi_server.sessions.get(body["session_id"])["previous_response_id"] == "resp_1"
+
+
+def test_identical_questions_at_once_take_one_slot(monkeypatch):
+    # One slot and no queue: any request but the leader that asks for a slot is shed
+    monkeypatch.setattr(asgi_server, "admission", AsyncAdmissionController(limit=1, min_limit=1, queue_size=0))
+    monkeypatch.setattr(asgi_server, "rate_limiter", RateLimiter(rate=0))
+    monkeypatch.setattr(asgi_server, "inflight", AsyncSingleFlight(timeout=5))
+    calls = []
+
+    async def call_openai(params):
+        calls.append(params)
+        # Answer once every other request has joined this call
+        for _ in range(5000):
+            if asgi_server.inflight.coalesced == 29:
+                break
+            await asyncio.sleep(0.001)
+        return completed_response("Contact the NDIA.")
+
+    monkeypatch.setattr(asgi_server, "call_openai", call_openai)
+
+    async def post_all():
+        client = asgi_server.app.test_client()
+        question = {"message": "Who do I call about the NDIS at once?"}
+        responses = await asyncio.gather(*(client.post("/chat", json=question) for _ in range(30)))
+        return [response.status_code for response in responses]
+
+    assert asyncio.run(post_all()) == [200] * 30
+    assert len(calls) == 1
+    assert asgi_server.admission.stats()["in_flight"] == 0
+
+
+def test_prewarm_is_bounded(monkeypatch):
+    running = peak = 0
+
+    async def answer(question, key):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return f"answer to {question}", []
+
+    monkeypatch.setattr(asgi_server, "answer", answer)
+    monkeypatch.setattr(asgi_server, "PREWARM_CONCURRENCY", 2)
+    monkeypatch.setattr(asgi_server, "inflight", AsyncSingleFlight())
+
+    warmed = asyncio.run(asgi_server.prewarm_answer_cache([f"question {i}" for i in range(10)]))
+    assert warmed == 10
+    assert peak == 2
@@ -0,0 +1,67 @@
+import json
+from pathlib import Path
+
+import pytest
+
+import corpus
+from bm25_index import BM25Index, build_index
+from corpus import chunk_pages
+from test_pdf_info import append_update, write_pdf
+
+DOCUMENTS = {
+    "Education/Auslan classes_NEW.pdf": ["Auslan classes for toddlers run every week at the deaf school."],
+    "NDIS/Funding.pdf": [
+        "The NDIS funds hearing aids and cochlear implant processors.",
+        "Plans are reviewed every year. Funding covers assistive technology."
+    ],
+    "NDIS/Travel.pdf": ["Travel to appointments can be funded. Funding funding funding."],
+}
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    """An index of plain-text stand-ins for PDFs, with one page per list item"""
+    source = tmp_path / "source"
+    for relative, pages in DOCUMENTS.items():
+        path = source / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("\f".join(pages), encoding="utf-8")
+    monkeypatch.setattr(corpus, "extract_pages", lambda path: (Path(path).read_text(encoding="utf-8").split("\f"), None))
+
+    manifest = build_index(source, tmp_path / "index")
+    assert manifest["documents"] == 3
+    return BM25Index(tmp_path / "index")
+
+
+def test_chunks_overlap_and_start_on_their_page():
+    chunks = list(chunk_pages(["one two three", "four five"], words=3, overlap=1))
+    assert chunks == [(1, "one two three"), (1, "three four five")]
+
+
+def test_an_indirect_source_url_is_resolved(tmp_path):
+    path = write_pdf(tmp_path / "a.pdf")
+    append_update(path, {10: b"<< /SourceURL 11 0 R >>", 11: b"(https://example.org/indirect)"}, info=10)
+    pages, url = corpus.extract_pages(path)
+    # Stored in documents.json
+    assert json.dumps(url) == '"https://example.org/indirect"'
+
+
+def test_search_ranks_the_matching_chunk_first(index):
+    [hit] = index.search("cochlear implant", k=3)
+    assert hit["filename"] == "Funding.pdf" and hit["category"] == "NDIS" and hit["page"] == 1
+    assert "cochlear implant" in hit["text"]
+
+    top = index.search("auslan toddlers")[0]
+    assert top["filename"] == "Auslan classes_NEW.pdf" and top["version"] == "NEW"
+
+
+def test_term_frequency_saturates(index):
+    travel, plan = index.search("funding", k=5)
+    assert travel["filename"] == "Travel.pdf" and plan["filename"] == "Funding.pdf"
+    # Four times the word is not four times as relevant
+    assert plan["score"] < travel["score"] < 4 * plan["score"]
+
+
+def test_unknown_terms_match_nothing(index):
+    assert index.search("zebra crossing") == []
+    assert index.search("") == []
@@ -0,0 +1,113 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+from citation_cache import CitationMetadataCache
+from resilience import UpstreamPolicy
+
+
+class FakeFiles:
+    """vector_stores.files over `attributes`, listed `page_size` at a time"""
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+        self.lists = 0
+        self.retrieved = []
+
+    def list(self, vector_store_id, limit=100, after=None, timeout=None):
+        self.lists += 1
+        ids = sorted(self.attributes)
+        start = ids.index(after) + 1 if after else 0
+        page = ids[start:start + limit]
+        return SimpleNamespace(
+            data=[SimpleNamespace(id=file_id, attributes=self.attributes[file_id]) for file_id in page],
+            has_more=start + limit < len(ids),
+            last_id=page[-1] if page else None
+        )
+
+    def retrieve(self, vector_store_id, file_id, timeout=None):
+        self.retrieved.append(file_id)
+        if file_id not in self.attributes:
+            response = httpx.Response(404, request=httpx.Request("GET", "https://api.openai.com/v1"))
+            raise openai.NotFoundError("not found", response=response, body=None)
+        return SimpleNamespace(id=file_id, attributes=self.attributes[file_id])
+
+
+class AsyncFakeFiles(FakeFiles):
+    async def retrieve(self, vector_store_id, file_id, timeout=None):
+        return super().retrieve(vector_store_id, file_id, timeout)
+
+
+def fake_client(files):
+    return SimpleNamespace(vector_stores=SimpleNamespace(files=files))
+
+
+def cache_for(files):
+    return CitationMetadataCache(fake_client(files), "vs_1", page_size=2, policy=UpstreamPolicy("test", attempts=1))
+
+
+def attributes(n):
+    return {f"file-{i}": {"filename": f"{i}.pdf", "category": "NDIS"} for i in range(n)}
+
+
+def test_snapshot_is_loaded_a_page_at_a_time():
+    files = FakeFiles(attributes(5))
+    cache = cache_for(files)
+    assert cache.is_stale and cache.fingerprint is None
+
+    assert cache.load() == 5
+    assert files.lists == 3
+    assert not cache.is_stale
+    assert cache.get_many(["file-4", "file-0", "file-4"]) == {
+        "file-4": {"filename": "4.pdf", "category": "NDIS"},
+        "file-0": {"filename": "0.pdf", "category": "NDIS"},
+    }
+    assert files.retrieved == []
+
+
+def test_a_snapshot_never_loaded_is_stale_whatever_the_ttl():
+    cache = cache_for(FakeFiles(attributes(1)))
+    # Longer than the host has been up
+    cache.ttl = 10 ** 12
+    assert cache.is_stale
+    cache.load()
+    assert not cache.is_stale
+
+
+def test_misses_are_retrieved_once_and_kept():
+    files = FakeFiles(attributes(2))
+    cache = cache_for(files)
+    cache.load()
+    files.attributes["file-9"] = {"filename": "9.pdf"}
+
+    found = cache.get_many(["file-9", "file-9", "missing"])
+    assert found == {"file-9": {"filename": "9.pdf"}, "missing": None}
+    assert sorted(files.retrieved) == ["file-9", "missing"]
+    cache.get_many(["file-9"])
+    assert sorted(files.retrieved) == ["file-9", "missing"]
+
+
+def test_fingerprint_follows_the_contents():
+    files = FakeFiles(attributes(3))
+    cache = cache_for(files)
+    cache.load()
+    fingerprint = cache.fingerprint
+    cache.load()
+    assert cache.fingerprint == fingerprint
+
+    files.attributes["file-0"] = {"filename": "renamed.pdf"}
+    cache.load()
+    assert cache.fingerprint != fingerprint
+
+
+def test_async_misses_use_the_async_client():
+    files = FakeFiles(attributes(1))
+    cache = cache_for(files)
+    cache.load()
+    async_files = AsyncFakeFiles({"file-7": {"filename": "7.pdf"}})
+
+    found = asyncio.run(cache.aget_many(["file-0", "file-7"], fake_client(async_files)))
+    assert found == {"file-0": {"filename": "0.pdf", "category": "NDIS"}, "file-7": {"filename": "7.pdf"}}
+    assert async_files.retrieved == ["file-7"]
@@ -0,0 +1,117 @@
+import os
+from pathlib import Path
+
+import pytest
+
+import dedup
+from dedup import dedupe, find_duplicates, minhash, similarity
+
+WORDS = (
+    "the national disability insurance scheme funds reasonable and necessary supports for deaf and hard "
+    "of hearing children including hearing aids cochlear implant processors auslan tutoring speech "
+    "pathology family workshops early intervention services travel costs and assistive technology"
+).split()
+
+
+def text(n=200, replace=()):
+    words = [WORDS[(i * 7) % len(WORDS)] + str(i // len(WORDS)) for i in range(n)]
+    for i in replace:
+        words[i] = f"changed{i}"
+    return " ".join(words)
+
+
+@pytest.fixture(autouse=True)
+def plain_text_pdfs(monkeypatch):
+    """The test files hold plain text, read as one page"""
+    reads = []
+
+    def extract_pages(path):
+        reads.append(Path(path).name)
+        return [Path(path).read_text(encoding="utf-8")], None
+
+    monkeypatch.setattr(dedup, "extract_pages", extract_pages)
+    return reads
+
+
+def write(path, content, mtime=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content, encoding="utf-8")
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_minhash_estimates_similarity():
+    base = minhash(text())
+    assert similarity(base, minhash(text())) == 1.0
+    assert similarity(base, minhash(text(replace=[50]))) > 0.9
+    assert similarity(base, minhash(" ".join(reversed(text().split())))) < 0.2
+    assert minhash("a . , !") is None
+
+
+def test_exact_duplicates_keep_the_preferred_file(tmp_path):
+    paths = [
+        write(tmp_path / "Guide_OLD.pdf", "same"),
+        write(tmp_path / "Guide.pdf", "same"),
+        write(tmp_path / "Guide_NEW.pdf", "same"),
+        write(tmp_path / "Other.pdf", "different"),
+    ]
+    groups = find_duplicates(paths, cache_path=None)
+    assert groups == [{
+        "canonical": tmp_path / "Guide_NEW.pdf",
+        "duplicates": [
+            {"path": tmp_path / "Guide.pdf", "match": "exact", "similarity": 1.0},
+            {"path": tmp_path / "Guide_OLD.pdf", "match": "exact", "similarity": 1.0},
+        ]
+    }]
+
+
+def test_copies_then_older_files_are_the_duplicates(tmp_path):
+    copy = write(tmp_path / "Report copy.pdf", "same", mtime=3000)
+    newer = write(tmp_path / "b" / "Report.pdf", "same", mtime=2000)
+    older = write(tmp_path / "a" / "Report.pdf", "same", mtime=1000)
+    [group] = find_duplicates([copy, older, newer], cache_path=None)
+    assert group["canonical"] == newer
+    assert [duplicate["path"] for duplicate in group["duplicates"]] == [older, copy]
+
+
+def test_near_duplicates_are_grouped_above_the_threshold(tmp_path):
+    original = write(tmp_path / "Policy.pdf", text(), mtime=2000)
+    edited = write(tmp_path / "Policy edited.pdf", text(replace=[10, 100]), mtime=1000)
+    unrelated = write(tmp_path / "Unrelated.pdf", " ".join(reversed(text().split())))
+
+    # Exact matching alone does not group them
+    assert find_duplicates([original, edited, unrelated], cache_path=None) == []
+
+    [group] = find_duplicates([original, edited, unrelated], threshold=0.8, cache_path=None)
+    assert group["canonical"] == original
+    [duplicate] = group["duplicates"]
+    assert duplicate["path"] == edited and duplicate["match"] == "near"
+    assert 0.8 <= duplicate["similarity"] < 1.0
+
+    assert find_duplicates([original, edited], threshold=0.99, cache_path=None) == []
+
+
+def test_dedupe_keeps_the_order_of_the_files_left(tmp_path):
+    paths = [
+        write(tmp_path / "c.pdf", "one"),
+        write(tmp_path / "b.pdf", "two"),
+        write(tmp_path / "a copy.pdf", "one"),
+        write(tmp_path / "a.pdf", "three"),
+    ]
+    kept, groups = dedupe(paths, cache_path=None)
+    assert kept == [paths[0], paths[1], paths[3]]
+    assert len(groups) == 1
+
+
+def test_fingerprints_are_cached_until_the_file_changes(tmp_path, plain_text_pdfs):
+    cache_path = tmp_path / "cache.json"
+    path = write(tmp_path / "docs" / "a.pdf", text(), mtime=1000)
+
+    first = dedup.fingerprints([path], cache_path=cache_path)
+    assert dedup.fingerprints([path], cache_path=cache_path) == first
+    assert plain_text_pdfs == ["a.pdf"]
+
+    write(path, text(replace=[1]), mtime=2000)
+    assert dedup.fingerprints([path], cache_path=cache_path)[path]["sha256"] != first[path]["sha256"]
+    assert plain_text_pdfs == ["a.pdf", "a.pdf"]
@@ -0,0 +1,79 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import corpus
+from dense_index import DenseIndex, add_documents, build_dense_index, top_k
+from embeddings import HashingEmbedder
+
+DOCUMENTS = {
+    "Education/Auslan classes.pdf": "Auslan classes for toddlers run every week at the deaf school.",
+    "NDIS/Hearing aids.pdf": "The NDIS funds hearing aids and cochlear implant processors.",
+    "State/Travel.pdf": "Travel to appointments in Victoria can be reimbursed.",
+}
+
+
+def write_documents(directory, documents):
+    paths = []
+    for relative, text in documents.items():
+        path = directory / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    """Plain-text stand-ins for PDFs, read as one page"""
+    monkeypatch.setattr(corpus, "extract_pages", lambda path: ([Path(path).read_text(encoding="utf-8")], None))
+    write_documents(tmp_path / "source", DOCUMENTS)
+    return tmp_path / "source"
+
+
+def test_top_k_is_ordered_and_bounded():
+    scores = np.array([[0.1, 0.9, 0.5], [0.3, 0.2, 0.1]], dtype=np.float32)
+    assert top_k(scores, 2).tolist() == [[1, 2], [0, 1]]
+    assert top_k(scores, 10).shape == (2, 3)
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_search_finds_the_matching_chunk(source, tmp_path, dtype):
+    manifest = build_dense_index(source, tmp_path / "dense", embedder=HashingEmbedder(dim=256), dtype=dtype)
+    assert manifest["chunks"] == 3
+
+    index = DenseIndex(tmp_path / "dense")
+    assert index.vectors.dtype == np.dtype(dtype)
+    [hit] = index.search("cochlear implant processors", k=1)
+    assert hit["filename"] == "Hearing aids.pdf" and hit["category"] == "NDIS"
+    assert hit["score"] > 0.3
+
+    batch = index.search_batch(["auslan toddlers", "travel victoria"], k=1)
+    assert [hits[0]["filename"] for hits in batch] == ["Auslan classes.pdf", "Travel.pdf"]
+
+
+def test_ivf_search_matches_exact_search_when_every_cell_is_probed(source, tmp_path):
+    build_dense_index(source, tmp_path / "dense", embedder=HashingEmbedder(dim=256), ivf_nlist=2)
+    exact = DenseIndex(tmp_path / "dense", nprobe=0)
+    probed = DenseIndex(tmp_path / "dense", nprobe=2)
+    assert exact.ivf is None and probed.ivf is not None
+    for query in ("cochlear implant", "auslan classes", "appointments"):
+        expected, found = exact.search(query, k=3), probed.search(query, k=3)
+        # Chunks with equal scores can come back in either order
+        assert [hit["score"] for hit in found] == pytest.approx([hit["score"] for hit in expected])
+        assert found[0]["chunk_id"] == expected[0]["chunk_id"]
+
+
+def test_added_documents_are_searchable_and_change_the_fingerprint(source, tmp_path):
+    build_dense_index(source, tmp_path / "dense", embedder=HashingEmbedder(dim=256), ivf_nlist=2)
+    fingerprint = DenseIndex(tmp_path / "dense").fingerprint
+    new = write_documents(tmp_path / "new", {"Education/Captioning.pdf": "Live captioning in classrooms for deaf students."})
+
+    manifest = add_documents(tmp_path / "dense", new + [source / "State/Travel.pdf"])
+    assert manifest["chunks"] == 4 and manifest["documents"] == 4
+
+    index = DenseIndex(tmp_path / "dense")
+    assert index.fingerprint != fingerprint
+    assert len(index.ivf) == 4
+    assert index.search("captioning classrooms", k=1)[0]["filename"] == "Captioning.pdf"
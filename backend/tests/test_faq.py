@@ -0,0 +1,73 @@
+import pytest
+
+from faq import FAQIndex, tokenize
+
+ENTRIES = [
+    {
+        "id": "apply",
+        "questions": ["How do I apply for NDIS access?", "How do I apply for the NDIS?"],
+        "answer": "Contact the NDIA.",
+        "citations": [{"filename": "access.pdf", "url": "https://example.org/access", "category": "NDIS"}]
+    },
+    {
+        "id": "hearing-aids",
+        "questions": ["Does the NDIS fund hearing aids?", "Will the NDIS pay for hearing aids?"],
+        "answer": "Usually not; see Hearing Australia."
+    },
+    {"id": "cochlear", "questions": ["What is a cochlear implant?"], "answer": "A surgically implanted device."},
+    {"id": "early", "questions": ["What is early intervention?"], "answer": "Support from birth to school age."},
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return FAQIndex(ENTRIES)
+
+
+def test_tokenize_keeps_question_words_and_negations():
+    assert tokenize("Why can't I apply for the NDIS?") == ["why", "not", "apply", "ndis"]
+    assert tokenize("It doesn’t cover aids") == ["not", "cover", "aids"]
+    assert tokenize("Who is not eligible?") == ["who", "not", "eligible"]
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("How do I apply for NDIS access?", "apply"),
+    ("how can i apply for ndis access", "apply"),
+    ("Does NDIS fund hearing aids", "hearing-aids"),
+    ("Does the NDIS fund hearing aid", "hearing-aids"),
+    ("what's a cochlear implant", "cochlear"),
+    ("cochlear implant?", "cochlear"),
+])
+def test_matches_rephrasings(index, question, expected):
+    matched = index.match(question)
+    assert matched is not None
+    assert matched[0]["id"] == expected
+
+
+@pytest.mark.parametrize("question", [
+    "When can I apply for NDIS access?",
+    "Who can apply for NDIS access?",
+    "Does the NDIS not fund hearing aids?",
+    "Why would a cochlear implant fail?",
+    "What is a hearing aid battery?",
+])
+def test_different_questions_go_to_the_model(index, question):
+    assert index.match(question) is None
+
+
+def test_citations_are_normalised(index):
+    entry, score = index.match("How do I apply for NDIS access?")
+    assert score == pytest.approx(1.0)
+    assert entry["citations"] == [{
+        "filename": "access.pdf",
+        "file_id": None,
+        "metadata": {"url": "https://example.org/access", "category": "NDIS"}
+    }]
+
+
+def test_close_runner_up_is_not_a_match():
+    index = FAQIndex([
+        {"id": "a", "questions": ["What is NDIS access?"], "answer": "a"},
+        {"id": "b", "questions": ["What is NDIS access?"], "answer": "b"},
+    ])
+    assert index.match("What is NDIS access?") is None
@@ -0,0 +1,63 @@
+import csv
+import json
+
+import pytest
+from PyPDF2 import PdfWriter
+
+from storage.functions.file_catalog import COLUMNS, create_file_catalog, write_catalog
+
+
+def write_pdf(path, metadata=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    writer = PdfWriter()
+    writer.add_blank_page(100, 100)
+    if metadata:
+        writer.add_metadata(metadata)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+@pytest.fixture
+def records(tmp_path):
+    root = tmp_path / "COMBINED"
+    write_pdf(root / "NDIS" / "Access_NEW.pdf", {"/SourceURL": "https://example.org/access"})
+    write_pdf(root / "NDIS" / "Access_OLD.pdf")
+    write_pdf(root / "Education" / "Guide.pdf")
+    (root / "Education" / "Broken.pdf").write_bytes(b"not a pdf")
+    (root / "Education" / "notes.txt").write_text("not catalogued")
+    # Only PDFs inside a category directory are catalogued
+    write_pdf(root / "Uncategorised.pdf")
+    return list(create_file_catalog(str(root), workers=1, cache_path=None))
+
+
+def test_catalog_records_each_categorised_pdf(records):
+    by_name = {record.name: record for record in records}
+    assert sorted(by_name) == ["Access_NEW.pdf", "Access_OLD.pdf", "Broken.pdf", "Guide.pdf"]
+
+    access = by_name["Access_NEW.pdf"]
+    assert (access.category, access.version, access.source_url) == ("NDIS", "NEW", "https://example.org/access")
+    assert access.size_kb > 0
+    assert by_name["Access_OLD.pdf"].version == "OLD"
+    assert by_name["Guide.pdf"].version == "UNKNOWN"
+
+
+def test_rows_say_why_there_is_no_url(records):
+    rows = {record.name: record.row() for record in records}
+    assert list(rows["Guide.pdf"]) == [header for header, _ in COLUMNS]
+    assert rows["Guide.pdf"]["Source URL"] == "No URL found"
+    assert rows["Broken.pdf"]["Source URL"] == "Error reading metadata"
+
+
+def test_write_catalog_by_extension(records, tmp_path):
+    assert write_catalog(iter(records), str(tmp_path / "catalog.jsonl")) == 4
+    with open(tmp_path / "catalog.jsonl", encoding="utf-8") as f:
+        assert [json.loads(line)["Name"] for line in f] == [record.name for record in records]
+
+    assert write_catalog(records, str(tmp_path / "catalog.csv")) == 4
+    with open(tmp_path / "catalog.csv", newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert rows[0].keys() == {header for header, _ in COLUMNS}
+    assert [row["Category"] for row in rows] == [record.category for record in records]
+
+    with pytest.raises(ValueError):
+        write_catalog(records, str(tmp_path / "catalog.txt"))
@@ -0,0 +1,158 @@
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from flag_queue import FlagQueue
+
+
+class FakeSession:
+    """
+    Records every POST and answers with the queued responses, then 400 for
+    a batch with a flag in `invalid`, then 201
+    """
+
+    def __init__(self):
+        self.posts = []
+        self.responses = []
+        self.invalid = set()
+
+    def post(self, url, params=None, headers=None, json=None, timeout=None):
+        self.posts.append({"url": url, "params": params, "prefer": headers["Prefer"], "body": json})
+        if self.responses:
+            response = self.responses.pop(0)
+        elif any(row["flaggedText"] in self.invalid for row in json):
+            response = (400, {"code": "22007", "message": "invalid input syntax for type timestamp"})
+        else:
+            response = (201, None)
+        if isinstance(response, Exception):
+            raise response
+        status, error = response
+        return SimpleNamespace(status_code=status, text=str(error), json=lambda: error)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = FlagQueue(str(tmp_path / "outbox.sqlite3"), "http://supabase", {"apikey": "key"}, batch_size=2)
+    queue.session = FakeSession()
+    return queue
+
+
+def flag(n):
+    return {"flaggedText": f"answer {n}", "userPrompt": f"question {n}", "timestamp": "2024-05-01T00:00:00Z"}
+
+
+def due(queue):
+    """Make every queued row due now, skipping its backoff"""
+    queue._connect().execute("UPDATE outbox SET next_attempt = 0")
+
+
+def test_flush_sends_batches_with_their_idempotency_keys(queue):
+    keys = [queue.enqueue(flag(n)) for n in range(3)]
+
+    assert queue.flush_once() == 2
+    assert queue.flush_once() == 1
+    assert queue.flush_once() == 0
+    assert queue.pending() == 0
+
+    first, second = queue.session.posts
+    assert first["params"] == {"on_conflict": "idempotency_key"}
+    assert "resolution=ignore-duplicates" in first["prefer"]
+    assert [row["idempotency_key"] for row in first["body"] + second["body"]] == keys
+    assert first["body"][0]["flaggedText"] == "answer 0"
+
+
+@pytest.mark.parametrize("failure", [
+    (503, {"message": "unavailable"}), (429, {"message": "slow down"}), requests.ConnectionError("refused")
+])
+def test_failed_flush_keeps_the_rows_for_a_retry(queue, failure):
+    key = queue.enqueue(flag(0))
+    queue.session.responses.append(failure)
+
+    assert queue.flush_once() == 0
+    assert queue.pending() == 1
+    attempts, next_attempt = queue._connect().execute("SELECT attempts, next_attempt FROM outbox").fetchone()
+    assert attempts == 1 and next_attempt > 0
+    # Backing off: not sent again until it is due
+    assert queue.flush_once() == 0
+    assert len(queue.session.posts) == 1
+
+    due(queue)
+    assert queue.flush_once() == 1
+    assert queue.session.posts[-1]["body"][0]["idempotency_key"] == key
+
+
+def test_falls_back_to_inserts_without_a_unique_constraint(queue, caplog):
+    key = queue.enqueue(flag(0))
+    queue.session.responses.append((400, {
+        "code": "42P10",
+        "message": "there is no unique or exclusion constraint matching the ON CONFLICT specification"
+    }))
+
+    assert queue.flush_once() == 1
+    upsert, insert = queue.session.posts
+    assert upsert["params"] == {"on_conflict": "idempotency_key"}
+    assert insert["params"] is None and insert["prefer"] == "return=minimal"
+    # The column exists, so the keys are still stored
+    assert insert["body"][0]["idempotency_key"] == key
+    assert "idempotency_key" in caplog.text and "ERROR" in caplog.text
+
+    queue.enqueue(flag(1))
+    assert queue.flush_once() == 1
+    assert queue.session.posts[-1]["params"] is None
+
+
+def test_falls_back_to_unkeyed_inserts_without_the_column(queue):
+    queue.enqueue(flag(0))
+    queue.session.responses.append((400, {
+        "code": "PGRST204",
+        "message": "Could not find the 'idempotency_key' column of 'flags' in the schema cache"
+    }))
+
+    assert queue.flush_once() == 1
+    assert queue.session.posts[-1]["params"] is None
+    assert "idempotency_key" not in queue.session.posts[-1]["body"][0]
+
+
+def test_other_bad_requests_do_not_fall_back(queue):
+    queue.enqueue(flag(0))
+    queue.session.responses.append((400, {"code": "PGRST204", "message": "Could not find the 'extra' column"}))
+
+    assert queue.flush_once() == 0
+    assert len(queue.session.posts) == 1
+    assert queue.upsert and queue.keyed
+    assert queue.pending() == 1
+
+
+def test_a_rejected_row_does_not_hold_back_its_batch(queue):
+    queue.enqueue(flag(0))
+    queue.enqueue(flag(1))
+    queue.session.invalid.add("answer 1")
+
+    assert queue.flush_once() == 1
+    # The whole batch, then each half
+    assert [len(post["body"]) for post in queue.session.posts] == [2, 1, 1]
+    assert queue.pending() == 1
+    attempts, payload = queue._connect().execute("SELECT attempts, payload FROM outbox").fetchone()
+    assert attempts == 1 and "answer 1" in payload
+
+
+def test_a_row_rejected_max_attempts_times_is_dead_lettered(queue):
+    queue.enqueue(flag(0))
+    queue.session.invalid.add("answer 0")
+
+    for _ in range(queue.max_attempts):
+        due(queue)
+        assert queue.flush_once() == 0
+    assert queue.pending() == 0
+    assert queue.dead_letters() == 1
+    attempts, error = queue._connect().execute("SELECT attempts, error FROM dead_letter").fetchone()
+    assert attempts == queue.max_attempts and "22007" in error
+
+    # Server errors are retried however long they last
+    queue.enqueue(flag(1))
+    queue.session.responses.extend([(500, {"message": "down"})] * queue.max_attempts)
+    for _ in range(queue.max_attempts):
+        due(queue)
+        queue.flush_once()
+    assert queue.pending() == 1 and queue.dead_letters() == 1
@@ -0,0 +1,43 @@
+import logging
+import os
+
+import logging_setup
+
+
+def test_forked_child_gets_a_running_listener():
+    listener = logging_setup.setup_logging()
+    pid = os.fork()
+    if pid == 0:
+        # A listener thread copied over from the parent would not be running
+        child = logging_setup._listener
+        ok = (
+            child is not listener
+            and child._thread is not None and child._thread.is_alive()
+            and logging_setup._queue_handler.queue is child.queue
+        )
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert listener._thread.is_alive()
+
+
+def test_records_are_written_after_fork(tmp_path):
+    logging_setup.setup_logging()
+    out = tmp_path / "child.log"
+    pid = os.fork()
+    if pid == 0:
+        handler = logging_setup._listener.handlers[0]
+        handler.setStream(open(out, "w"))
+        logging.getLogger("child").warning("from the child")
+        logging_setup._stop_listener()
+        handler.stream.close()
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert '"message": "from the child"' in out.read_text()
+
+
+def test_user_text_is_summarised():
+    record = logging.makeLogRecord({"msg": "key sk-abcdefghijkl", "user_message": "hello"})
+    logging_setup.RequestContextFilter().filter(record)
+    assert "sk-abcdefghijkl" not in record.msg
+    assert record.user_message == {"chars": 5, "sha256": logging_setup.summarize_text("hello")["sha256"]}
@@ -0,0 +1,107 @@
+import re
+
+import pytest
+from PyPDF2 import PdfWriter
+
+from storage.functions import pdf_info
+from storage.functions.pdf_info import Unsupported, read_info_source_url, read_source_url, source_urls
+
+URL = "https://example.org/guide (2024).pdf"
+
+
+def write_pdf(path, metadata=None):
+    writer = PdfWriter()
+    writer.add_blank_page(100, 100)
+    if metadata is not None:
+        writer.add_metadata(metadata)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return path
+
+
+def append_update(path, objects, info):
+    """Append an incremental update with objects ({number: body}) and a trailer pointing at Info info"""
+    data = path.read_bytes()
+    previous = int(re.findall(rb"startxref\s+(\d+)", data)[-1])
+    root = re.search(rb"/Root\s+(\d+ \d+ R)", data).group(1)
+    update = bytearray(b"\n")
+    offsets = {}
+    for number, body in objects.items():
+        offsets[number] = len(data) + len(update)
+        update += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(data) + len(update)
+    update += b"xref\n"
+    for number, offset in sorted(offsets.items()):
+        update += b"%d 1\n%010d 00000 n \n" % (number, offset)
+    update += b"trailer\n<< /Size %d /Root %s /Info %d 0 R /Prev %d >>\nstartxref\n%d\n%%%%EOF\n" % (
+        max(objects) + 1, root, info, previous, xref
+    )
+    path.write_bytes(data + bytes(update))
+    return path
+
+
+def test_reads_escaped_urls_through_the_trailer(tmp_path):
+    path = write_pdf(tmp_path / "a.pdf", {"/SourceURL": URL})
+    assert read_info_source_url(path) == URL
+    assert read_source_url(path) == (URL, False)
+
+
+def test_pdf_without_a_source_url(tmp_path):
+    assert read_info_source_url(write_pdf(tmp_path / "a.pdf", {"/Title": "Guide"})) is None
+
+
+def test_pdf_without_an_info_dictionary(tmp_path):
+    path = write_pdf(tmp_path / "a.pdf")
+    # Blank the trailer's /Info entry, keeping every offset
+    path.write_bytes(re.sub(rb"/Info \d+ 0 R", lambda m: b" " * len(m.group()), path.read_bytes()))
+    assert read_source_url(path) == (None, False)
+
+
+def test_hex_and_utf16_strings(tmp_path):
+    path = write_pdf(tmp_path / "a.pdf")
+    append_update(path, {10: b"<< /SourceURL <FEFF0068007400740070003A002F002F00E9> >>"}, info=10)
+    assert read_info_source_url(path) == "http://é"
+
+
+def test_follows_prev_to_an_info_object_not_updated(tmp_path):
+    path = write_pdf(tmp_path / "a.pdf", {"/SourceURL": URL})
+    info = int(re.search(rb"/Info\s+(\d+)", path.read_bytes()).group(1))
+    append_update(path, {10: b"<< /Unrelated true >>"}, info=info)
+    assert read_info_source_url(path) == URL
+
+
+def test_latest_revision_wins(tmp_path):
+    path = write_pdf(tmp_path / "a.pdf", {"/SourceURL": URL})
+    append_update(path, {10: b"<< /SourceURL (https://example.org/new) >>"}, info=10)
+    assert read_source_url(path) == ("https://example.org/new", False)
+
+
+def test_indirect_values_fall_back_to_a_full_parse(tmp_path):
+    path = write_pdf(tmp_path / "a.pdf")
+    append_update(path, {10: b"<< /SourceURL 11 0 R >>", 11: b"(https://example.org/indirect)"}, info=10)
+    with pytest.raises(Unsupported):
+        read_info_source_url(path)
+    assert read_source_url(path) == ("https://example.org/indirect", False)
+
+
+def test_unreadable_files_are_reported(tmp_path):
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"not a pdf")
+    assert read_source_url(path) == (None, True)
+
+
+def test_results_are_cached_until_the_file_changes(tmp_path, monkeypatch):
+    cache_path = tmp_path / "cache.json"
+    paths = [write_pdf(tmp_path / f"{n}.pdf", {"/SourceURL": f"https://example.org/{n}"}) for n in range(3)]
+    reads = []
+    read = pdf_info.read_source_url
+    monkeypatch.setattr(pdf_info, "read_source_url", lambda path: reads.append(path) or read(path))
+
+    first = source_urls(paths, cache_path=cache_path)
+    assert first[paths[1]] == ("https://example.org/1", False)
+    assert source_urls(paths, cache_path=cache_path) == first
+    assert len(reads) == 3
+
+    write_pdf(paths[0], {"/SourceURL": "https://example.org/changed"})
+    assert source_urls(paths, cache_path=cache_path)[paths[0]] == ("https://example.org/changed", False)
+    assert reads[3:] == [paths[0]]
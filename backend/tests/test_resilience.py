@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+import resilience
+from resilience import CircuitBreaker, CircuitOpen, UpstreamPolicy, is_retryable
+
+
+def status_error(status, headers=None):
+    response = httpx.Response(status, headers=headers, request=httpx.Request("POST", "https://api.openai.com/v1"))
+    return openai.APIStatusError(f"status {status}", response=response, body=None)
+
+
+def connection_error():
+    return openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1"))
+
+
+class Upstream:
+    """fn(timeout=) that raises the queued errors, then returns "ok" """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.timeouts = []
+
+    def __call__(self, timeout):
+        self.timeouts.append(timeout)
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def policy(**kwargs):
+    return UpstreamPolicy("test", base_delay=0.001, max_delay=0.001, **kwargs)
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (connection_error(), True),
+    (status_error(408), True),
+    (status_error(429), True),
+    (status_error(503), True),
+    (status_error(400), False),
+    (status_error(404), False),
+    (status_error(409), False),
+    (ValueError("bug"), False),
+])
+def test_is_retryable(error, retryable):
+    assert is_retryable(error) == retryable
+
+
+def test_retries_retryable_errors():
+    upstream = Upstream(status_error(503), connection_error())
+    assert policy(attempts=3).call(upstream) == "ok"
+    assert len(upstream.timeouts) == 3
+    # Each attempt gets what is left of the deadline
+    assert upstream.timeouts[0] <= 60 and upstream.timeouts == sorted(upstream.timeouts, reverse=True)
+
+
+def test_gives_up_after_the_last_attempt():
+    upstream = Upstream(*[status_error(503)] * 3)
+    with pytest.raises(openai.APIStatusError):
+        policy(attempts=2).call(upstream)
+    assert len(upstream.timeouts) == 2
+
+
+def test_does_not_retry_client_errors():
+    upstream = Upstream(status_error(400))
+    with pytest.raises(openai.APIStatusError):
+        policy(attempts=3).call(upstream)
+    assert len(upstream.timeouts) == 1
+
+
+def test_retry_after_longer_than_the_deadline_is_not_waited_for():
+    upstream = Upstream(status_error(429, {"retry-after": "30"}))
+    started = time.monotonic()
+    with pytest.raises(openai.APIStatusError):
+        policy(attempts=3, deadline=1).call(upstream)
+    assert time.monotonic() - started < 0.5
+
+
+def test_breaker_opens_then_lets_one_probe_through(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    upstream = Upstream(*[status_error(503)] * 2)
+    guarded = policy(attempts=1, breaker=breaker)
+
+    for _ in range(2):
+        with pytest.raises(openai.APIStatusError):
+            guarded.call(upstream)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpen) as rejected:
+        guarded.call(upstream)
+    assert rejected.value.retry_after == 30
+    assert len(upstream.timeouts) == 2
+
+    now[0] += 30
+    breaker.allow()
+    assert breaker.state == "half_open"
+    # Only one probe at a time
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_breaker_counts_calls_not_attempts():
+    breaker = CircuitBreaker("test", failure_threshold=2)
+    guarded = policy(attempts=3, breaker=breaker)
+    with pytest.raises(openai.APIStatusError):
+        guarded.call(Upstream(*[status_error(503)] * 3))
+    assert breaker.state == "closed"
+    # Retried into a success: the failed attempts do not count
+    assert guarded.call(Upstream(status_error(503), status_error(503))) == "ok"
+    with pytest.raises(openai.APIStatusError):
+        guarded.call(Upstream(*[status_error(503)] * 3))
+    assert breaker.state == "closed"
+
+    with pytest.raises(openai.APIStatusError):
+        guarded.call(Upstream(*[status_error(503)] * 3))
+    assert breaker.state == "open"
+
+
+def test_a_cancelled_probe_lets_the_next_one_through():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    async def hang(timeout):
+        await asyncio.sleep(5)
+
+    async def main():
+        probe = asyncio.ensure_future(policy(breaker=breaker).acall(hang))
+        await asyncio.sleep(0)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(main())
+    assert breaker.state == "half_open"
+    breaker.allow()
+
+
+def test_client_errors_do_not_open_the_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1)
+    with pytest.raises(openai.APIStatusError):
+        policy(attempts=1, breaker=breaker).call(Upstream(status_error(404)))
+    assert breaker.state == "closed"
+
+
+def test_slow_attempts_are_hedged():
+    hedged = policy(hedge=True, hedge_min_delay=0.01)
+    for _ in range(hedged.latency.min_samples):
+        hedged.latency.observe(0.01)
+    release = threading.Event()
+    calls = []
+
+    def fn(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            # The first attempt hangs until the test ends
+            release.wait(5)
+            return "slow"
+        return "fast"
+
+    try:
+        assert hedged.call(fn) == "fast"
+    finally:
+        release.set()
+    assert len(calls) == 2
+
+
+def test_acall_retries():
+    errors = [connection_error()]
+
+    async def fn(timeout):
+        if errors:
+            raise errors.pop()
+        return "ok"
+
+    assert asyncio.run(policy(attempts=2).acall(fn)) == "ok"
+    assert errors == []
@@ -0,0 +1,83 @@
+import pytest
+
+from routing import QueryRouter, classify, file_search_filters, superseded_files
+
+EARLY = "Early Intervention"
+EDUCATION = "Education"
+FEDERAL = "Australian Federal Laws and Policies"
+LANGUAGE = "Language Development Tools & Assessment Resources for DHH Children"
+NDIS = "NDIS Access, Assistive Technology and Carer Inclusion"
+STATE = "State and Territory Policies (AUSTRALIA)"
+
+
+@pytest.mark.parametrize("question, categories", [
+    ("Is my son eligible for the NDIS?", [NDIS]),
+    ("What does the Disability Discrimination Act say?", [FEDERAL]),
+    ("Hearing test for my newborn", [EARLY]),
+    ("What are the Auslan milestones for a toddler?", [LANGUAGE, EARLY]),
+    # Speaking is as much language development as early intervention
+    ("How do I help my deaf baby learn to talk", [EARLY, LANGUAGE]),
+    ("Can my child get a hearing aid at school in NSW?", [EDUCATION, STATE]),
+])
+def test_classify(question, categories):
+    assert sorted(classify(question)) == sorted(categories)
+
+
+@pytest.mark.parametrize("question", [
+    # Words every kind of question uses say nothing about the category
+    "How do I get access to a hearing aid?",
+    "Is there a guide for parents to use at home?",
+    "Which act or policy covers this?",
+    "What should be in my child's plan?",
+    # Too many categories to narrow the search safely
+    "Can a toddler at school in Victoria get funding?",
+])
+def test_classify_does_not_narrow_general_questions(question):
+    assert classify(question) == []
+
+
+def test_file_search_filters():
+    assert file_search_filters([]) is None
+    assert file_search_filters([EDUCATION]) == {"type": "eq", "key": "category", "value": EDUCATION}
+    assert file_search_filters([EDUCATION, STATE], {"b_OLD.pdf"}) == {
+        "type": "and",
+        "filters": [
+            {"type": "or", "filters": [
+                {"type": "eq", "key": "category", "value": EDUCATION},
+                {"type": "eq", "key": "category", "value": STATE},
+            ]},
+            {"type": "ne", "key": "filename", "value": "b_OLD.pdf"},
+        ]
+    }
+
+
+def test_superseded_files():
+    files = [
+        {"filename": "Inclusion Guide 2020_OLD.pdf", "category": EDUCATION, "version": "OLD"},
+        {"filename": "Inclusion Guide 2020_NEW.pdf", "category": EDUCATION, "version": "NEW"},
+        # Different year, or a replacement in another category: kept
+        {"filename": "Annual Report 2019_OLD.pdf", "category": NDIS, "version": "OLD"},
+        {"filename": "Annual Report 2021_NEW.pdf", "category": NDIS, "version": "NEW"},
+        {"filename": "Funding Rules_OLD.pdf", "category": STATE, "version": "OLD"},
+        {"filename": "Funding Rules_NEW.pdf", "category": FEDERAL, "version": "NEW"},
+    ]
+    assert superseded_files(files) == {"Inclusion Guide 2020_OLD.pdf"}
+
+
+def test_router_works_out_superseded_files_once_per_snapshot():
+    snapshots = []
+    files = [
+        {"filename": "Guide_OLD.pdf", "category": EDUCATION, "version": "OLD"},
+        {"filename": "Guide_NEW.pdf", "category": EDUCATION, "version": "NEW"},
+    ]
+
+    def snapshot():
+        snapshots.append(1)
+        return "v1", files
+
+    router = QueryRouter(snapshot)
+    assert router.filters("What should I ask?") == {"type": "ne", "key": "filename", "value": "Guide_OLD.pdf"}
+    files.clear()
+    # Same fingerprint: the earlier result is reused
+    assert router.superseded() == {"Guide_OLD.pdf"}
+    assert len(snapshots) == 2
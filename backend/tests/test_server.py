@@ -0,0 +1,209 @@
+import base64
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import server
+from admission import AdmissionController, RateLimiter
+from singleflight import SingleFlight
+
+
+def completed_response(text):
+    return SimpleNamespace(
+        id="resp_1",
+        output=[SimpleNamespace(
+            type="message",
+            content=[SimpleNamespace(type="output_text", text=text, annotations=[])]
+        )],
+        usage=SimpleNamespace(input_tokens=10, output_tokens=5, total_tokens=15)
+    )
+
+
+class FakeResponses:
+    """Streams `text` as one delta per word, then the completed response"""
+
+    def __init__(self, text):
+        self.text = text
+        self.calls = []
+
+    def create(self, stream=False, timeout=None, **params):
+        self.calls.append(params)
+        if not stream:
+            return completed_response(self.text)
+        events = [SimpleNamespace(type="response.output_text.delta", delta=word) for word in self.text.split(" ")]
+        events.append(SimpleNamespace(type="response.completed", response=completed_response(self.text)))
+        return iter(events)
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    responses = FakeResponses("Contact the NDIA.")
+    monkeypatch.setattr(server, "client", SimpleNamespace(responses=responses))
+    return responses
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+def sse_events(body):
+    """[(event, data)] of a Server-Sent Events body"""
+    events = []
+    for message in body.decode("utf-8").strip().split("\n\n"):
+        event, data = message.split("\n")
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def test_chat_streams_deltas_then_citations(client, responses):
+    response = client.post("/chat/stream", json={"message": "Who do I call about the NDIS stream?"})
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    assert sse_events(response.data) == [
+        ("delta", {"text": "Contact"}),
+        ("delta", {"text": "the"}),
+        ("delta", {"text": "NDIA."}),
+        ("citations", {"response": "Contact the NDIA.", "citations": []}),
+        ("done", {}),
+    ]
+
+
+def test_repeated_streamed_question_is_replayed_from_the_cache(client, responses):
+    question = {"message": "Who do I call about the NDIS replay?"}
+    # Streamed bodies are produced as they are read
+    client.post("/chat/stream", json=question).data
+    response = client.post("/chat", json=question, headers={"Accept": "text/event-stream"})
+
+    assert len(responses.calls) == 1
+    assert [event for event, _ in sse_events(response.data)] == ["delta", "citations", "done"]
+    assert sse_events(response.data)[1][1]["response"] == "Contact the NDIA."
+
+
+def test_identical_questions_at_once_take_one_slot(monkeypatch, responses):
+    # One slot and no queue: any request but the leader that asks for a slot is shed
+    monkeypatch.setattr(server, "admission", AdmissionController(limit=1, min_limit=1, queue_size=0))
+    monkeypatch.setattr(server, "rate_limiter", RateLimiter(rate=0))
+    monkeypatch.setattr(server, "inflight", SingleFlight(timeout=5))
+    release = threading.Event()
+    create = responses.create
+
+    def slow_create(**kwargs):
+        release.wait(5)
+        return create(**kwargs)
+
+    monkeypatch.setattr(responses, "create", slow_create)
+    statuses = []
+
+    def post():
+        response = server.app.test_client().post("/chat", json={"message": "Who do I call about the NDIS at once?"})
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=post) for _ in range(30)]
+    for thread in threads:
+        thread.start()
+    for _ in range(5000):
+        if server.inflight.coalesced == 29:
+            break
+        threading.Event().wait(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert statuses == [200] * 30
+    assert len(responses.calls) == 1
+    assert server.admission.stats()["in_flight"] == 0
+
+
+def test_metrics_record_requests(client, responses):
+    client.post("/chat", json={"message": "Who do I call about the NDIS metrics?"})
+    body = client.get("/metrics").data.decode("utf-8")
+    assert 'podc_request_seconds_count{endpoint="/chat",status="200"}' in body
+    assert 'podc_stage_seconds_count{endpoint="chat",stage="openai"}' in body
+
+
+@pytest.mark.parametrize("body", [
+    {"timestamp": "yesterday", "userPrompt": "q", "flaggedText": "a"},
+    {"timestamp": "2024-05-01T00:00:00Z", "userPrompt": ["q"], "flaggedText": "a"},
+    ["not", "an", "object"],
+])
+def test_invalid_flags_are_rejected_before_they_are_queued(client, body):
+    pending = server.flag_queue.pending()
+    response = client.post("/flag", json=body)
+    assert response.status_code == 400
+    assert response.get_json()["message"].startswith("Invalid flag")
+    assert server.flag_queue.pending() == pending
+
+
+def test_flag_is_queued(client):
+    response = client.post("/flag", json={"timestamp": "2024-05-01T10:00:00.123Z", "userPrompt": "q", "flaggedText": "a"})
+    assert response.status_code == 202
+    assert response.get_json()["id"]
+
+
+class FakeSupabase:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        self.calls.append(params)
+        limit = int(params["limit"])
+        return SimpleNamespace(status_code=200, text="", json=lambda: self.rows[:limit])
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    rows = [{"id": n, "timestamp": f"2024-05-0{9 - n}T00:00:00Z", "userPrompt": "q", "flaggedText": "a"} for n in range(3)]
+    supabase = FakeSupabase(rows)
+    monkeypatch.setattr(server, "supabase_session", supabase)
+    server.flags_cache.clear()
+    return supabase
+
+
+def test_flags_page_links_the_next_page(client, supabase):
+    response = client.get("/flags?limit=2")
+    assert response.status_code == 200
+    assert [row["id"] for row in response.get_json()] == [0, 1]
+    cursor = response.headers["X-Next-Cursor"]
+    assert response.headers["Link"] == f'</flags?limit=2&cursor={cursor}>; rel="next"'
+
+    client.get(f"/flags?limit=2&cursor={cursor}")
+    assert supabase.calls[-1]["or"].startswith('(timestamp.lt."2024-05-08T00:00:00Z"')
+
+
+def test_flags_last_page_has_no_cursor(client, supabase):
+    response = client.get("/flags?limit=5")
+    assert len(response.get_json()) == 3
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_flags_pages_are_cached_and_revalidated(client, supabase):
+    first = client.get("/flags?limit=2")
+    etag = first.headers["ETag"]
+    revalidated = client.get("/flags?limit=2", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b""
+    assert len(supabase.calls) == 1
+
+
+def test_flags_reject_a_bad_cursor(client, supabase):
+    assert client.get("/flags?cursor=not-a-cursor").status_code == 400
+
+
+@pytest.mark.parametrize("cursor", [
+    ['2024-05-08T00:00:00Z",id.gt.0)', 1],
+    ["2024-05-08T00:00:00Z", "1),id.gt.(0"],
+])
+def test_flags_reject_a_cursor_that_would_change_the_filter(client, supabase, cursor):
+    crafted = base64.urlsafe_b64encode(json.dumps(cursor).encode("utf-8")).decode("ascii")
+    assert client.get(f"/flags?cursor={crafted}").status_code == 400
+    assert supabase.calls == []
+
+
+def test_flags_export_as_ndjson(client, supabase):
+    response = client.get("/flags?format=ndjson")
+    assert response.mimetype == "application/x-ndjson"
+    assert [json.loads(line)["id"] for line in response.data.decode("utf-8").splitlines()] == [0, 1, 2]
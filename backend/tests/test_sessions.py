@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pytest
+
+import sessions
+from sessions import SessionBudgetExceeded, SessionStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SessionStore(str(tmp_path / "sessions.sqlite3"), context_tokens=1000, history_turns=2, token_budget=500)
+
+
+def response(response_id, input_tokens=100, total_tokens=150):
+    return SimpleNamespace(id=response_id, usage=SimpleNamespace(input_tokens=input_tokens, total_tokens=total_tokens))
+
+
+def test_turns_chain_on_the_previous_response(store):
+    session = store.get_or_create(None)
+    assert store.turn_params(session, "Hi") == {"user_input": "Hi"}
+
+    store.record_turn(session, "Hi", "Hello", response("resp_1"))
+    session = store.get_or_create(session["id"])
+    assert store.turn_params(session, "And the NDIS?") == {"user_input": "And the NDIS?", "previous_response_id": "resp_1"}
+
+
+def test_large_context_restarts_from_the_trimmed_history(store):
+    session = store.create()
+    for n in range(3):
+        store.record_turn(store.get(session["id"]), f"q{n}", f"a{n}", response(f"resp_{n}", input_tokens=2000, total_tokens=0))
+
+    params = store.turn_params(store.get(session["id"]), "q3")
+    assert params == {"user_input": [
+        {"role": "user", "content": "q1"},
+        {"role": "assistant", "content": "a1"},
+        {"role": "user", "content": "q2"},
+        {"role": "assistant", "content": "a2"},
+        {"role": "user", "content": "q3"},
+    ]}
+
+
+def test_budget_is_enforced(store):
+    session = store.create()
+    store.record_turn(session, "q", "a", response("resp_1", total_tokens=500))
+    with pytest.raises(SessionBudgetExceeded):
+        store.turn_params(store.get(session["id"]), "again")
+
+
+def test_idle_sessions_expire(store, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sessions.time, "time", lambda: now[0])
+    session = store.create()
+    now[0] += store.idle_ttl + 1
+    assert store.get(session["id"]) is None
+    assert store.get_or_create(session["id"])["id"] != session["id"]
+
+
+def test_least_recently_used_sessions_are_evicted(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sessions.time, "time", lambda: now[0])
+    store = SessionStore(str(tmp_path / "sessions.sqlite3"), max_sessions=2)
+    first = store.create()
+    for _ in range(2):
+        now[0] += 1
+        store.create()
+    assert len(store) == 2
+    assert store.get(first["id"]) is None
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+import pytest
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight(timeout=5)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "answer"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("q", fn)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do("q", fn))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flight.coalesced < 3:
+        threading.Event().wait(0.001)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+
+    assert results == ["answer"] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {"leaders": 1, "coalesced": 3, "in_flight": 0}
+
+
+def test_waiters_share_the_leaders_error():
+    flight = SingleFlight(timeout=5)
+    call, leader = flight.begin("q")
+    waiter, is_leader = flight.begin("q")
+    assert leader and not is_leader and waiter is call
+
+    flight.finish("q", call, error=RuntimeError("upstream failed"))
+    with pytest.raises(RuntimeError):
+        flight.wait(waiter)
+    # The next caller starts a new call
+    assert flight.begin("q")[1]
+
+
+def test_waiting_times_out():
+    flight = SingleFlight(timeout=0.01)
+    call, _ = flight.begin("q")
+    with pytest.raises(TimeoutError):
+        flight.wait(call)
+
+
+def test_async_callers_share_one_call():
+    flight = AsyncSingleFlight(timeout=5)
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*(flight.do("q", fn) for _ in range(4)))
+
+    assert asyncio.run(main()) == ["answer"] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {"leaders": 1, "coalesced": 3, "in_flight": 0}
+
+
+def test_waiters_outlive_a_cancelled_leader():
+    flight = AsyncSingleFlight(timeout=5)
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do("q", fn))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do("q", fn))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await waiter == "answer"
+        assert leader.cancelled()
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+    assert len(calls) == 1
+
+
+def test_an_interrupted_call_clears_its_key():
+    flight = SingleFlight(timeout=5)
+
+    def fn():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        flight.do("q", fn)
+    assert flight.stats()["in_flight"] == 0
+    assert flight.do("q", lambda: "answer") == "answer"
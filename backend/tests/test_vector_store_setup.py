@@ -0,0 +1,256 @@
+import itertools
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import vector_store_setup
+from ingest_journal import IngestJournal
+from resilience import UpstreamPolicy
+
+
+def status_error(status):
+    response = httpx.Response(status, request=httpx.Request("GET", "https://api.openai.com/v1"))
+    return openai.APIStatusError(f"status {status}", response=response, body=None)
+
+
+class FakeBatches:
+    """File batches that complete on their second poll, except for `errors`"""
+
+    def __init__(self, vector_store_files):
+        self.vector_store_files = vector_store_files
+        self.batches = {}
+        self.polls = {}
+        # batch_id -> exception raised by every poll of it
+        self.errors = {}
+        self.failing_files = set()
+        self._ids = itertools.count()
+
+    def create(self, vector_store_id, files, timeout=None):
+        batch_id = f"batch-{next(self._ids)}"
+        self.batches[batch_id] = [f["file_id"] for f in files]
+        self.polls[batch_id] = 0
+        for f in files:
+            self.vector_store_files[f["file_id"]] = f["attributes"]
+        return SimpleNamespace(id=batch_id, status="in_progress")
+
+    def retrieve(self, vector_store_id, batch_id, timeout=None):
+        self.polls[batch_id] += 1
+        if batch_id in self.errors:
+            raise self.errors[batch_id]
+        file_ids = self.batches[batch_id]
+        done = self.polls[batch_id] >= 2
+        failed = len([f for f in file_ids if f in self.failing_files]) if done else 0
+        return SimpleNamespace(
+            id=batch_id,
+            status="completed" if done else "in_progress",
+            file_counts=SimpleNamespace(completed=len(file_ids) - failed if done else 0, failed=failed, cancelled=0)
+        )
+
+    def list_files(self, batch_id, vector_store_id, limit=100, after=None, timeout=None):
+        return SimpleNamespace(
+            data=[
+                SimpleNamespace(
+                    id=file_id,
+                    status="failed" if file_id in self.failing_files else "completed",
+                    last_error=SimpleNamespace(message="unsupported file") if file_id in self.failing_files else None
+                )
+                for file_id in self.batches[batch_id]
+            ],
+            has_more=False
+        )
+
+
+class FakeVectorStoreFiles:
+    def __init__(self, attached):
+        self.attached = attached
+
+    def update(self, file_id, vector_store_id, attributes, timeout=None):
+        self.attached[file_id] = attributes
+
+    def delete(self, file_id, vector_store_id, timeout=None):
+        self.attached.pop(file_id, None)
+
+    def list(self, vector_store_id, limit=100, after=None, timeout=None):
+        return SimpleNamespace(
+            data=[SimpleNamespace(id=file_id, attributes=a) for file_id, a in sorted(self.attached.items())],
+            has_more=False
+        )
+
+
+class FakeFiles:
+    def __init__(self):
+        self.uploaded = {}
+        self.deleted = []
+        self._ids = itertools.count()
+
+    def create(self, file, purpose, timeout=None):
+        file_id = f"file-{next(self._ids)}"
+        self.uploaded[file_id] = file.read()
+        return SimpleNamespace(id=file_id)
+
+    def delete(self, file_id, timeout=None):
+        self.deleted.append(file_id)
+
+
+class FakeClient:
+    def __init__(self):
+        attached = {}
+        self.files = FakeFiles()
+        self.vector_stores = SimpleNamespace(
+            create=lambda name: SimpleNamespace(id=f"vs_{next(self._store_ids)}"),
+            file_batches=FakeBatches(attached),
+            files=FakeVectorStoreFiles(attached)
+        )
+        self._store_ids = itertools.count()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(vector_store_setup, "client", client)
+    # One attempt per call, and no waiting between polls
+    monkeypatch.setattr(vector_store_setup, "upload_policy", UpstreamPolicy("files", attempts=1))
+    monkeypatch.setattr(vector_store_setup.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(vector_store_setup, "get_catalog_metadata", lambda directory: {})
+    return client
+
+
+def write_pdf(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"%PDF-1.4\n% " + text.encode("utf-8") + b"\n%%EOF\n")
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    directory = tmp_path / "corpus"
+    for name in ("a", "b", "c"):
+        write_pdf(directory / "Category" / f"{name}.pdf", name)
+    return directory
+
+
+def test_wait_for_batches_gives_up_on_non_retryable_errors(client):
+    batches = client.vector_stores.file_batches
+    kept = batches.create("vs", [{"file_id": "file-1", "attributes": {}}]).id
+    missing = batches.create("vs", [{"file_id": "file-2", "attributes": {}}]).id
+    batches.errors[missing] = status_error(404)
+
+    finished = vector_store_setup.wait_for_batches("vs", [kept, missing])
+    assert list(finished) == [kept]
+    assert batches.polls[missing] == 1
+
+
+def test_wait_for_batches_caps_failed_polls(client):
+    batches = client.vector_stores.file_batches
+    batch_id = batches.create("vs", [{"file_id": "file-1", "attributes": {}}]).id
+    batches.errors[batch_id] = status_error(503)
+
+    assert vector_store_setup.wait_for_batches("vs", [batch_id]) == {}
+    assert batches.polls[batch_id] == vector_store_setup.MAX_FAILED_POLLS
+
+
+def test_build_closes_the_run_with_its_failures(client, corpus, tmp_path):
+    journal = IngestJournal(str(tmp_path / "journal.sqlite3"))
+    manifest = tmp_path / "manifest.json"
+    client.vector_stores.file_batches.failing_files.add("file-0")
+
+    # One upload at a time, so a.pdf is file-0
+    vector_store_id = vector_store_setup.build_vector_store(corpus, journal, manifest, concurrency=1, dedup="off")
+
+    assert journal.unfinished_run(str(corpus)) is None
+    run = journal.conn.execute("SELECT * FROM runs WHERE vector_store_id = ?", (vector_store_id,)).fetchone()
+    assert run["finished_at"] is not None and run["failed"] == 1
+    assert sorted(vector_store_setup.load_manifest(manifest)["files"]) == ["Category/b.pdf", "Category/c.pdf"]
+
+
+def test_build_marks_files_of_unreachable_batches_failed(client, corpus, tmp_path, monkeypatch):
+    journal = IngestJournal(str(tmp_path / "journal.sqlite3"))
+    batches = client.vector_stores.file_batches
+    create = batches.create
+
+    def create_unreachable(*args, **kwargs):
+        batch = create(*args, **kwargs)
+        batches.errors[batch.id] = status_error(401)
+        return batch
+
+    monkeypatch.setattr(batches, "create", create_unreachable)
+    vector_store_id = vector_store_setup.build_vector_store(corpus, journal, tmp_path / "manifest.json", dedup="off")
+
+    assert journal.counts(vector_store_id) == {"failed": 3}
+    assert journal.unfinished_run(str(corpus)) is None
+
+
+def test_interrupted_build_resumes_without_uploading_again(client, corpus, tmp_path, monkeypatch):
+    journal = IngestJournal(str(tmp_path / "journal.sqlite3"))
+    manifest = tmp_path / "manifest.json"
+
+    def interrupted(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as patch:
+        patch.setattr(vector_store_setup, "wait_for_batches", interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            vector_store_setup.build_vector_store(corpus, journal, manifest, dedup="off")
+    vector_store_id = journal.unfinished_run(str(corpus))
+    assert journal.counts(vector_store_id) == {"attached": 3}
+
+    assert vector_store_setup.build_vector_store(corpus, journal, manifest, dedup="off") == vector_store_id
+    assert len(client.files.uploaded) == 3
+    assert journal.counts(vector_store_id) == {"indexed": 3}
+    assert journal.unfinished_run(str(corpus)) is None
+
+
+def sync(corpus, manifest):
+    return vector_store_setup.sync_vector_store(corpus, "vs", manifest, concurrency=2, dedup="off")
+
+
+def assert_store_matches(client, manifest):
+    """Every attached file is tracked by the manifest, and the other way round"""
+    tracked = {entry["file_id"] for entry in manifest["files"].values()}
+    assert set(client.vector_stores.files.attached) == tracked
+
+
+def test_sync_without_changes_makes_no_calls(client, corpus, tmp_path):
+    manifest = tmp_path / "manifest.json"
+    sync(corpus, manifest)
+    assert len(client.files.uploaded) == 3
+
+    polls = dict(client.vector_stores.file_batches.polls)
+    assert_store_matches(client, sync(corpus, manifest))
+    assert len(client.files.uploaded) == 3
+    assert client.files.deleted == []
+    assert client.vector_stores.file_batches.polls == polls
+
+
+def test_sync_reuses_the_upload_of_a_moved_file(client, corpus, tmp_path):
+    manifest = tmp_path / "manifest.json"
+    file_id = sync(corpus, manifest)["files"]["Category/a.pdf"]["file_id"]
+
+    (corpus / "Other").mkdir()
+    (corpus / "Category" / "a.pdf").rename(corpus / "Other" / "a.pdf")
+    synced = sync(corpus, manifest)
+
+    assert len(client.files.uploaded) == 3
+    assert synced["files"]["Other/a.pdf"]["file_id"] == file_id
+    assert client.vector_stores.files.attached[file_id]["category"] == "Other"
+    assert_store_matches(client, synced)
+
+
+def test_sync_removes_every_vanished_copy_of_the_same_content(client, corpus, tmp_path):
+    manifest = tmp_path / "manifest.json"
+    for name in ("copy 1", "copy 2", "copy 3"):
+        write_pdf(corpus / "Copies" / f"{name}.pdf", "same")
+    copies = {relative: entry["file_id"] for relative, entry in sync(corpus, manifest)["files"].items() if "copy" in relative}
+    assert len(set(copies.values())) == 3
+
+    # One copy moves, the other two are deleted
+    (corpus / "Copies" / "copy 1.pdf").rename(corpus / "Category" / "copy 1.pdf")
+    (corpus / "Copies" / "copy 2.pdf").unlink()
+    (corpus / "Copies" / "copy 3.pdf").unlink()
+    synced = sync(corpus, manifest)
+
+    assert len(client.files.uploaded) == 6
+    assert synced["files"]["Category/copy 1.pdf"]["file_id"] in copies.values()
+    assert len(client.files.deleted) == 2
+    assert_store_matches(client, synced)
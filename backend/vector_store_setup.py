@@ -1,12 +1,21 @@
+import openai
 from openai import OpenAI
+import argparse
+import hashlib
+import json
 import os
 import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from pathlib import Path
-import pandas as pd
 from datetime import datetime
 import time
 
+from dedup import dedupe, file_sha256
+from ingest_journal import IngestJournal
+from resilience import UpstreamPolicy, is_retryable
+
 # Setup project paths
 project_root = Path(__file__).parent.parent.resolve()
 tests_path = project_root / "storage/data"
@@ -16,108 +25,155 @@ sys.path.append(str(project_root))
 sys.path.append(str(tests_path))
 
 # Import the file_catalog function - use explicit import from Tests directory
-from storage.functions.file_catalog import create_file_catalog
+from storage.functions.file_catalog import create_file_catalog, file_version
+from storage.functions.pdf_info import read_source_url
 
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Initialize OpenAI client; retries are done by upload_policy instead of the SDK
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+# Uploads in flight at once
+DEFAULT_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "8"))
+
+# Most files one vector store file batch may hold
+MAX_BATCH_FILES = 2000
+
+# What has been uploaded to which vector store, for --sync
+DEFAULT_MANIFEST = Path(__file__).parent / "vector_store_manifest.json"
+
+# Checkpoints of the build in progress, so an interrupted one resumes
+DEFAULT_JOURNAL = Path(__file__).parent / "ingest_journal.sqlite3"
+
+# Batch status polling: first wait, and the longest wait while nothing finishes
+POLL_INITIAL_DELAY = 1.0
+POLL_MAX_DELAY = 30.0
+# Failed polls in a row (each already retried) after which a batch is given up on
+MAX_FAILED_POLLS = 5
+
+# Estimated text similarity at which --dedup near treats two PDFs as one document
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
+
+# Jittered backoff on connection errors, 429s (honouring Retry-After) and 5xx
+upload_policy = UpstreamPolicy("files", deadline=600, attempts=6, base_delay=1.0, max_delay=30.0)
 
 def get_catalog_metadata(directory):
     """
-    Generate catalog and return metadata dictionary
+    Metadata for every PDF the catalog lists, keyed by resolved path
     """
     try:
-        # Ensure directory is absolute path
-        directory = Path(directory).resolve()
-        
-        # Create catalog using existing function
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        output_file = f'file_catalog_{timestamp}.xlsx'
-        
-        # Call create_file_catalog with absolute path
-        create_file_catalog(str(directory))
-        
-        # Wait briefly to ensure file is written
-        time.sleep(1)
-        
-        # Look for the generated file in the current working directory
-        catalog_files = list(Path('.').glob(f'file_catalog_*.xlsx'))
-        if not catalog_files:
-            raise FileNotFoundError("No catalog file found")
-            
-        # Use the most recent catalog file
-        latest_catalog = max(catalog_files, key=lambda p: p.stat().st_mtime)
-        print(f"Reading catalog from: {latest_catalog.absolute()}")
-        
-        # Read the generated catalog
-        df = pd.read_excel(latest_catalog)
-        
-        # Convert to dictionary with filename as key
-        metadata_dict = {}
-        for _, row in df.iterrows():
-            metadata_dict[row['Name']] = {
-                'filename': row['Name'],
-                'category': row['Category'],
-                'url': row['Source URL'] if row['Source URL'] != 'No URL found' else None,
-                'version': row['Version'],
-                'last_modified': row['Date Modified']
+        return {
+            str(Path(record.path).resolve()): {
+                'filename': record.name,
+                'category': record.category,
+                'url': record.source_url,
+                'version': record.version,
+                'last_modified': record.date_modified
             }
-        
-        return metadata_dict
-        
+            for record in create_file_catalog(str(Path(directory).resolve()))
+        }
     except Exception as e:
         print(f"Error in get_catalog_metadata: {e}")
         return {}
 
-def process_files(directory, vector_store_id):
+def path_metadata(file_path, url):
     """
-    Process files and upload them to OpenAI with metadata
+    Metadata worked out from a PDF's path and stat, the same way as the
+    catalog does, with its already known source URL
     """
-    files_with_metadata = []
-    
-    # Get metadata from catalog
-    catalog_metadata = get_catalog_metadata(directory)
+    file_path = Path(file_path)
+    return {
+        'filename': file_path.name,
+        'category': file_path.parent.name,
+        'url': url,
+        'version': file_version(file_path.name),
+        'last_modified': datetime.fromtimestamp(file_path.stat().st_mtime).strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+def get_file_metadata(file_path):
+    """
+    Metadata for a PDF the catalog does not list, worked out the same way
+    as the catalog does
+    """
+    url, _ = read_source_url(str(file_path))
+    return path_metadata(file_path, url)
+
+def file_attributes(metadata):
+    """Vector store file attributes for a file's metadata"""
+    return {
+        'filename': metadata['filename'],
+        'category': metadata['category'],
+        'url': metadata['url'] if metadata['url'] else '',
+        'version': str(metadata['version']),
+        'last_modified': str(metadata['last_modified'])
+    }
+
+def upload_file(file_path):
+    """
+    Upload one PDF, retrying transient failures, and return its file ID
+    """
+    def create(timeout):
+        with open(file_path, 'rb') as file:
+            return client.files.create(file=file, purpose="assistants", timeout=timeout)
+    return upload_policy.call(create).id
+
+def upload_files(file_paths, concurrency=DEFAULT_CONCURRENCY, on_upload=None):
+    """
+    Upload file_paths, `concurrency` at a time, printing progress, and
+    return {file_path: file_id} for each one uploaded. on_upload(file_path,
+    file_id) is called (on this thread) as each upload finishes.
+    """
+    total_bytes = sum(p.stat().st_size for p in file_paths)
+    print(f"Uploading {len(file_paths)} files ({total_bytes / 1e6:.1f} MB) with concurrency {concurrency}")
     
-    for file_path in Path(directory).glob('**/*.pdf'):
-        try:
-            filename = file_path.name
-            # Use catalog metadata if available, fallback to PDF extraction
-            if filename in catalog_metadata:
-                metadata = catalog_metadata[filename]
-            else:
-                metadata = get_file_metadata(file_path)
+    file_ids = {}
+    started = time.perf_counter()
+    uploaded_bytes = 0
+    failures = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(upload_file, file_path): file_path for file_path in file_paths}
+        for done, future in enumerate(as_completed(futures), 1):
+            file_path = futures[future]
+            try:
+                file_ids[file_path] = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"[{done}/{len(file_paths)}] Error uploading {file_path}: {e}")
+                continue
+            if on_upload is not None:
+                on_upload(file_path, file_ids[file_path])
             
-            # Upload file first
-            with open(file_path, 'rb') as file:
-                uploaded_file = client.files.create(
-                    file=file,
-                    purpose="assistants"
-                )
-                
-                # Create vector store file with metadata as attributes
-                vector_file = client.vector_stores.files.create(
-                    vector_store_id=vector_store_id,
-                    file_id=uploaded_file.id,
-                    attributes={
-                        'filename': metadata['filename'],
-                        'category': metadata['category'],
-                        'url': metadata['url'] if metadata['url'] else '',
-                        'version': str(metadata['version']),
-                        'last_modified': str(metadata['last_modified'])
-                    }
-                )
-                
-                files_with_metadata.append((vector_file.id, metadata))
-                print(f"Uploaded and processed {filename}: {vector_file.id}")
-                print(f"Metadata attributes: {vector_file.attributes}")
-                
-        except Exception as e:
-            print(f"Error processing {file_path}: {e}")
-            continue
+            uploaded_bytes += file_path.stat().st_size
+            elapsed = time.perf_counter() - started
+            print(
+                f"[{done}/{len(file_paths)}] Uploaded {file_path.name}: {file_ids[file_path]} "
+                f"({done / elapsed:.1f} files/s, {uploaded_bytes / 1e6 / elapsed:.2f} MB/s)"
+            )
     
-    return files_with_metadata
+    elapsed = time.perf_counter() - started
+    print(
+        f"Uploaded {len(file_ids)} files ({uploaded_bytes / 1e6:.1f} MB) in {elapsed:.1f}s: "
+        f"{len(file_ids) / max(elapsed, 1e-9):.1f} files/s, "
+        f"{uploaded_bytes / 1e6 / max(elapsed, 1e-9):.2f} MB/s, {failures} failed"
+    )
+    return file_ids
+
+def select_files(directory, dedup='exact'):
+    """
+    PDFs under directory to ingest. With dedup 'exact' or 'near', only the
+    canonical file of each group of duplicates is kept (see dedup.py).
+    """
+    file_paths = sorted(Path(directory).glob('**/*.pdf'))
+    if dedup == 'off':
+        return file_paths
+    threshold = NEAR_DUPLICATE_THRESHOLD if dedup == 'near' else None
+    kept, groups = dedupe(file_paths, threshold=threshold)
+    for group in groups:
+        for duplicate in group['duplicates']:
+            print(f"Skipping {duplicate['path'].name}: {duplicate['match']} duplicate of {group['canonical'].name}")
+    print(f"Skipping {len(file_paths) - len(kept)} duplicates of {len(file_paths)} files")
+    return kept
 
 def create_vector_store():
     """Create a new vector store"""
@@ -131,73 +187,480 @@ def create_vector_store():
         print(f"Error creating vector store: {e}")
         return None
 
-def create_file_batch(vector_store_id, files_with_metadata):
+def create_file_batch(vector_store_id, files_with_metadata, on_batch=None):
     """
-    Create a vector store file batch
+    Attach uploaded files to the vector store with their metadata as
+    attributes, in batches of up to MAX_BATCH_FILES. Returns the batches
+    that were created; on_batch(batch, chunk) is called as each one is.
     """
+    batches = []
+    for start in range(0, len(files_with_metadata), MAX_BATCH_FILES):
+        chunk = files_with_metadata[start:start + MAX_BATCH_FILES]
+        try:
+            batch = upload_policy.call(lambda timeout: client.vector_stores.file_batches.create(
+                vector_store_id=vector_store_id,
+                files=[
+                    {'file_id': file_id, 'attributes': file_attributes(metadata)}
+                    for file_id, metadata in chunk
+                ],
+                timeout=timeout
+            ))
+            print(f"Created file batch {batch.id} of {len(chunk)} files")
+            batches.append(batch)
+            if on_batch is not None:
+                on_batch(batch, chunk)
+        except Exception as e:
+            print(f"Error creating file batch: {e}")
+    return batches
+
+def retrieve_batch(vector_store_id, batch_id):
+    """(the file batch, None), or (None, the error) when it could not be fetched"""
     try:
-        # Extract file IDs and metadata
-        file_ids = [f[0] for f in files_with_metadata]
-        
-        # Create the file batch
-        batch = client.vector_stores.file_batches.create(
+        return upload_policy.call(lambda timeout: client.vector_stores.file_batches.retrieve(
             vector_store_id=vector_store_id,
-            file_ids=file_ids
-        )
-        return batch
+            batch_id=batch_id,
+            timeout=timeout
+        )), None
     except Exception as e:
-        print(f"Error creating file batch: {e}")
+        return None, e
+
+def wait_for_batches(vector_store_id, batch_ids, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Poll file batches until none is in progress and return {batch_id:
+    batch}. All pending batches are polled together each round. The wait
+    between rounds starts at POLL_INITIAL_DELAY, doubles while no file
+    finishes, up to POLL_MAX_DELAY, and drops back once files finish again.
+    A batch that cannot be fetched because of a non-retryable error (e.g. a
+    404 or bad credentials), or MAX_FAILED_POLLS rounds in a row, is given
+    up on and left out of the result.
+    """
+    pending = list(dict.fromkeys(batch_ids))
+    total = len(pending)
+    finished = {}
+    counts = {}
+    failed_polls = {}
+    delay = POLL_INITIAL_DELAY
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(pending)))) as pool:
+        while pending:
+            batches = pool.map(lambda batch_id: retrieve_batch(vector_store_id, batch_id), pending)
+            progressed = False
+            for batch_id, (batch, error) in zip(list(pending), batches):
+                if error is not None:
+                    failed_polls[batch_id] = failed_polls.get(batch_id, 0) + 1
+                    if not is_retryable(error) or failed_polls[batch_id] >= MAX_FAILED_POLLS:
+                        pending.remove(batch_id)
+                        print(f"Giving up on file batch {batch_id}: {error}")
+                    else:
+                        print(f"Error checking file batch {batch_id}: {error}")
+                    continue
+                failed_polls.pop(batch_id, None)
+                file_counts = batch.file_counts
+                current = (file_counts.completed, file_counts.failed, file_counts.cancelled)
+                progressed |= counts.get(batch_id) != current
+                counts[batch_id] = current
+                if batch.status != "in_progress":
+                    finished[batch_id] = batch
+                    pending.remove(batch_id)
+                    print(f"File batch {batch_id} {batch.status}: {file_counts}")
+            
+            completed = sum(c[0] for c in counts.values())
+            failed = sum(c[1] + c[2] for c in counts.values())
+            print(
+                f"{len(finished)}/{total} batches done, {completed} files indexed, "
+                f"{failed} failed after {time.perf_counter() - started:.0f}s"
+            )
+            if pending:
+                delay = POLL_INITIAL_DELAY if progressed else min(POLL_MAX_DELAY, delay * 2)
+                time.sleep(delay)
+    return finished
+
+def batch_file_statuses(vector_store_id, batch_id):
+    """{file_id: (status, error message or None)} for the files of a batch"""
+    statuses = {}
+    after = None
+    while True:
+        page = upload_policy.call(lambda timeout: client.vector_stores.file_batches.list_files(
+            batch_id,
+            vector_store_id=vector_store_id,
+            limit=100,
+            **({'after': after} if after else {}),
+            timeout=timeout
+        ))
+        for vs_file in page.data:
+            error = vs_file.last_error.message if getattr(vs_file, 'last_error', None) else None
+            statuses[vs_file.id] = (vs_file.status, error)
+        if not page.has_more or not page.data:
+            return statuses
+        after = page.data[-1].id
+
+def load_manifest(manifest_path):
+    """
+    The sync manifest:
+        {
+            "vector_store_id": "vs_...",
+            "files": {
+                "<path relative to the corpus directory>": {
+                    "sha256": "...", "size": 123, "mtime": 1700000000.0,
+                    "file_id": "file-...", "attributes": {...}
+                }
+            }
+        }
+    An uploaded file keeps its ID once attached, so file_id is both the
+    uploaded file ID and the vector store file ID.
+    """
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"vector_store_id": None, "files": {}}
+
+def save_manifest(manifest, manifest_path):
+    """Write the manifest atomically, so an interrupted run leaves the previous one"""
+    tmp_path = Path(f"{manifest_path}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def scan_directory(directory, known, file_paths=None):
+    """
+    {relative path: {"sha256", "size", "mtime"}} for file_paths, by default
+    every PDF under directory. Files whose size and mtime match their
+    `known` manifest entry keep its hash instead of being read again.
+    """
+    directory = Path(directory)
+    scanned = {}
+    for file_path in sorted(directory.glob('**/*.pdf')) if file_paths is None else file_paths:
+        relative = file_path.relative_to(directory).as_posix()
+        stat = file_path.stat()
+        entry = known.get(relative)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            sha256 = entry['sha256']
+        else:
+            sha256 = file_sha256(file_path)
+        scanned[relative] = {'sha256': sha256, 'size': stat.st_size, 'mtime': stat.st_mtime}
+    return scanned
+
+def list_vector_store_files(vector_store_id):
+    """Every file attached to the vector store"""
+    files = []
+    after = None
+    while True:
+        page = upload_policy.call(lambda timeout: client.vector_stores.files.list(
+            vector_store_id=vector_store_id,
+            limit=100,
+            **({'after': after} if after else {}),
+            timeout=timeout
+        ))
+        files.extend(page.data)
+        if not page.has_more or not page.data:
+            return files
+        after = page.data[-1].id
+
+def adopt_vector_store(directory, vector_store_id, scanned):
+    """
+    Manifest entries for a store that was built without one, matching its
+    files to local PDFs by category and filename. The local content is
+    assumed to be what was uploaded.
+    """
+    by_name = {}
+    for vs_file in list_vector_store_files(vector_store_id):
+        attributes = vs_file.attributes or {}
+        by_name[(attributes.get('category'), attributes.get('filename'))] = (vs_file.id, attributes)
+    
+    adopted = {}
+    for relative, info in scanned.items():
+        file_path = Path(directory) / relative
+        match = by_name.get((file_path.parent.name, file_path.name))
+        if match:
+            adopted[relative] = dict(info, file_id=match[0], attributes=match[1])
+    print(f"Adopted {len(adopted)} of {len(by_name)} files already in {vector_store_id}")
+    return adopted
+
+def update_attributes(vector_store_id, file_id, attributes):
+    upload_policy.call(lambda timeout: client.vector_stores.files.update(
+        file_id=file_id,
+        vector_store_id=vector_store_id,
+        attributes=attributes,
+        timeout=timeout
+    ))
+
+def remove_file(vector_store_id, file_id):
+    """Detach a file from the vector store and delete the uploaded file"""
+    for remove in (
+        lambda timeout: client.vector_stores.files.delete(file_id=file_id, vector_store_id=vector_store_id, timeout=timeout),
+        lambda timeout: client.files.delete(file_id, timeout=timeout)
+    ):
+        try:
+            upload_policy.call(remove)
+        except openai.NotFoundError:
+            # Already gone
+            pass
+
+def run_concurrently(fn, calls, concurrency, label):
+    """fn(*args) for each args in calls; returns the args of the calls that failed"""
+    failed = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(fn, *args): args for args in calls}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                failed.append(futures[future])
+                print(f"Error {label} {futures[future][0]}: {e}")
+    return failed
+
+def sync_vector_store(directory, vector_store_id, manifest_path=DEFAULT_MANIFEST,
+                      concurrency=DEFAULT_CONCURRENCY, prune=False, dedup='exact'):
+    """
+    Bring vector_store_id in line with the PDFs under directory, using the
+    manifest to find what changed since the last run:
+    - new or changed files are uploaded and attached, and the versions they
+      replace removed
+    - files whose content is unchanged but whose attributes differ (moved
+      or touched) are updated in place
+    - files no longer on disk, or now skipped as duplicates, are detached
+      and deleted
+    With prune, files in the store the manifest does not track are removed
+    too. Source URLs are only read from new or changed PDFs, and a run with
+    no changes makes no API calls (beyond the listing for prune).
+    Anything that fails is left out of the manifest so the next run retries it.
+    """
+    started = time.perf_counter()
+    directory = Path(directory)
+    manifest = load_manifest(manifest_path)
+    if manifest['vector_store_id'] not in (None, vector_store_id):
+        print(
+            f"Manifest {manifest_path} is for vector store {manifest['vector_store_id']}, "
+            f"not {vector_store_id}; use another --manifest"
+        )
         return None
+    
+    known = manifest['files']
+    scanned = scan_directory(directory, known, select_files(directory, dedup))
+    if not known and scanned:
+        known = adopt_vector_store(directory, vector_store_id, scanned)
+    files = dict(known)
+    manifest = {'vector_store_id': vector_store_id, 'files': files}
+    
+    # Content that has gone from its old path can be reused where it moved to;
+    # several vanished paths can share content, and each is reused at most once
+    vanished = defaultdict(list)
+    for relative, entry in known.items():
+        if relative not in scanned:
+            vanished[entry['sha256']].append(relative)
+    
+    to_upload = []
+    to_update = []
+    unchanged = 0
+    for relative, info in scanned.items():
+        entry = known.get(relative)
+        if entry is None and vanished.get(info['sha256']):
+            entry = files.pop(vanished[info['sha256']].pop())
+        if entry is None or entry['sha256'] != info['sha256']:
+            to_upload.append(directory / relative)
+            continue
+        attributes = file_attributes(path_metadata(directory / relative, entry['attributes'].get('url') or None))
+        files[relative] = dict(info, file_id=entry['file_id'], attributes=entry['attributes'])
+        if attributes != entry['attributes']:
+            to_update.append((relative, entry['file_id'], attributes))
+        else:
+            unchanged += 1
+    removed = [relative for paths in vanished.values() for relative in paths]
+    print(
+        f"{len(scanned)} files: {len(to_upload)} to upload, {len(to_update)} to update, "
+        f"{len(removed)} to remove, {unchanged} unchanged"
+    )
+    
+    failures = 0
+    if to_update:
+        failed = run_concurrently(
+            lambda relative, file_id, attributes: update_attributes(vector_store_id, file_id, attributes),
+            to_update, concurrency, "updating attributes of"
+        )
+        failures += len(failed)
+        for update in to_update:
+            if update not in failed:
+                files[update[0]]['attributes'] = update[2]
+        save_manifest(manifest, manifest_path)
+    
+    to_remove = []
+    if to_upload:
+        file_ids = upload_files(to_upload, concurrency)
+        uploaded = [(file_path, file_id, get_file_metadata(file_path)) for file_path, file_id in file_ids.items()]
+        batches = create_file_batch(vector_store_id, [(file_id, metadata) for _, file_id, metadata in uploaded])
+        batches = list(wait_for_batches(vector_store_id, [batch.id for batch in batches], concurrency).values())
+        failures += len(to_upload) - len(uploaded)
+        if len(batches) * MAX_BATCH_FILES < len(uploaded) or any(batch.status != "completed" for batch in batches):
+            # Keep the old versions and leave the new files out of the manifest;
+            # the next sync uploads them again and prune clears up these ones
+            print("Not all new files were attached; keeping the versions they replace")
+            failures += 1
+        else:
+            for file_path, file_id, metadata in uploaded:
+                relative = file_path.relative_to(directory).as_posix()
+                if relative in files:
+                    to_remove.append(files[relative]['file_id'])
+                files[relative] = dict(scanned[relative], file_id=file_id, attributes=file_attributes(metadata))
+            save_manifest(manifest, manifest_path)
+    
+    to_remove += [files.pop(relative)['file_id'] for relative in removed]
+    if prune:
+        tracked = {entry['file_id'] for entry in files.values()} | set(to_remove)
+        orphans = [vs_file.id for vs_file in list_vector_store_files(vector_store_id) if vs_file.id not in tracked]
+        print(f"Pruning {len(orphans)} files the manifest does not track")
+        to_remove += orphans
+    if to_remove:
+        failures += len(run_concurrently(
+            lambda file_id: remove_file(vector_store_id, file_id),
+            [(file_id,) for file_id in to_remove], concurrency, "removing"
+        ))
+    save_manifest(manifest, manifest_path)
+    
+    print(
+        f"Synced {vector_store_id} in {time.perf_counter() - started:.1f}s: "
+        f"{len(to_upload)} uploaded, {len(to_update)} updated, {len(to_remove)} removed, "
+        f"{unchanged} unchanged, {failures} failed"
+    )
+    return manifest
+
+def build_vector_store(directory, journal, manifest_path=DEFAULT_MANIFEST,
+                       concurrency=DEFAULT_CONCURRENCY, dedup='exact', fresh=False):
+    """
+    Build a vector store from the PDFs under directory, checkpointing each
+    file's progress in the journal so an interrupted build resumes where it
+    left off (unless fresh). Writes the manifest once every file is indexed
+    or has failed, and returns the vector store ID.
+    """
+    started = time.perf_counter()
+    directory = Path(directory)
+    vector_store_id = None if fresh else journal.unfinished_run(str(directory))
+    if vector_store_id:
+        print(f"Resuming the build of vector store {vector_store_id}: {dict(journal.counts(vector_store_id))}")
+    else:
+        vector_store_id = create_vector_store()
+        if not vector_store_id:
+            print("Failed to create vector store")
+            return None
+        journal.start_run(vector_store_id, str(directory))
+    
+    # Hashed: files changed or removed since an interrupted run lose their uploads
+    scanned = scan_directory(directory, journal.files(vector_store_id), select_files(directory, dedup))
+    stale = journal.hashed(vector_store_id, scanned)
+    if stale:
+        print(f"Removing {len(stale)} uploads of files that changed or were removed")
+        run_concurrently(lambda file_id: remove_file(vector_store_id, file_id), [(f,) for f in stale], concurrency, "removing")
+    
+    # Uploaded
+    to_upload = [directory / relative for relative in journal.files(vector_store_id, 'hashed')]
+    upload_started = time.perf_counter()
+    uploaded_bytes = sum(file_path.stat().st_size for file_path in to_upload)
+    if to_upload:
+        upload_files(to_upload, concurrency, on_upload=lambda file_path, file_id: journal.record(
+            vector_store_id, file_path.relative_to(directory).as_posix(), 'uploaded', file_id=file_id
+        ))
+    upload_seconds = time.perf_counter() - upload_started
+    
+    # Attached
+    to_attach = journal.files(vector_store_id, 'uploaded')
+    if to_attach:
+        catalog_metadata = get_catalog_metadata(directory)
+        files_with_metadata = []
+        paths_by_file_id = {}
+        for relative, row in to_attach.items():
+            file_path = directory / relative
+            # Use catalog metadata if available, fallback to PDF extraction
+            metadata = catalog_metadata.get(str(file_path.resolve())) or get_file_metadata(file_path)
+            files_with_metadata.append((row['file_id'], metadata))
+            paths_by_file_id[row['file_id']] = (relative, file_attributes(metadata))
+        
+        def attached(batch, chunk):
+            for file_id, _ in chunk:
+                relative, attributes = paths_by_file_id[file_id]
+                journal.record(vector_store_id, relative, 'attached', batch_id=batch.id, attributes=attributes)
+        create_file_batch(vector_store_id, files_with_metadata, on_batch=attached)
+    
+    # Indexed
+    index_started = time.perf_counter()
+    in_batches = journal.files(vector_store_id, 'attached')
+    batches = wait_for_batches(vector_store_id, [row['batch_id'] for row in in_batches.values()], concurrency)
+    for relative, row in in_batches.items():
+        if row['batch_id'] not in batches:
+            journal.record(vector_store_id, relative, 'failed', error=f"file batch {row['batch_id']} could not be checked")
+    for batch_id in batches:
+        statuses = batch_file_statuses(vector_store_id, batch_id)
+        for relative, row in in_batches.items():
+            if row['batch_id'] != batch_id:
+                continue
+            status, error = statuses.get(row['file_id'], ('missing', 'not in its batch'))
+            if status == 'completed':
+                journal.record(vector_store_id, relative, 'indexed')
+            else:
+                journal.record(vector_store_id, relative, 'failed', error=error or status)
+    index_seconds = time.perf_counter() - index_started
+    
+    counts = journal.counts(vector_store_id)
+    failed = journal.files(vector_store_id, 'failed')
+    if not counts['hashed'] and not counts['uploaded'] and not counts['attached']:
+        indexed = journal.files(vector_store_id, 'indexed')
+        previous = load_manifest(manifest_path)['vector_store_id']
+        if previous not in (None, vector_store_id):
+            print(f"Replacing the manifest for vector store {previous}")
+        save_manifest({
+            'vector_store_id': vector_store_id,
+            'files': {
+                relative: {key: row[key] for key in ('sha256', 'size', 'mtime', 'file_id', 'attributes')}
+                for relative, row in indexed.items()
+            }
+        }, manifest_path)
+        print(f"Wrote manifest {manifest_path}")
+        # Closed even with failures, which --sync retries, so the next build starts afresh
+        journal.finish_run(vector_store_id, failed=len(failed))
+    
+    for relative, row in list(failed.items())[:10]:
+        print(f"Failed: {relative}: {row['error']}")
+    print(
+        f"Vector store {vector_store_id} in {time.perf_counter() - started:.1f}s: "
+        f"{counts['indexed']} indexed, {counts['failed']} failed, "
+        f"{counts['hashed'] + counts['uploaded'] + counts['attached']} unfinished; "
+        f"uploaded {len(to_upload)} files ({uploaded_bytes / 1e6:.1f} MB) in {upload_seconds:.1f}s "
+        f"({uploaded_bytes / 1e6 / max(upload_seconds, 1e-9):.2f} MB/s), indexing took {index_seconds:.1f}s"
+    )
+    if counts['hashed'] or counts['uploaded'] or counts['attached']:
+        print("Run again to resume the unfinished files")
+    elif counts['failed']:
+        print("Run with --sync to retry the failed files")
+    return vector_store_id
 
 def main():
+    parser = argparse.ArgumentParser(description="Upload the PDF corpus to a new vector store, or sync an existing one")
+    parser.add_argument("--directory", default=None, help="PDF directory (default storage/data/Grouped_Data/COMBINED)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="uploads in flight at once")
+    parser.add_argument("--sync", action="store_true", help="update an existing vector store with what changed instead of creating one")
+    parser.add_argument("--vector-store-id", default=None, help="store to sync (default the manifest's, then VECTOR_STORE_ID)")
+    parser.add_argument("--manifest", default=str(DEFAULT_MANIFEST), help="sync manifest path")
+    parser.add_argument("--prune", action="store_true", help="with --sync, also remove store files the manifest does not track")
+    parser.add_argument("--journal", default=str(DEFAULT_JOURNAL), help="build checkpoint journal path")
+    parser.add_argument("--fresh", action="store_true", help="start a new vector store even if an earlier build is unfinished")
+    parser.add_argument("--dedup", choices=["off", "exact", "near"], default="exact",
+                        help="skip PDFs with identical bytes (exact) or also near-identical text (near)")
+    args = parser.parse_args()
+
     # Use absolute path for base directory
-    base_dir = Path(project_root) / "storage\data\Grouped_Data\COMBINED"
+    base_dir = Path(args.directory) if args.directory else Path(project_root) / "storage" / "data" / "Grouped_Data" / "COMBINED"
     base_dir = base_dir.resolve()
     
     print(f"Processing files in: {base_dir}")
     
-    # First create a vector store
-    vector_store_id = create_vector_store()
-    if not vector_store_id:
-        print("Failed to create vector store")
-        return
-    
-    # Process and upload files
-    files_with_metadata = process_files(base_dir, vector_store_id)
-    
-    if not files_with_metadata:
-        print("No files were processed successfully")
+    if args.sync:
+        vector_store_id = args.vector_store_id or load_manifest(args.manifest)['vector_store_id'] or os.getenv("VECTOR_STORE_ID")
+        if not vector_store_id:
+            print("No vector store to sync; pass --vector-store-id or set VECTOR_STORE_ID")
+            return
+        sync_vector_store(base_dir, vector_store_id, args.manifest, args.concurrency, args.prune, args.dedup)
         return
     
-    # Create file batch in the vector store
-    batch = create_file_batch(vector_store_id, files_with_metadata)
-    
-    if batch:
-        print(f"Successfully created file batch: {batch.id}")
-        print(f"Status: {batch.status}")
-        
-        # Monitor the batch status
-        try:
-            while batch.status == "in_progress":
-                # Wait a bit before checking again
-                time.sleep(5)
-                # Get updated status
-                batch = client.vector_stores.file_batches.retrieve(
-                    vector_store_id=vector_store_id,
-                    batch_id=batch.id
-                )
-                print(f"Batch status: {batch.status}")
-                print(f"File counts: {batch.file_counts}")
-                
-            if batch.status == "completed":
-                print("Successfully processed all files")
-            else:
-                print(f"Batch processing ended with status: {batch.status}")
-                
-        except Exception as e:
-            print(f"Error monitoring batch status: {e}")
-    else:
-        print("Failed to create file batch")
+    build_vector_store(base_dir, IngestJournal(args.journal), args.manifest, args.concurrency, args.dedup, args.fresh)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
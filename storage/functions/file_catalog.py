@@ -1,82 +1,142 @@
+import argparse
+import csv
+import json
 import os
-import pandas as pd
 from datetime import datetime
-from PyPDF2 import PdfReader
+from typing import NamedTuple, Optional
+from storage.functions.pdf_info import DEFAULT_CACHE, read_source_url, source_urls
 
-def create_file_catalog(root_directory):
-    # Lists to store file information
-    file_names = []
-    mod_dates = []
-    categories = []
-    versions = []
-    sizes = []
-    source_urls = []  # New list for URLs
+# Column headers of the written catalog, in order, and the record field each holds
+COLUMNS = [
+    ('Name', 'name'),
+    ('Date Modified', 'date_modified'),
+    ('Category', 'category'),
+    ('Version', 'version'),
+    ('Size (KB)', 'size_kb'),
+    ('Source URL', 'source_url'),
+]
 
-    # Walk through the directory
+class CatalogRecord(NamedTuple):
+    name: str
+    date_modified: str
+    category: str
+    version: str
+    size_kb: float
+    # None when the PDF has no /SourceURL or its metadata could not be read
+    source_url: Optional[str]
+    path: str
+    metadata_error: bool = False
+
+    def row(self):
+        """The record as a catalog row, with the sheet's placeholder URLs"""
+        row = {header: getattr(self, field) for header, field in COLUMNS}
+        if self.source_url is None:
+            row['Source URL'] = 'Error reading metadata' if self.metadata_error else 'No URL found'
+        return row
+
+def file_version(file_name):
+    if file_name.endswith('_OLD.pdf'):
+        return 'OLD'
+    if file_name.endswith('_NEW.pdf'):
+        return 'NEW'
+    return 'UNKNOWN'
+
+def catalog_record(file_path, category=None, source=None):
+    """
+    Catalog record for one PDF; category defaults to its directory name and
+    source to read_source_url(file_path)
+    """
+    file_name = os.path.basename(file_path)
+    stat = os.stat(file_path)
+    source_url, metadata_error = source if source is not None else read_source_url(file_path)
+    return CatalogRecord(
+        name=file_name,
+        date_modified=datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
+        category=category if category is not None else os.path.basename(os.path.dirname(file_path)),
+        version=file_version(file_name),
+        size_kb=round(stat.st_size / 1024, 2),
+        source_url=source_url,
+        path=file_path,
+        metadata_error=metadata_error
+    )
+
+def create_file_catalog(root_directory, workers=None, cache_path=DEFAULT_CACHE):
+    """
+    Yield a CatalogRecord for every PDF in the subdirectories of
+    root_directory, with the subdirectory name as its category. PDFs directly
+    in root_directory are not catalogued. Source URLs come from the metadata
+    cache, or are read across `workers` processes (see pdf_info.source_urls).
+    """
+    pdfs = []
     for root, dirs, files in os.walk(root_directory):
-        category = os.path.basename(root)
-        
         if root == root_directory:
             continue
-            
-        for file in files:
-            if not file.lower().endswith('.pdf'):
-                continue
+        category = os.path.basename(root)
+        for file in sorted(files):
+            if file.lower().endswith('.pdf'):
+                pdfs.append((os.path.join(root, file), category))
 
-            file_path = os.path.join(root, file)
-            file_names.append(file)
-            
-            # Get file modification time
-            mod_timestamp = os.path.getmtime(file_path)
-            mod_datetime = datetime.fromtimestamp(mod_timestamp)
-            mod_dates.append(mod_datetime.strftime('%Y-%m-%d %H:%M:%S'))
-            
-            categories.append(category)
-            
-            # Get file size
-            size_kb = round(os.path.getsize(file_path) / 1024, 2)
-            sizes.append(size_kb)
-            
-            # Get version
-            if file.endswith('_OLD.pdf'):
-                versions.append('OLD')
-            elif file.endswith('_NEW.pdf'):
-                versions.append('NEW')
-            else:
-                versions.append('UNKNOWN')
+    sources = source_urls([file_path for file_path, _ in pdfs], workers=workers, cache_path=cache_path)
+    for file_path, category in pdfs:
+        yield catalog_record(file_path, category, sources[file_path])
 
-            # Get source URL from metadata
-            try:
-                reader = PdfReader(file_path)
-                url = reader.metadata.get('/SourceURL', 'No URL found')
-                source_urls.append(url)
-            except Exception as e:
-                source_urls.append('Error reading metadata')
-    
-    # Create DataFrame with six columns
-    df = pd.DataFrame({
-        'Name': file_names,
-        'Date Modified': mod_dates,
-        'Category': categories,
-        'Version': versions,
-        'Size (KB)': sizes,
-        'Source URL': source_urls
-    })
-    
-    # Generate timestamp for unique filename
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    output_file = f'file_catalog_{timestamp}.xlsx'
-    
-    try:
+def write_jsonl(records, output_file):
+    with open(output_file, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record.row()) + '\n')
+
+def write_csv(records, output_file):
+    with open(output_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=[header for header, _ in COLUMNS])
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record.row())
+
+def write_dataframe(records, output_file):
+    # pandas (and openpyxl or pyarrow) are only needed for these formats
+    import pandas as pd
+    df = pd.DataFrame([record.row() for record in records], columns=[header for header, _ in COLUMNS])
+    if output_file.endswith('.parquet'):
+        df.to_parquet(output_file, index=False)
+    else:
         df.to_excel(output_file, index=False)
-        print(f"Catalog created successfully: {output_file}")
-        print(f"Total files processed: {len(file_names)}")
-    except Exception as e:
-        print(f"Error creating Excel file: {e}")
+
+# Catalog writers by file extension
+SINKS = {
+    '.xlsx': write_dataframe,
+    '.parquet': write_dataframe,
+    '.csv': write_csv,
+    '.jsonl': write_jsonl,
+}
+
+def write_catalog(records, output_file):
+    """
+    Write catalog records to output_file in the format its extension names
+    (.xlsx, .parquet, .csv or .jsonl) and return how many were written
+    """
+    extension = os.path.splitext(output_file)[1].lower()
+    if extension not in SINKS:
+        raise ValueError(f"Unsupported catalog format: {output_file}")
+    records = list(records)
+    SINKS[extension](records, output_file)
+    return len(records)
 
 if __name__ == "__main__":
-    # Get the current directory where the script is running
-    directory = "storage\data\Grouped_Data\COMBINED"
+    parser = argparse.ArgumentParser(description="Catalog the PDFs under a directory")
+    parser.add_argument("directory", nargs="?", default=os.path.join("storage", "data", "Grouped_Data", "COMBINED"))
+    parser.add_argument("--output", default=None, help="catalog file: .xlsx (default), .parquet, .csv or .jsonl")
+    parser.add_argument("--workers", type=int, default=None, help="processes reading PDF metadata (default one per CPU)")
+    parser.add_argument("--no-cache", action="store_true", help="read every PDF instead of using the metadata cache")
+    args = parser.parse_args()
+
+    # Generate timestamp for unique filename
+    output_file = args.output or f"file_catalog_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
 
     print("Starting catalog creation...")
-    create_file_catalog(directory)
\ No newline at end of file
+    try:
+        records = create_file_catalog(args.directory, workers=args.workers, cache_path=None if args.no_cache else DEFAULT_CACHE)
+        total = write_catalog(records, output_file)
+        print(f"Catalog created successfully: {output_file}")
+        print(f"Total files processed: {total}")
+    except Exception as e:
+        print(f"Error creating catalog file: {e}")
@@ -0,0 +1,253 @@
+"""
+Fast, cached reads of the /SourceURL entry of PDF Info dictionaries.
+
+read_source_url() looks the Info dictionary up through the trailer and the
+classic cross-reference table, so it only reads the end of the file, a few
+xref entries and the Info object itself. PDFs it cannot handle that way
+(xref streams, encryption, indirect values) go through PyPDF2 instead,
+which gives the same result.
+
+source_urls() reads many PDFs across a process pool and keeps the results
+in a JSON cache keyed by absolute path, size and mtime, so repeated catalog
+runs only read the files that changed.
+"""
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from PyPDF2 import PdfReader
+
+# Where source_urls() keeps its results between runs
+DEFAULT_CACHE = os.getenv(
+    "PDF_METADATA_CACHE",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pdf_metadata_cache.json")
+)
+
+# Below this many uncached PDFs, starting a process pool costs more than it saves
+MIN_PARALLEL = 16
+
+TAIL_BYTES = 4096
+OBJECT_BYTES = 8192
+
+_ESCAPES = {
+    b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f',
+    b'(': b'(', b')': b')', b'\\': b'\\'
+}
+
+
+class Unsupported(Exception):
+    """The PDF needs a full parse"""
+
+
+def _literal_string(data, start):
+    """Bytes of the literal string whose '(' is at data[start]"""
+    out = bytearray()
+    depth = 1
+    i = start + 1
+    while i < len(data):
+        c = data[i:i + 1]
+        if c == b'\\':
+            following = data[i + 1:i + 2]
+            octal = re.match(rb'[0-7]{1,3}', data[i + 1:i + 4])
+            if following in _ESCAPES:
+                out += _ESCAPES[following]
+                i += 2
+            elif octal:
+                out.append(int(octal.group(), 8) & 0xFF)
+                i += 1 + len(octal.group())
+            elif following in (b'\r', b'\n'):
+                # Line continuation
+                i += 3 if data[i + 1:i + 3] == b'\r\n' else 2
+            else:
+                out += following
+                i += 2
+            continue
+        if c == b'(':
+            depth += 1
+        elif c == b')':
+            depth -= 1
+            if depth == 0:
+                return bytes(out)
+        out += c
+        i += 1
+    raise Unsupported("unterminated string")
+
+
+def _hex_string(data, start):
+    end = data.find(b'>', start)
+    if end < 0:
+        raise Unsupported("unterminated hex string")
+    digits = re.sub(rb'\s', b'', data[start + 1:end])
+    if len(digits) % 2:
+        digits += b'0'
+    return bytes.fromhex(digits.decode('ascii'))
+
+
+def _text(raw):
+    if raw.startswith(b'\xfe\xff'):
+        return raw[2:].decode('utf-16-be')
+    return raw.decode('latin-1')
+
+
+def _xref_section(f, offset):
+    """
+    ([(first object, count, offset of the first entry)], trailer bytes) of
+    the classic xref section at offset
+    """
+    f.seek(offset)
+    head = f.read(64)
+    match = re.match(rb'\s*xref\s*', head)
+    if not match:
+        raise Unsupported("xref stream")
+    position = offset + match.end()
+    subsections = []
+    while True:
+        f.seek(position)
+        head = f.read(64)
+        if re.match(rb'\s*trailer', head):
+            f.seek(position)
+            return subsections, f.read(TAIL_BYTES)
+        match = re.match(rb'\s*(\d+)\s+(\d+)[ \t]*\r?\n?', head)
+        if not match:
+            raise Unsupported("malformed xref")
+        first, count = int(match.group(1)), int(match.group(2))
+        subsections.append((first, count, position + match.end()))
+        position += match.end() + 20 * count
+
+
+def _object_offset(f, subsections, number):
+    for first, count, entries in subsections:
+        if first <= number < first + count:
+            f.seek(entries + 20 * (number - first))
+            match = re.match(rb'(\d{10}) (\d{5}) n', f.read(20))
+            if not match:
+                raise Unsupported("free or malformed xref entry")
+            return int(match.group(1))
+    return None
+
+
+def _trailer_info(f):
+    """(object number, file offset) of the trailer's Info dictionary"""
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(max(0, size - TAIL_BYTES))
+    found = list(re.finditer(rb'startxref\s+(\d+)', f.read()))
+    if not found:
+        raise Unsupported("no startxref")
+
+    subsections, trailer = _xref_section(f, int(found[-1].group(1)))
+    trailer = trailer[:trailer.find(b'startxref')] if b'startxref' in trailer else trailer
+    if re.search(rb'/(Encrypt|XRefStm)\b', trailer):
+        raise Unsupported("encrypted or hybrid")
+    info = re.search(rb'/Info\s+(\d+)\s+(\d+)\s+R', trailer)
+    if not info:
+        raise Unsupported("no Info dictionary")
+
+    number = int(info.group(1))
+    seen = set()
+    while True:
+        offset = _object_offset(f, subsections, number)
+        if offset is not None:
+            return number, offset
+        # Not updated since an earlier revision: look in the previous xref section
+        previous = re.search(rb'/Prev\s+(\d+)', trailer)
+        if not previous or int(previous.group(1)) in seen:
+            raise Unsupported("Info object not in the xref table")
+        seen.add(int(previous.group(1)))
+        subsections, trailer = _xref_section(f, int(previous.group(1)))
+
+
+def read_info_source_url(file_path):
+    """
+    /SourceURL of the PDF's Info dictionary (None when it has none), read
+    through the trailer; raises Unsupported when that is not possible
+    """
+    with open(file_path, 'rb') as f:
+        number, offset = _trailer_info(f)
+        f.seek(offset)
+        data = f.read(OBJECT_BYTES)
+    header = re.match(rb'\s*(\d+)\s+\d+\s+obj\s*<<', data)
+    if not header or int(header.group(1)) != number:
+        raise Unsupported("bad xref offset")
+    end = data.find(b'endobj', header.end())
+    if end < 0:
+        raise Unsupported("Info object too large")
+    value = re.search(rb'/SourceURL\s*(?=[(<\d])', data[:end])
+    if not value:
+        return None
+    start = value.end()
+    if data[start:start + 1] == b'(':
+        return _text(_literal_string(data, start))
+    if data[start:start + 2] != b'<<' and data[start:start + 1] == b'<':
+        return _text(_hex_string(data, start))
+    raise Unsupported("indirect or non-string value")
+
+
+def read_source_url(file_path):
+    """
+    (source URL or None, whether reading the metadata failed)
+    """
+    try:
+        return read_info_source_url(file_path), False
+    except (Unsupported, OSError, ValueError):
+        pass
+    try:
+        metadata = PdfReader(file_path).metadata or {}
+        # Indexing resolves indirect values, get() does not
+        url = metadata['/SourceURL'] if '/SourceURL' in metadata else None
+        return (str(url) if url is not None else None), False
+    except Exception:
+        return None, True
+
+
+def _load_cache(cache_path):
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_cache(cache, cache_path):
+    # Forget files that no longer exist
+    cache = {path: entry for path, entry in cache.items() if os.path.exists(path)}
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, cache_path)
+
+
+def source_urls(file_paths, workers=None, cache_path=DEFAULT_CACHE):
+    """
+    {file_path: (source URL or None, whether reading the metadata failed)}
+    for file_paths. Cached results are used for files whose size and mtime
+    are unchanged; the rest are read across `workers` processes (default
+    one per CPU). cache_path=None turns the cache off.
+    """
+    cache = _load_cache(cache_path) if cache_path else {}
+    results = {}
+    pending = []
+    for file_path in file_paths:
+        key = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        entry = cache.get(key)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            results[file_path] = (entry['url'], entry['error'])
+        else:
+            pending.append((file_path, key, stat))
+
+    paths = [file_path for file_path, _, _ in pending]
+    if len(paths) < MIN_PARALLEL or workers == 1:
+        extracted = map(read_source_url, paths)
+    else:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            extracted = list(pool.map(read_source_url, paths, chunksize=max(1, len(paths) // (workers * 4))))
+
+    for (file_path, key, stat), (url, error) in zip(pending, extracted):
+        results[file_path] = (url, error)
+        cache[key] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'url': url, 'error': error}
+    if cache_path and pending:
+        _save_cache(cache, cache_path)
+    print(f"PDF metadata: {len(file_paths) - len(pending)} cached, {len(pending)} read")
+    return results
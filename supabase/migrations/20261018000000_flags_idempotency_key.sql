@@ -0,0 +1,4 @@
+-- The backend's flag outbox upserts with on_conflict=idempotency_key, so a
+-- batch re-sent after a lost response is not written twice. Safe to re-run.
+alter table flags add column if not exists idempotency_key text;
+create unique index if not exists flags_idempotency_key on flags (idempotency_key);